@@ -1,124 +1,941 @@
-from flask import Flask, request, Response, send_file, jsonify
+from flask import Flask, Blueprint, request, Response, send_from_directory, jsonify
 import os
-import subprocess  # Still needed for ffprobe
 import math
 import json
+import gzip
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
 from flask_cors import CORS, cross_origin
+from config import (LIBRARY_ROOTS, HLS_DIR, VIDEO_DIR, REMUX_CACHE_DIR, SUPPORTED_INPUT_EXTENSIONS,
+                    METADATA_DB_PATH, library_path, resolve_library_path)
+from metadata_store import MetadataStore, ProbeError
+from catalog import Catalog, InvalidQuery
+from streaming import StreamFile, StreamLimiter, file_range_body
+from http_ranges import (RangeNotSatisfiable, MultipartRangeIterator, parse_range_header,
+                         evaluate_preconditions, if_range_allows, none_match, make_etag,
+                         http_date)
+from thumbnails import THUMBNAIL_DIR
+from chunk_cache import BlockCache, CachedRangeIterator
+from mp4_index import MP4IndexError, gop_range, seek_plan
+from pacing import EgressBudget, ClientThroughput, PacedBody
+from live_remux import LiveRemuxer, SourceIndex, RemuxBody, RemuxUnsupported, RemuxBusy
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Histogram, FunctionMetric
+from request_metrics import RequestMetrics
 
+# Brotli is optional; gzip is used when it isn't installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-app = Flask(__name__)
-cors = CORS(app)
-app.config['CORS_HEADERS'] = 'Content-Type'
 
-# Directory where converted MP4 files are stored
-# The server will ONLY look in this directory for video files.
-CONVERTED_DIR = 'C:\\Users\\himan\\Videos\\Music videos'
+# Routes are registered on this blueprint. The Flask app is built by
+# create_app() (serve.py, gunicorn.conf.py, benchmark.py), so importing this
+# module doesn't open the metadata database, the access log or any directory.
+bp = Blueprint('video_streamer', __name__)
 
-# Ensure the converted directory exists (though the converter script should create it)
-if not os.path.exists(CONVERTED_DIR):
-    os.makedirs(CONVERTED_DIR)
-    print(f"Created directory for converted videos: {CONVERTED_DIR}")
+# Converted MP4 files are stored in the library roots (LIBRARY_ROOTS, see
+# config.py); the server will ONLY look in these directories for video files.
+# Adaptive bitrate output from `convert_videos.py --mode hls` is in HLS_DIR.
 
+# Every HLS encode goes into its own build directory, so segments, init files and
+# variant playlists never change and browsers/CDNs may cache them forever.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# The per-title master playlist is swapped when a title is re-encoded
+MASTER_PLAYLIST_CACHE_CONTROL = 'public, max-age=60'
+HLS_MIME_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',  # fMP4 init segments
+}
 
-@app.route("/")
+# Generated posters, sprite sheets and WebVTT thumbnail tracks (thumbnails.py).
+# File names are content hashes, so they are cached as immutable.
+THUMBNAIL_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.vtt': 'text/vtt',
+}
+
+# Catalog written by getInfo.py, served from memory by /api/videos
+# (another file via VIDEO_STREAMER_CATALOG)
+VIDEOS_JSON_PATH = os.environ.get('VIDEO_STREAMER_CATALOG', os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'videos.json'))
+catalog = Catalog(VIDEOS_JSON_PATH)
+# Clients allowed to trigger /api/catalog/reload
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+# Page size limits for /api/videos
+DEFAULT_PAGE_SIZE = 40
+MAX_PAGE_SIZE = 200
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Hand video responses to the server's wsgi.file_wrapper when it offers one
+# (zero-copy sendfile on gunicorn, non-blocking I/O loop on waitress; see
+# streaming.file_range_body). Set to False for servers whose file wrapper
+# ignores Content-Length.
+USE_WSGI_FILE_WRAPPER = True
+
+# In-process cache of the first CHUNK_CACHE_MAX_OFFSET bytes of videos (moov atom
+# plus the first GOPs, which every viewer of a title requests), shared by all
+# requests. Budget in MiB via VIDEO_STREAMER_CHUNK_CACHE_MB; 0 disables it.
+# Behind a file wrapper it answers the ranges that lie entirely in that head
+# (players probing for the moov box); longer ranges stay zero-copy.
+CHUNK_CACHE_BYTES = int(os.environ.get('VIDEO_STREAMER_CHUNK_CACHE_MB', '256')) * 1024 * 1024
+CHUNK_CACHE_MAX_OFFSET = 8 * 1024 * 1024
+chunk_cache = BlockCache(CHUNK_CACHE_BYTES)
+
+# Seeks: a range starting inside the media data is a seek. With the file's
+# keyframe index (mp4_index.py, stored in the metadata store), a seek asking
+# for no more than the group of pictures it lands in (the range /video_index?t=
+# plans, at most SEEK_CACHE_MAX_BYTES) is served through the block cache, so
+# other viewers seeking to the same spot hit memory. Longer seeks are streamed
+# from disk and the kernel is asked to read ahead SEEK_READAHEAD_BYTES.
+SEEK_CACHE_MAX_BYTES = 4 * 1024 * 1024
+SEEK_READAHEAD_BYTES = 16 * 1024 * 1024
+
+# Maximum number of video streams served at the same time. Further requests get a
+# 503 with Retry-After instead of piling up on the server's worker pool.
+MAX_ACTIVE_STREAMS = int(os.environ.get('VIDEO_STREAMER_MAX_STREAMS', '2000'))
+stream_limiter = StreamLimiter(MAX_ACTIVE_STREAMS)
+
+# Optional pacing (VIDEO_STREAMER_PACING=1): once a stream has sent its first
+# PACING_BURST_SECONDS of video (the player's initial buffer) at full speed,
+# the rest goes at PACING_RATE_MULTIPLIER times the title's bitrate (from the
+# metadata store), so clients prefetching with 'bytes=0-' can't hog the uplink.
+# Titles whose bitrate isn't known yet aren't paced.
+PACING_ENABLED = os.environ.get('VIDEO_STREAMER_PACING', '').lower() in ('1', 'true', 'yes')
+PACING_RATE_MULTIPLIER = float(os.environ.get('VIDEO_STREAMER_PACING_MULTIPLIER', '2.0'))
+PACING_BURST_SECONDS = float(os.environ.get('VIDEO_STREAMER_PACING_BURST_SECONDS', '30'))
+# Global egress budget in Mbit/s per server process (VIDEO_STREAMER_EGRESS_MBPS,
+# 0 = unlimited), shared max-min fair by the active streams (see pacing.py).
+# Paced or budgeted streams are sent in chunks from Python rather than with
+# the zero-copy file wrapper, and hold a worker thread while they wait.
+EGRESS_BUDGET_MBPS = float(os.environ.get('VIDEO_STREAMER_EGRESS_MBPS', '0'))
+egress_budget = EgressBudget(EGRESS_BUDGET_MBPS * 1000 * 1000 / 8)
+# Bytes and throughput per client address, served on /api/clients
+client_throughput = ClientThroughput()
+
+# Sources in VIDEO_DIR that aren't converted yet are remuxed on the fly
+# (ffmpeg stream copy to fragmented MP4, see live_remux.py) by at most
+# MAX_LIVE_REMUXES processes at a time. The output is kept in REMUX_CACHE_DIR
+# (up to REMUX_CACHE_MAX_GB) and later viewers are served from there.
+MAX_LIVE_REMUXES = int(os.environ.get('VIDEO_STREAMER_MAX_REMUXES', '2'))
+REMUX_CACHE_MAX_BYTES = int(float(os.environ.get('VIDEO_STREAMER_REMUX_CACHE_GB', '20')) * 1024 ** 3)
+live_remuxer = LiveRemuxer(REMUX_CACHE_DIR, MAX_LIVE_REMUXES, REMUX_CACHE_MAX_BYTES)
+# Sources are found by file name in memory; VIDEO_DIR is only rescanned for
+# names it doesn't know yet (at most every SOURCE_RESCAN_INTERVAL seconds)
+source_index = SourceIndex(VIDEO_DIR, SUPPORTED_INPUT_EXTENSIONS)
+
+# Persistent ffprobe results keyed by path, size and mtime, so /video_info only
+# spawns ffprobe the first time a file (or a changed version of it) is seen.
+# Opened by create_app() at config.METADATA_DB_PATH (VIDEO_STREAMER_METADATA_DB).
+metadata_store = None
+
+# Request metrics (latency, TTFB, bytes per route and title) served on /metrics.
+# A sampled JSON lines access log is written when VIDEO_STREAMER_ACCESS_LOG is
+# set to a path ('-' for stdout); VIDEO_STREAMER_ACCESS_LOG_SAMPLE is the share
+# of requests logged.
+ACCESS_LOG_PATH = os.environ.get('VIDEO_STREAMER_ACCESS_LOG')
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('VIDEO_STREAMER_ACCESS_LOG_SAMPLE', '0.01'))
+request_metrics = None
+
+# Startup warm-up (see create_app): the stored metadata of every catalog title
+# is loaded into memory, and the WARM_TITLES most viewed titles (topped up in
+# catalog order) are probed if needed, indexed, and have their cached regions
+# (moov box and first GOPs) read into the block cache, filling at most
+# WARM_CACHE_SHARE of it. /ready answers 503 until this is done.
+WARM_TITLES = int(os.environ.get('VIDEO_STREAMER_WARM_TITLES', '20'))
+WARM_CACHE_SHARE = 0.5
+# Views are counted per stream start (no Range, or one starting at byte 0) and
+# added to the metadata store's totals at most every VIEW_FLUSH_INTERVAL seconds
+VIEW_FLUSH_INTERVAL = 60.0
+warm_state = {"ready": False, "started": None, "seconds": None, "titles": 0}
+_pending_views = Counter()
+_views_lock = threading.Lock()
+_last_view_flush = time.monotonic()
+_app = None
+_app_lock = threading.Lock()
+
+# Size of the byte ranges /video serves, by kind of response (full, single, multipart)
+RANGE_SIZE_BUCKETS = tuple(2 ** power for power in range(10, 32, 2))  # 1 KiB .. 1 GiB
+video_range_bytes = Histogram(
+    'video_range_bytes', 'Bytes requested per /video response, by kind.', ['kind'],
+    buckets=RANGE_SIZE_BUCKETS)
+FunctionMetric('video_active_streams', 'Video streams being served right now.',
+               lambda: stream_limiter.active)
+FunctionMetric('video_stream_limit', 'Maximum number of concurrent video streams.',
+               lambda: stream_limiter.limit)
+FunctionMetric('chunk_cache_lookups_total', 'Hot-chunk cache lookups for /video by result.',
+               lambda: {('hit',): chunk_cache.hits, ('miss',): chunk_cache.misses},
+               'counter', ['result'])
+FunctionMetric('chunk_cache_bytes', 'Memory used by the hot-chunk cache.',
+               lambda: chunk_cache.stats()['bytes'])
+FunctionMetric('metadata_lookups_total',
+               'Metadata lookups for /video_info by where they were answered from.',
+               lambda: {('memory',): metadata_store.memory_hits, ('db',): metadata_store.db_hits,
+                        ('probe',): metadata_store.probes},
+               'counter', ['source'])
+FunctionMetric('catalog_videos', 'Videos in the loaded catalog.',
+               lambda: len(catalog.snapshot().videos))
+FunctionMetric('video_paced_streams', 'Video streams sent through the pacer.',
+               lambda: egress_budget.active)
+FunctionMetric('video_egress_budget_bytes_per_second',
+               'Global egress budget for video streams (0 = unlimited).',
+               lambda: egress_budget.bytes_per_second or 0)
+FunctionMetric('video_clients', 'Client addresses streamed to recently.',
+               lambda: len(client_throughput))
+FunctionMetric('video_live_remuxes', 'Live remux processes running.',
+               lambda: live_remuxer.active)
+FunctionMetric('server_ready', 'Whether the startup warm-up has finished (1) or not (0).',
+               lambda: int(warm_state["ready"]))
+
+
+def create_app(warm=True):
+    """
+    Builds the Flask app (once per process; later calls return the same app):
+    opens the metadata store and the request metrics, registers the routes
+    and, with warm=True, starts the warm-up in a background thread so the
+    server can accept connections right away and report progress on /ready.
+    Missing library roots are reported, not created; the converter creates them.
+    """
+    global _app, metadata_store, request_metrics
+    with _app_lock:
+        if _app is not None:
+            return _app
+
+        for name, directory in LIBRARY_ROOTS.items():
+            if not os.path.isdir(directory):
+                print(f"Warning: library root '{name}' ({directory}) does not exist")
+
+        app = Flask(__name__)
+        CORS(app)
+        app.config['CORS_HEADERS'] = 'Content-Type'
+        app.register_blueprint(bp)
+
+        metadata_store = MetadataStore(METADATA_DB_PATH)
+        request_metrics = RequestMetrics(app.wsgi_app, access_log=ACCESS_LOG_PATH,
+                                         sample_rate=ACCESS_LOG_SAMPLE_RATE)
+        app.wsgi_app = request_metrics
+        request_metrics.init_app(app)
+
+        warm_state["started"] = time.monotonic()
+        if warm:
+            threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+        else:
+            catalog.reload()
+            warm_state["ready"] = True
+        _app = app
+        return app
+
+
+def warm_up():
+    """
+    Startup phase run by create_app(): loads the catalog, the names of the
+    sources awaiting conversion and the stored metadata, then warms the most
+    viewed titles (see WARM_TITLES). Errors on single titles are skipped; the
+    server is marked ready either way.
+    """
+    try:
+        snapshot = catalog.reload()
+        source_index.refresh()
+        paths = []
+        for video in snapshot.videos:
+            if video.get('root') and video.get('path'):
+                video_path = resolve_library_path(library_path(video['root'], video['path']))
+                if video_path is not None:
+                    paths.append(os.path.abspath(video_path))
+        loaded = metadata_store.preload(paths)
+        print(f"Loaded stored metadata of {loaded}/{len(paths)} catalog video(s)")
+
+        catalog_paths = set(paths)
+        warm_paths = [path for path in metadata_store.most_viewed(WARM_TITLES * 2)
+                      if path in catalog_paths][:WARM_TITLES]
+        for path in paths:
+            if len(warm_paths) >= WARM_TITLES:
+                break
+            if path not in warm_paths:
+                warm_paths.append(path)
+
+        warmed = 0
+        for video_path in warm_paths:
+            cache_full = chunk_cache.stats()['bytes'] >= chunk_cache.max_bytes * WARM_CACHE_SHARE
+            if chunk_cache.enabled and cache_full:
+                break
+            if warm_title(video_path):
+                warmed += 1
+        warm_state["titles"] = warmed
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warm-up failed: {e}")
+    finally:
+        warm_state["seconds"] = round(time.monotonic() - warm_state["started"], 3)
+        warm_state["ready"] = True
+        print(f"Warm-up finished in {warm_state['seconds']}s ({warm_state['titles']} title(s) warmed)")
+
+
+def warm_title(video_path):
+    """Probes, indexes and caches the head of one video. Returns False if it can't be read."""
+    try:
+        metadata_store.get(video_path)
+    except ProbeError as e:
+        print(f"ffprobe error for '{os.path.basename(video_path)}': {e.details}")
+    except FileNotFoundError:
+        if not os.path.isfile(video_path):
+            return False
+        # ffprobe isn't installed: the index and the cache still help
+    index = lookup_video_index(video_path)
+    if not chunk_cache.enabled:
+        return True
+    try:
+        with open(video_path, 'rb') as video_file:
+            st = os.fstat(video_file.fileno())
+            version = (st.st_mtime_ns, st.st_size)
+            for start, end in cached_regions(index, 0, st.st_size):
+                end = min(end, st.st_size)
+                for _ in chunk_cache.iter_range(video_file, video_path, version, start, end - start):
+                    pass
+    except OSError:
+        return False
+    return True
+
+
+def count_view(video_path):
+    """Counts a stream start of video_path; flushes the counts when they are due."""
+    global _last_view_flush
+    now = time.monotonic()
+    with _views_lock:
+        _pending_views[video_path] += 1
+        if now - _last_view_flush < VIEW_FLUSH_INTERVAL:
+            return
+        _last_view_flush = now
+    flush_views()
+
+
+def flush_views():
+    """Adds the views counted since the last flush to the metadata store (serve.py calls this on shutdown)."""
+    with _views_lock:
+        counts = dict(_pending_views)
+        _pending_views.clear()
+    if not counts or metadata_store is None:
+        return
+    try:
+        metadata_store.record_views(counts)
+    except sqlite3.Error as e:
+        print(f"Could not record view counts: {e}")
+
+
+@bp.route("/")
 @cross_origin()
 def hello():
     return "Application is running"
 
 
-@app.route('/video/<filename>')
+@bp.route("/ready")
+def ready():
+    """
+    Readiness for load balancers: 200 once the startup warm-up has finished,
+    503 (with Retry-After) while it runs and while the server is draining.
+    """
+    body = {
+        "ready": warm_state["ready"] and not stream_limiter.draining,
+        "draining": stream_limiter.draining,
+        "warm_up_seconds": warm_state["seconds"],
+        "warmed_titles": warm_state["titles"],
+    }
+    if body["ready"]:
+        return jsonify(body)
+    response = jsonify(body)
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@bp.route('/video/<filename>')
 @cross_origin()
 def stream_video(filename):
     """
-    Streams MP4 video files from the converted directory using range requests.
-    Assumes files in CONVERTED_DIR are already MP4.
+    Streams MP4 video files from the library roots using range requests.
+    Sources that aren't converted yet (a SUPPORTED_INPUT_EXTENSIONS file in
+    VIDEO_DIR, requested by its own name) are remuxed on the fly, see
+    stream_live; once converted, their MP4 is served instead.
     """
-    # Ensure the requested file has an .mp4 extension
-    if not filename.lower().endswith('.mp4'):
+    filename_base, extension = os.path.splitext(filename)
+    extension = extension.lower()
+    if extension in SUPPORTED_INPUT_EXTENSIONS:
+        video_path = resolve_video_path(f"{filename_base}.mp4")
+        if video_path is None:
+            return stream_live(filename)
+    elif extension != '.mp4':
         # 415 Unsupported Media Type
-        return "Only MP4 files are supported for streaming.", 415
-
-    video_path = os.path.join(CONVERTED_DIR, filename)
+        return "Only MP4 files (and sources awaiting conversion) are supported for streaming.", 415
+    else:
+        video_path = resolve_video_path(filename)
 
     # Check if the converted MP4 file exists
-    if not os.path.exists(video_path):
+    if video_path is None:
         # Provide a more informative error if the file isn't found in the converted directory
         # This might indicate the conversion script hasn't been run for the original file.
         return f"Converted file '{filename}' not found. Please ensure the original video has been converted.", 404
 
-    range_header = request.headers.get('Range', None)
-    file_size = os.path.getsize(video_path)
+    # Bound the number of concurrent streams; the slot is held until the
+    # response body has been sent (or the client disconnects).
+    if not stream_limiter.try_acquire():
+        return too_many_streams()
 
-    # --- Streaming Logic (Handles Range Requests for MP4) ---
-    if range_header:
-        # Parse the Range header sent by the browser
-        byte_range = range_header.replace('bytes=', '').split('-')
-        start = int(byte_range[0])
-        end = int(byte_range[1]) if len(
-            byte_range) > 1 and byte_range[1] else file_size - 1
+    try:
+        video_file = StreamFile(video_path)
+    except IOError:
+        stream_limiter.release()
+        return "Error opening video file", 500
+    track_stream(video_file, filename)
+    if request.headers.get('Range', 'bytes=0-').replace(' ', '').startswith('bytes=0-'):
+        count_view(os.path.abspath(video_path))
+
+    try:
+        return build_stream_response(video_file)
+    except BaseException:
+        video_file.close()
+        raise
+
+
+def too_many_streams():
+    response = Response("Too many active streams, please retry shortly.", 503)
+    response.headers['Retry-After'] = '2'
+    return response
 
-        chunk_size = end - start + 1
 
+def track_stream(video_file, title):
+    """
+    Ties the per-stream bookkeeping to the lifetime of an open video file:
+    closing it (end of transfer, client gone, or error) frees the stream slot
+    and finishes the client statistics and request metrics.
+    """
+    video_file.call_on_close(stream_limiter.release)
+    client = request.remote_addr
+    client_throughput.stream_started(client)
+    video_file.call_on_close(lambda: client_throughput.stream_finished(client))
+    record = RequestMetrics.current(request.environ)
+    if record is not None:
+        record.title = title
+        record.finish_on_close(video_file)
+
+
+def stream_live(filename):
+    """
+    Streams a source that hasn't been converted yet. The first viewer starts
+    an ffmpeg stream copy into fragmented MP4 (live_remux.py) and gets its
+    output as it is produced: a 200 response without a length, Range ignored,
+    so the player can't seek past what has been remuxed. Viewers arriving
+    while it runs follow the same process. Once it has finished, the remux is
+    a cached file and is streamed like any converted MP4, with ranges.
+    Sources whose video isn't H.264 get a 415: they need the batch converter.
+    """
+    source_path = source_index.find(filename)
+    if source_path is None:
+        return f"Video '{filename}' not found.", 404
+    try:
+        st = os.stat(source_path)
+    except OSError:
+        return f"Video '{filename}' not found.", 404
+
+    cached = live_remuxer.cached_path(source_path, st)
+    if cached is None:
         try:
-            with open(video_path, 'rb') as f:
-                f.seek(start)
-                data = f.read(chunk_size)
+            # Probed once, then answered from the metadata store. The codecs are
+            # all the remux needs, so the keyframe pass over the file is skipped.
+            info = metadata_store.get(source_path, with_keyframes=False)
+        except ProbeError as e:
+            print(f"ffprobe error for '{filename}': {e.details}")
+            return "Could not read video for live streaming.", 500
+        except FileNotFoundError:
+            return "ffprobe command not found", 500
+
+    if not stream_limiter.try_acquire():
+        return too_many_streams()
 
-            response = Response(data, 206)  # 206 Partial Content
+    remux = None
+    try:
+        if cached is None:
+            # None: the remux finished since cached_path was checked
+            remux = live_remuxer.open(source_path, st, info)
+        video_file = StreamFile(live_remuxer.cache_path(source_path, st))
+    except RemuxUnsupported:
+        stream_limiter.release()
+        return f"'{filename}' can't be streamed before it has been converted.", 415
+    except RemuxBusy:
+        stream_limiter.release()
+        response = Response("Too many videos being prepared, please retry shortly.", 503)
+        response.headers['Retry-After'] = '10'
+        return response
+    except OSError as e:
+        stream_limiter.release()
+        print(f"Could not start live remux of '{filename}': {e}")
+        return "Error preparing video", 500
+    track_stream(video_file, filename)
+
+    if remux is None:
+        try:
+            return build_stream_response(video_file)
+        except BaseException:
+            video_file.close()
+            raise
+
+    body = RemuxBody(remux, video_file)
+    client = request.remote_addr
+    video_file.call_on_close(lambda: client_throughput.add_bytes(client, body.bytes_sent))
+    response = Response(body, 200, mimetype='video/mp4', direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'none'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def resolve_video_path(filename):
+    """
+    Finds a converted MP4 in the library roots. The catalog records which
+    root (and which path in it) holds each title, so this is a lookup in the
+    in-memory catalog and a single stat on that disk. A file the catalog
+    doesn't know yet (or that moved since it was built) is looked for at the
+    top of every root. Returns the file's path, or None if it isn't found.
+    """
+    video = catalog.snapshot().by_filename.get(filename)
+    if video is not None and video.get('root') and video.get('path'):
+        video_path = resolve_library_path(library_path(video['root'], video['path']))
+        if video_path is not None and os.path.isfile(video_path):
+            return video_path
+    for directory in LIBRARY_ROOTS.values():
+        video_path = os.path.join(directory, filename)
+        if os.path.isfile(video_path):
+            return video_path
+    return None
+
+
+def lookup_video_index(video_path):
+    """The keyframe index of a video from the metadata store, or None if it can't be indexed."""
+    try:
+        return metadata_store.get_mp4_index(video_path)
+    except (MP4IndexError, OSError):
+        return None
+
+
+def readahead(video_file, start, length):
+    """Asks the kernel to start reading a byte range into the page cache (where supported)."""
+    if hasattr(os, 'posix_fadvise') and length > 0:
+        try:
+            os.posix_fadvise(video_file.fileno(), start, length, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+
+def cached_regions(index, start, end):
+    """
+    Byte regions of a video served through the block cache for the range
+    [start, end): the head of the file (extended to the end of the moov box
+    for faststart files whose moov is larger than CHUNK_CACHE_MAX_OFFSET), the
+    moov box of files that keep it at the end, and, for a seek that stays
+    within the group of pictures it lands in, the range itself.
+    """
+    if index is None:
+        return [(0, CHUNK_CACHE_MAX_OFFSET)]
+    moov_start = index["moov"]["offset"]
+    moov_end = moov_start + index["moov"]["size"]
+    head_end = max(CHUNK_CACHE_MAX_OFFSET, moov_end) if index["faststart"] else CHUNK_CACHE_MAX_OFFSET
+    regions = [(0, head_end)]
+    if not index["faststart"]:
+        regions.append((max(head_end, moov_start), moov_end))
+    if start >= head_end and not moov_start <= start < moov_end:
+        gop = gop_range(index, start)
+        if gop is not None and end <= min(gop[1], start + SEEK_CACHE_MAX_BYTES):
+            regions.append((start, end))
+    return sorted(region for region in regions if region[0] < region[1])
+
+
+def stream_pacing(video_path, st):
+    """
+    How a stream of video_path is paced: (rate limit in bytes per second or
+    None, bytes sent before the limit applies), or None if the stream isn't
+    paced and no egress budget is set.
+    """
+    if not PACING_ENABLED:
+        return (None, 0) if egress_budget.enabled else None
+    try:
+        info = metadata_store.lookup(video_path, st)
+    except OSError:
+        info = None
+    bit_rate = (info or {}).get('bit_rate')
+    if not bit_rate:
+        return (None, 0) if egress_budget.enabled else None
+    bytes_per_second = bit_rate / 8
+    return bytes_per_second * PACING_RATE_MULTIPLIER, int(bytes_per_second * PACING_BURST_SECONDS)
+
+
+def covered_by(regions, start, end):
+    """True if the byte range [start, end) lies entirely inside the (sorted) regions."""
+    position = start
+    for region_start, region_end in regions:
+        if region_start <= position < region_end:
+            position = region_end
+        if position >= end:
+            return True
+    return False
+
+
+def video_range_body(video_file, start, length, index=None, use_file_wrapper=USE_WSGI_FILE_WRAPPER):
+    """
+    Response body for one byte range of a video. With the server's zero-copy
+    file wrapper (unless use_file_wrapper is False), only ranges lying entirely
+    in the cached regions (see cached_regions) are answered from the block
+    cache; everything else, full GETs and 'bytes=0-' included, is left to the
+    file wrapper, so the transfer doesn't hold a worker thread. Without a file
+    wrapper the body is iterated in Python anyway, so the parts of the range in
+    the cached regions go through the cache and the rest continues from disk.
+    Seeks streamed from disk also get a read-ahead hint.
+    """
+    if not chunk_cache.enabled:
+        return file_range_body(request.environ, video_file, start, length, use_file_wrapper)
+    end = start + length
+    regions = cached_regions(index, start, end)
+    if index is not None and start >= regions[0][1] and not covered_by(regions, start, end):
+        # A seek streamed from disk: have the kernel read ahead of the player
+        readahead(video_file, start, min(length, SEEK_READAHEAD_BYTES))
+    if use_file_wrapper and 'wsgi.file_wrapper' in request.environ:
+        use_cache = covered_by(regions, start, end)
+    else:
+        use_cache = any(region_start < end and start < region_end
+                        for region_start, region_end in regions)
+    if use_cache:
+        return CachedRangeIterator(chunk_cache, video_file, start, length, regions)
+    return file_range_body(request.environ, video_file, start, length, use_file_wrapper)
+
+
+def build_stream_response(video_file):
+    """
+    Builds the response for an open MP4 file following RFC 7232/7233:
+    conditional requests (ETag, Last-Modified, 304/412), If-Range, single and
+    suffix ranges (206), multiple ranges (206 multipart/byteranges) and
+    unsatisfiable ranges (416). The response body takes ownership of
+    video_file and closes it when the transfer ends; responses without a body
+    close it right away.
+    """
+    st = os.fstat(video_file.fileno())
+    file_size = st.st_size
+    etag = make_etag(st)
+
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+
+    # Cached clients and proxies revalidate without transferring anything
+    status = evaluate_preconditions(request.headers, etag, st.st_mtime)
+    if status is not None:
+        video_file.close()
+        return Response(status=status, headers=validators)
+
+    # --- Streaming Logic (Handles Range Requests for MP4) ---
+    ranges = None
+    range_header = request.headers.get('Range', None)
+    if range_header and if_range_allows(request.headers.get('If-Range'), etag, st.st_mtime):
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            video_file.close()
+            response = Response("Requested range not satisfiable", 416, headers=validators)
+            response.headers['Content-Range'] = f'bytes */{file_size}'
+            return response
+
+    # Keyframe index (moov location, GOP boundaries) for cache and read-ahead planning
+    index = lookup_video_index(video_file.name)
+    # Paced streams are sent in chunks, so the file wrapper can't be used
+    pacing = stream_pacing(video_file.name, st)
+    use_file_wrapper = USE_WSGI_FILE_WRAPPER and pacing is None
+
+    try:
+        if not ranges:
+            # No (usable) Range header: serve the whole file, streamed in chunks
+            body = video_range_body(video_file, 0, file_size, index, use_file_wrapper)
+            video_range_bytes.observe(file_size, kind='full')
+            response = Response(body, 200, mimetype='video/mp4', direct_passthrough=True)
+            response.headers['Content-Length'] = file_size
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            chunk_size = end - start + 1
+            # The file stays open while the body is streamed and is closed by
+            # the body once the transfer finishes or the client goes away.
+            body = video_range_body(video_file, start, chunk_size, index, use_file_wrapper)
+            video_range_bytes.observe(chunk_size, kind='single')
+
+            # direct_passthrough stops Werkzeug from buffering the body
+            response = Response(body, 206, direct_passthrough=True)  # 206 Partial Content
             response.headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
             response.headers['Content-Length'] = chunk_size
             response.headers['Content-Type'] = 'video/mp4'  # Always video/mp4
-            response.headers['Accept-Ranges'] = 'bytes'
-            return response
+        else:
+            # Several ranges in one response, each part read straight from the file
+            body = MultipartRangeIterator(video_file, ranges, file_size, 'video/mp4')
+            video_range_bytes.observe(sum(end - start + 1 for start, end in ranges), kind='multipart')
+            response = Response(body, 206, direct_passthrough=True)
+            response.headers['Content-Type'] = body.content_type
+            response.headers['Content-Length'] = body.content_length
+
+    except IOError:
+        video_file.close()
+        return Response("Error reading file chunk", 500)
 
-        except IOError:
-            return "Error reading file chunk", 500
+    client = request.remote_addr
+    if pacing is not None:
+        rate_limit, burst_bytes = pacing
+        response.response = PacedBody(response.response, client, client_throughput,
+                                       egress_budget, rate_limit, burst_bytes)
     else:
-        # If no Range header, serve the whole file (or the beginning).
-        response = send_file(video_path, mimetype='video/mp4')
-        response.headers['Accept-Ranges'] = 'bytes'
+        # Zero-copy bodies can't be counted as they go; count them when done
+        length = int(response.headers['Content-Length'])
+        video_file.call_on_close(lambda: client_throughput.add_bytes(client, length))
+
+    response.headers.update(validators)
+    return response
+
+
+def compressed_json_response(body, etag):
+    """
+    Builds a JSON response from an already-serialised body, compressed with
+    brotli or gzip depending on the client's Accept-Encoding.
+    """
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        if brotli is not None and 'br' in accept_encoding:
+            body = brotli.compress(body, quality=5)
+            encoding = 'br'
+        elif 'gzip' in accept_encoding:
+            body = gzip.compress(body, compresslevel=6)
+            encoding = 'gzip'
+
+    response = Response(body, 200, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate; 304s are cheap
+    return response
+
+
+@bp.route('/api/videos')
+@cross_origin()
+def list_videos():
+    """
+    Paginated, searchable catalog served from memory.
+
+    Query parameters:
+      q       case-insensitive substring filter on the title
+      prefix  word prefix filter on the title
+      sort    'title' (default) or 'id'
+      order   'asc' (default) or 'desc'
+      cursor  next_cursor value from the previous page
+      limit   page size (default DEFAULT_PAGE_SIZE, max MAX_PAGE_SIZE)
+    """
+    snapshot = catalog.snapshot()
+
+    # The ETag only depends on the catalog version and the query, so
+    # revalidations are answered without running the query at all.
+    query_hash = hashlib.sha1(request.query_string).hexdigest()[:16]
+    etag = f'"{snapshot.version}-{query_hash}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+        response.headers['ETag'] = etag
         return response
 
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    try:
+        items, next_cursor, total = snapshot.query(
+            search=request.args.get('q') or None,
+            prefix=request.args.get('prefix') or None,
+            sort=request.args.get('sort', 'title'),
+            descending=request.args.get('order', 'asc') == 'desc',
+            cursor=request.args.get('cursor') or None,
+            limit=limit)
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = json.dumps({
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": total,
+    }, ensure_ascii=False).encode('utf-8')
+    return compressed_json_response(body, etag)
+
 
-@app.route('/video_info/<filename>')
+@bp.route('/hls/<path:asset>')
+@cross_origin()
+def serve_hls(asset):
+    """
+    Serves HLS playlists, init files and segments from HLS_DIR with CDN-friendly
+    cache headers: the top-level master playlist (<title>/master.m3u8) is short
+    lived, everything inside a build directory is immutable.
+    """
+    extension = os.path.splitext(asset)[1].lower()
+    mimetype = HLS_MIME_TYPES.get(extension)
+    if mimetype is None:
+        return "Unsupported HLS asset.", 415
+
+    # send_from_directory rejects paths escaping HLS_DIR and returns 404 for missing files
+    response = send_from_directory(HLS_DIR, asset, mimetype=mimetype, conditional=True)
+    is_master = asset.count('/') == 1 and asset.endswith('/master.m3u8')
+    response.headers['Cache-Control'] = (
+        MASTER_PLAYLIST_CACHE_CONTROL if is_master else IMMUTABLE_CACHE_CONTROL)
+    return response
+
+
+@bp.route('/thumbs/<path:asset>')
+@cross_origin()
+def serve_thumbnail(asset):
+    """
+    Serves generated posters, sprite sheets and thumbnail tracks from
+    THUMBNAIL_DIR. Names are content-hashed, so they never change.
+    """
+    mimetype = THUMBNAIL_MIME_TYPES.get(os.path.splitext(asset)[1].lower())
+    if mimetype is None:
+        return "Unsupported thumbnail asset.", 415
+
+    response = send_from_directory(THUMBNAIL_DIR, asset, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@bp.route('/api/cache_stats')
+@cross_origin()
+def cache_stats():
+    """Hit/miss counters and memory use of the hot-chunk cache."""
+    return jsonify(chunk_cache.stats())
+
+
+@bp.route('/api/clients')
+def client_stats():
+    """
+    Per-client streaming statistics: active and total streams, bytes sent and
+    current throughput (bytes per second) by client address, plus the pacing
+    settings. Only answered for this machine, as it lists client addresses.
+    """
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "client statistics are only available from localhost"}), 403
+    return jsonify({
+        "clients": client_throughput.snapshot(),
+        "paced_streams": egress_budget.active,
+        "egress_budget_bytes_per_second": egress_budget.bytes_per_second,
+        "pacing": {
+            "enabled": PACING_ENABLED,
+            "rate_multiplier": PACING_RATE_MULTIPLIER,
+            "burst_seconds": PACING_BURST_SECONDS,
+        },
+    })
+
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus metrics of this process (request, stream and cache statistics)."""
+    return Response(REGISTRY.render(), 200, content_type=METRICS_CONTENT_TYPE)
+
+
+@bp.route('/api/catalog/reload', methods=['POST'])
+def reload_catalog():
+    """
+    Re-reads videos.json right away (watcher.py calls this after updating it).
+    Only accepted from this machine; everyone else gets 403.
+    """
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "reload is only allowed from localhost"}), 403
+    snapshot = catalog.reload()
+    return jsonify({"version": snapshot.version, "videos": len(snapshot.videos)})
+
+
+@bp.route('/video_index/<filename>')
+@cross_origin()
+def get_video_index(filename):
+    """
+    Keyframe index of a converted MP4 (see mp4_index.build_index): where the
+    moov and mdat boxes are and a time -> byte offset table of every keyframe,
+    so a client can turn a seek into a single exact Range request.
+    With ?t=SECONDS only the plan for that seek is returned: the keyframe
+    time and the byte range of its group of pictures (which the server then
+    starts reading ahead).
+    """
+    if not filename.lower().endswith('.mp4'):
+        return jsonify({"error": "Only MP4 files are supported for indexing."}), 415
+
+    video_path = resolve_video_path(filename)
+    try:
+        if video_path is None:
+            raise FileNotFoundError(filename)
+        st = os.stat(video_path)
+        index = metadata_store.get_mp4_index(video_path)
+    except FileNotFoundError:
+        return jsonify({"error": f"Converted file '{filename}' not found."}), 404
+    except MP4IndexError as e:
+        return jsonify({"error": "Could not index video", "details": str(e)}), 422
+
+    seconds = request.args.get('t')
+    plan = None
+    if seconds is not None:
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            return jsonify({"error": "t must be a number of seconds"}), 400
+        plan = seek_plan(index, seconds)
+        if plan is None:
+            return jsonify({"error": "Video has no keyframe index"}), 422
+
+    # Changes whenever the file does and differs per keyframe (every t that
+    # resolves to the same keyframe gets the same plan, so the same tag)
+    etag = make_etag(st)[:-1] + (f'-k{plan["start"]:x}"' if plan is not None else '"')
+    if none_match(request.headers.get('If-None-Match'), etag):
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        return response
+
+    if plan is None:
+        body = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        return compressed_json_response(body, etag)
+
+    with open(video_path, 'rb') as video_file:
+        readahead(video_file, plan["start"], plan["end"] + 1 - plan["start"])
+    return compressed_json_response(json.dumps(plan).encode('utf-8'), etag)
+
+
+@bp.route('/video_info/<filename>')
 @cross_origin()
 def get_video_info(filename):
     """
-    Gets video metadata (like duration) using ffprobe from the converted directory.
-    Assumes files in CONVERTED_DIR are already MP4.
+    Gets video metadata (duration, codecs, resolution, bitrate, keyframe count)
+    from the metadata store, probing with ffprobe only on first sight.
+    Assumes files in the library are already MP4.
     """
     # Ensure the requested file has an .mp4 extension
     if not filename.lower().endswith('.mp4'):
         return jsonify({"error": "Only MP4 files are supported for info."}), 415
 
-    video_path = os.path.join(CONVERTED_DIR, filename)
+    video_path = resolve_video_path(filename)
 
-    if not os.path.exists(video_path):
+    if video_path is None:
         # Provide a more informative error if the file isn't found
         return jsonify({"error": f"Converted file '{filename}' not found. Please ensure the original video has been converted."}), 404
 
     try:
-        # Use ffprobe to get the duration
-        ffprobe_command = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            '-i', video_path  # Probe the file in the converted directory
-        ]
-
-        process = subprocess.run(
-            ffprobe_command, capture_output=True, text=True, check=True)
-
-        duration_str = process.stdout.strip()
-        duration = float(duration_str)
-
-        return jsonify({"duration": duration})
-
-    except subprocess.CalledProcessError as e:
-        print(f"ffprobe error (stdout): {e.stdout}")
-        print(f"ffprobe error (stderr): {e.stderr}")
-        return jsonify({"error": "Could not get video info", "details": e.stderr.strip()}), 500
+        # Served from the metadata cache; ffprobe only runs for new or changed files
+        info = metadata_store.get(video_path)
+        return jsonify(info)
+
+    except ProbeError as e:
+        print(f"ffprobe error for '{filename}': {e.details}")
+        return jsonify({"error": "Could not get video info", "details": e.details}), 500
     except FileNotFoundError:
         print("Error: ffprobe command not found.")
         print("Please ensure ffmpeg (which includes ffprobe) is installed and accessible in your system's PATH.")
@@ -129,10 +946,5 @@ def get_video_info(filename):
 
 
 if __name__ == '__main__':
-    # Ensure the converted directory exists on server startup as well
-    if not os.path.exists(CONVERTED_DIR):
-        os.makedirs(CONVERTED_DIR)
-        print(f"Created directory for converted videos: {CONVERTED_DIR}")
-
     # Run the Flask development server
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,520 @@
+# Load test / benchmark for the streaming server:
+#
+#   python server/benchmark.py [--server waitress|gunicorn|flask] [--viewers 32]
+#                              [--phase-seconds 20] [--compare old_result.json]
+#
+# Generates MP4 fixtures (encoded with ffmpeg when it is installed, otherwise
+# synthetic files with the same box layout), starts the server on them in a
+# child process and replays typical viewer behaviour in phases:
+#
+#   start       bytes=0- and the first few MiB, then the player aborts
+#   moov_probe  the first 64 KiB plus the last 64 KiB (players looking for moov)
+#   seek        bytes=<random>- and a couple of MiB, then abort
+#   hot_title   every viewer reads the same title sequentially in 1 MiB ranges
+#   video_info  /video_info lookups
+#
+# For each phase it reports throughput, p50/p99 time to first byte and errors,
+# and it samples the server's RSS and open file descriptors (Linux /proc) while
+# the phases run. Results are written as JSON; --compare prints the change
+# against an earlier result so regressions show up between versions. A phase
+# with failed requests aborts the run: its numbers wouldn't mean anything.
+#
+# The server gets its own metadata database and catalog in a temporary
+# directory, so benchmarks never touch the real library's state. Synthetic
+# fixtures can't be probed by ffprobe, so video_info is skipped for them.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import struct
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SERVER_DIR)
+
+# Where fixtures are generated (and reused by later runs with the same settings)
+DEFAULT_FIXTURE_DIR = os.path.join(tempfile.gettempdir(), 'video-streamer-bench')
+# Where results are written
+DEFAULT_RESULTS_DIR = os.path.join(REPO_DIR, 'benchmark_results')
+
+# Fixtures: (name, seconds) encoded at FIXTURE_BITRATE with ffmpeg, or
+# synthetic files of the equivalent size
+FIXTURES = [('bench-short', 30), ('bench-medium', 120), ('bench-long', 600)]
+FIXTURE_BITRATE_KBPS = 4000
+
+# Bytes read per request by the viewer patterns
+START_READ_BYTES = 4 * 1024 * 1024
+PROBE_BYTES = 64 * 1024
+SEEK_READ_BYTES = 2 * 1024 * 1024
+HOT_RANGE_BYTES = 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+PHASES = ['start', 'moov_probe', 'seek', 'hot_title', 'video_info']
+# How often the server's RSS and file descriptors are sampled
+SAMPLE_INTERVAL = 0.5
+# --compare flags changes bigger than this (relative) as regressions
+REGRESSION_THRESHOLD = 0.10
+
+
+# --- Fixtures ---
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def write_synthetic_mp4(path, size, rng):
+    """
+    Writes a file with the box layout of a faststart MP4 (ftyp, moov, mdat)
+    whose moov and mdat are filled with random bytes. The server never decodes
+    video, so this exercises it like a real file of the same size would.
+    """
+    ftyp = _box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    moov = _box(b'moov', _box(b'free', rng.randbytes(max(0, size // 1000))))
+    mdat_payload = size - len(ftyp) - len(moov) - 8
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        f.write(moov)
+        f.write(struct.pack('>I4s', 8 + mdat_payload, b'mdat'))
+        remaining = mdat_payload
+        block = rng.randbytes(1024 * 1024)
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def encode_mp4(path, seconds):
+    """Encodes a test pattern with ffmpeg (H.264 + AAC, faststart, like convert_videos.py)."""
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={seconds}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{FIXTURE_BITRATE_KBPS}k',
+        '-g', '60', '-c:a', 'aac', '-movflags', '+faststart', path,
+    ], check=True)
+
+
+def prepare_fixtures(fixture_dir, synthetic=False, seed=0):
+    """Creates the fixture files unless they already exist. Returns their file names."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    use_ffmpeg = not synthetic and shutil.which('ffmpeg') is not None
+    rng = random.Random(seed)
+    names = []
+    for name, seconds in FIXTURES:
+        filename = f"{name}-{'enc' if use_ffmpeg else 'syn'}.mp4"
+        path = os.path.join(fixture_dir, filename)
+        if not os.path.exists(path):
+            print(f"Generating fixture {filename} ({seconds}s)...")
+            temp_path = path + '.tmp.mp4'
+            if use_ffmpeg:
+                encode_mp4(temp_path, seconds)
+            else:
+                write_synthetic_mp4(temp_path, seconds * FIXTURE_BITRATE_KBPS * 1000 // 8, rng)
+            os.replace(temp_path, path)
+        names.append(filename)
+    return names
+
+
+# --- Server process ---
+
+def server_command(kind, port):
+    if kind == 'waitress':
+        return [sys.executable, os.path.join(SERVER_DIR, 'serve.py'),
+                '--host', '127.0.0.1', '--port', str(port)]
+    if kind == 'gunicorn':
+        return ['gunicorn', '-c', os.path.join(SERVER_DIR, 'gunicorn.conf.py'),
+                '--bind', f'127.0.0.1:{port}']
+    # Flask development server (threaded), for comparison
+    return [sys.executable, '-c',
+            f"import app; app.create_app().run(host='127.0.0.1', port={port}, threaded=True)"]
+
+
+def start_server(kind, port, fixture_dir, state_dir, timeout=60):
+    # The fixture directory is the server's only library root; its metadata
+    # database, catalog and remux cache live in state_dir
+    env = dict(os.environ,
+               VIDEO_STREAMER_LIBRARY_ROOTS=f'bench={fixture_dir}',
+               VIDEO_STREAMER_METADATA_DB=os.path.join(state_dir, 'video_metadata.db'),
+               VIDEO_STREAMER_CATALOG=os.path.join(state_dir, 'videos.json'),
+               VIDEO_STREAMER_REMUX_CACHE_DIR=os.path.join(state_dir, 'remux'))
+    process = subprocess.Popen(server_command(kind, port), cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/ready')  # 200 once the warm-up is done
+            ok = conn.getresponse().status == 200
+            conn.close()
+            if ok:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server did not become ready")
+
+
+def _process_tree(pid):
+    """pid plus all of its descendants (gunicorn workers), from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for current in tree:
+        tree.extend(children.get(current, []))
+    return tree
+
+
+def sample_resources(pid):
+    """Total RSS (bytes) and open file descriptors of the server, or None without /proc."""
+    if not os.path.isdir('/proc'):
+        return None
+    rss = 0
+    fds = 0
+    for member in _process_tree(pid):
+        try:
+            with open(f'/proc/{member}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+            fds += len(os.listdir(f'/proc/{member}/fd'))
+        except OSError:
+            continue
+    return {"rss": rss, "fds": fds}
+
+
+class ResourceSampler:
+    """Samples the server's resources in the background while a phase runs."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            sample = sample_resources(self.pid)
+            if sample is None:
+                return
+            self.samples.append(sample)
+            self._stop_event.wait(SAMPLE_INTERVAL)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        if not self.samples:
+            return None
+        return {
+            "rss_peak": max(sample["rss"] for sample in self.samples),
+            "fds_peak": max(sample["fds"] for sample in self.samples),
+        }
+
+
+# --- Viewer patterns ---
+
+class Viewer:
+    """One simulated player with a keep-alive connection to the server."""
+
+    def __init__(self, port, fixtures, sizes, rng):
+        self.port = port
+        self.fixtures = fixtures
+        self.sizes = sizes
+        self.rng = rng
+        self.conn = None
+        self.samples = []  # (ttfb or None, bytes, status or None)
+        self._hot_position = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        return self.conn
+
+    def _reset(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def get(self, path, range_header=None, read_limit=None):
+        """
+        Requests path and reads at most read_limit bytes of the body (all of it
+        when None). Stopping early drops the connection, as a player does.
+        """
+        headers = {'Range': range_header} if range_header else {}
+        started = time.perf_counter()
+        ttfb = None
+        received = 0
+        try:
+            conn = self._connection()
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            while read_limit is None or received < read_limit:
+                want = READ_CHUNK if read_limit is None else min(READ_CHUNK, read_limit - received)
+                chunk = response.read(want)
+                if not chunk:
+                    break
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                received += len(chunk)
+            if ttfb is None:
+                ttfb = time.perf_counter() - started  # Empty body
+            if read_limit is not None and not response.isclosed():
+                self._reset()  # Aborted mid-body
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self._reset()
+            status = None
+        self.samples.append((ttfb, received, status))
+
+    def video_path(self, filename):
+        return f'/video/{filename}'
+
+    def start(self):
+        filename = self.rng.choice(self.fixtures)
+        self.get(self.video_path(filename), 'bytes=0-', START_READ_BYTES)
+
+    def moov_probe(self):
+        filename = self.rng.choice(self.fixtures)
+        self.get(self.video_path(filename), f'bytes=0-{PROBE_BYTES - 1}')
+        self.get(self.video_path(filename), f'bytes=-{PROBE_BYTES}')
+
+    def seek(self):
+        filename = self.rng.choice(self.fixtures)
+        offset = self.rng.randrange(0, max(1, self.sizes[filename] - SEEK_READ_BYTES))
+        self.get(self.video_path(filename), f'bytes={offset}-', SEEK_READ_BYTES)
+
+    def hot_title(self):
+        filename = self.fixtures[0]
+        size = self.sizes[filename]
+        if self._hot_position is None:
+            self._hot_position = self.rng.randrange(0, size, HOT_RANGE_BYTES)
+        start = self._hot_position
+        end = min(size, start + HOT_RANGE_BYTES) - 1
+        self.get(self.video_path(filename), f'bytes={start}-{end}')
+        self._hot_position = end + 1 if end + 1 < size else 0
+
+    def video_info(self):
+        self.get(f'/video_info/{self.rng.choice(self.fixtures)}')
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_phase(phase, port, fixtures, sizes, viewers, seconds, seed, server_pid):
+    """Runs `viewers` concurrent viewers doing `phase` for `seconds`. Returns the phase result."""
+    stop_at = time.monotonic() + seconds
+    clients = [Viewer(port, fixtures, sizes, random.Random(seed * 1000 + i)) for i in range(viewers)]
+
+    def loop(viewer):
+        action = getattr(viewer, phase)
+        while time.monotonic() < stop_at:
+            action()
+        viewer._reset()
+
+    sampler = ResourceSampler(server_pid)
+    sampler.start()
+    started = time.monotonic()
+    threads = [threading.Thread(target=loop, args=(viewer,)) for viewer in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    resources = sampler.stop()
+
+    samples = [sample for viewer in clients for sample in viewer.samples]
+    ok = [sample for sample in samples if sample[2] is not None and sample[2] < 400]
+    failures = {}
+    for _, _, status in samples:
+        if status is None or status >= 400:
+            key = str(status) if status is not None else 'connection error'
+            failures[key] = failures.get(key, 0) + 1
+    ttfbs = [sample[0] for sample in ok]
+    total_bytes = sum(sample[1] for sample in samples)
+    result = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "failures": failures,
+        "requests_per_second": len(samples) / elapsed,
+        "bytes": total_bytes,
+        "throughput_mbps": total_bytes * 8 / elapsed / 1e6,
+        "ttfb_p50_ms": _percentile(ttfbs, 0.50) * 1000 if ttfbs else None,
+        "ttfb_p99_ms": _percentile(ttfbs, 0.99) * 1000 if ttfbs else None,
+        "seconds": elapsed,
+    }
+    if resources:
+        result.update(resources)
+    return result
+
+
+# --- Results ---
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metrics compared by --compare, and whether higher values are better
+COMPARED_METRICS = {
+    "throughput_mbps": True,
+    "requests_per_second": True,
+    "ttfb_p50_ms": False,
+    "ttfb_p99_ms": False,
+    "rss_peak": False,
+    "fds_peak": False,
+}
+
+
+def compare_results(previous, current):
+    """Prints per-phase changes against an earlier result and returns the number of regressions."""
+    regressions = 0
+    print(f"\nCompared with {previous.get('revision') or 'previous run'} "
+          f"({previous.get('timestamp')}):")
+    for phase, result in current["phases"].items():
+        old = previous.get("phases", {}).get(phase)
+        if not old:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change < -REGRESSION_THRESHOLD if higher_is_better else change > REGRESSION_THRESHOLD
+            regressions += worse
+            marker = '  REGRESSION' if worse else ''
+            print(f"  {phase:11s} {metric:20s} {before:12.2f} -> {after:12.2f} "
+                  f"({change * 100:+.1f}%){marker}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the streaming server.")
+    parser.add_argument('--server', choices=['waitress', 'gunicorn', 'flask'], default='waitress')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--viewers', type=int, default=32, help="concurrent viewers per phase")
+    parser.add_argument('--phase-seconds', type=float, default=20.0)
+    parser.add_argument('--phases', default=','.join(PHASES),
+                        help=f"comma-separated subset of {','.join(PHASES)}")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fixture-dir', default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument('--synthetic', action='store_true',
+                        help="don't encode fixtures with ffmpeg even if it is installed")
+    parser.add_argument('--output', default=None,
+                        help="result file (default: benchmark_results/<time>-<revision>.json)")
+    parser.add_argument('--compare', metavar='RESULT_JSON', default=None,
+                        help="earlier result to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    phases = [phase.strip() for phase in args.phases.split(',') if phase.strip()]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        print(f"Unknown phase(s): {', '.join(sorted(unknown))}", file=sys.stderr)
+        sys.exit(2)
+
+    fixtures = prepare_fixtures(args.fixture_dir, args.synthetic, args.seed)
+    sizes = {name: os.path.getsize(os.path.join(args.fixture_dir, name)) for name in fixtures}
+    if 'video_info' in phases and any(name.endswith('-syn.mp4') for name in fixtures):
+        print("Skipping phase video_info: synthetic fixtures can't be probed.")
+        phases.remove('video_info')
+
+    print(f"Starting {args.server} server on port {args.port}...")
+    state_dir = tempfile.mkdtemp(prefix='video-streamer-bench-state-')
+    server = start_server(args.server, args.port, args.fixture_dir, state_dir)
+    try:
+        baseline = sample_resources(server.pid)
+        results = {}
+        for phase in phases:
+            print(f"Phase {phase}: {args.viewers} viewer(s) for {args.phase_seconds:.0f}s...")
+            results[phase] = run_phase(phase, args.port, fixtures, sizes, args.viewers,
+                                       args.phase_seconds, args.seed, server.pid)
+            result = results[phase]
+            ttfb = (f"TTFB p50 {result['ttfb_p50_ms']:.1f} ms, p99 {result['ttfb_p99_ms']:.1f} ms"
+                    if result['ttfb_p50_ms'] is not None else "no successful requests")
+            print(f"  {result['requests']} requests ({result['errors']} errors), "
+                  f"{result['throughput_mbps']:.1f} Mbit/s, {ttfb}")
+            if result['errors']:
+                details = ', '.join(f"{count} x {status}"
+                                    for status, count in sorted(result['failures'].items()))
+                print(f"Error: {result['errors']} of {result['requests']} requests failed in "
+                      f"phase {phase} ({details}); no results written.", file=sys.stderr)
+                sys.exit(1)
+        final = sample_resources(server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "server": args.server,
+            "viewers": args.viewers,
+            "phase_seconds": args.phase_seconds,
+            "seed": args.seed,
+            "fixtures": sizes,
+        },
+        "server_resources": {
+            "start": baseline,
+            "end": final,
+            "rss_growth": (final["rss"] - baseline["rss"]) if baseline and final else None,
+        },
+        "phases": results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') +
+                              f"-{report['revision'] or 'unknown'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+    if report["server_resources"]["rss_growth"] is not None:
+        print(f"Server RSS growth: {report['server_resources']['rss_growth'] / 1e6:.1f} MB, "
+              f"open fds {baseline['fds']} -> {final['fds']}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), report)
+        if regressions:
+            print(f"{regressions} regression(s) above {REGRESSION_THRESHOLD:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
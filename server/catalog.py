@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right
+
+# Fields the catalog can be sorted by, mapped to a function building the sort key.
+# Every key ends with the video ID so the order is total and cursors are unambiguous.
+SORT_KEYS = {
+    'title': lambda video: (video.get('title', '').lower(), video.get('id', '')),
+    'id': lambda video: (video.get('id', ''),),
+}
+DEFAULT_SORT = 'title'
+# How often (seconds) the catalog file's mtime is checked for changes
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class InvalidQuery(ValueError):
+    """Raised for malformed catalog queries (bad sort field, cursor, ...)."""
+
+
+def encode_cursor(key):
+    """Turns a sort key into an opaque URL-safe cursor string."""
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """
+    Inverse of encode_cursor for a sort key of `length` strings.
+    Raises InvalidQuery for malformed cursors (or ones made for another sort).
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise InvalidQuery("Invalid cursor")
+    if (not isinstance(key, list) or len(key) != length
+            or not all(isinstance(part, str) for part in key)):
+        raise InvalidQuery("Invalid cursor")
+    return tuple(key)
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogSnapshot:
+    """
+    Immutable in-memory view of the catalog with prebuilt search indexes:
+    one sorted order (and its keys) per sort field, a sorted word list for
+    prefix search and a trigram index for substring search.
+    """
+
+    def __init__(self, videos, version):
+        self.videos = videos
+        self.version = version
+        self.by_id = {video.get('id'): video for video in videos}
+        self.by_filename = {video.get('filename'): video for video in videos}
+        self._titles = [video.get('title', '').lower() for video in videos]
+
+        # Sorted orders per field: positions into self.videos plus their keys
+        self._orders = {}
+        for field, key_func in SORT_KEYS.items():
+            keys = [key_func(video) for video in videos]
+            order = sorted(range(len(videos)), key=keys.__getitem__)
+            self._orders[field] = (order, [keys[i] for i in order])
+
+        # Prefix index: every (word, position) pair of every title, sorted
+        words = []
+        for position, title in enumerate(self._titles):
+            for word in set(title.split()):
+                words.append((word, position))
+        words.sort()
+        self._words = words
+        self._word_keys = [word for word, _ in words]
+
+        # Substring index: trigram -> positions of titles containing it
+        trigrams = {}
+        for position, title in enumerate(self._titles):
+            for trigram in _trigrams(title):
+                trigrams.setdefault(trigram, set()).add(position)
+        self._trigrams = trigrams
+
+    def _prefix_matches(self, prefix):
+        """Positions of titles having a word (or the whole title) starting with prefix."""
+        start = bisect_left(self._word_keys, prefix)
+        end = bisect_left(self._word_keys, prefix + '\uffff')
+        matches = {position for _, position in self._words[start:end]}
+        matches.update(position for position, title in enumerate(self._titles)
+                       if ' ' in prefix and title.startswith(prefix))
+        return matches
+
+    def _substring_matches(self, text):
+        """Positions of titles containing text, narrowed down via the trigram index."""
+        if len(text) < 3:
+            return {position for position, title in enumerate(self._titles) if text in title}
+        candidates = None
+        for trigram in _trigrams(text):
+            positions = self._trigrams.get(trigram)
+            if not positions:
+                return set()
+            candidates = positions if candidates is None else candidates & positions
+        return {position for position in candidates if text in self._titles[position]}
+
+    def query(self, search=None, prefix=None, sort=DEFAULT_SORT, descending=False, cursor=None, limit=50):
+        """
+        Returns (items, next_cursor, total) for one page of the catalog.
+        search is a case-insensitive substring filter, prefix a word prefix filter.
+        Pagination is keyset based: the cursor encodes the sort key of the last
+        item of the previous page, so pages stay consistent across reloads.
+        """
+        if sort not in self._orders:
+            raise InvalidQuery(f"Unknown sort field '{sort}'")
+        order, keys = self._orders[sort]
+        if cursor is not None:
+            cursor = decode_cursor(cursor, len(SORT_KEYS[sort]({})))
+
+        matches = None
+        if search:
+            matches = self._substring_matches(search.lower())
+        if prefix:
+            prefix_matches = self._prefix_matches(prefix.lower())
+            matches = prefix_matches if matches is None else matches & prefix_matches
+        total = len(self.videos) if matches is None else len(matches)
+
+        # Position in the sorted order right after (or before, descending) the cursor
+        if descending:
+            step = -1
+            start = len(order) - 1 if cursor is None else bisect_left(keys, cursor) - 1
+        else:
+            step = 1
+            start = 0 if cursor is None else bisect_right(keys, cursor)
+
+        items = []
+        last_key = None
+        i = start
+        while 0 <= i < len(order) and len(items) < limit:
+            position = order[i]
+            if matches is None or position in matches:
+                items.append(self.videos[position])
+                last_key = keys[i]
+            i += step
+
+        # Only hand out a cursor if there may be more items
+        has_more = False
+        while 0 <= i < len(order):
+            if matches is None or order[i] in matches:
+                has_more = True
+                break
+            i += step
+        next_cursor = encode_cursor(last_key) if has_more and last_key is not None else None
+        return items, next_cursor, total
+
+
+class Catalog:
+    """
+    The video catalog produced by getInfo.py, kept in memory.
+
+    The JSON file is re-read automatically when its mtime changes (checked at
+    most every RELOAD_CHECK_INTERVAL seconds) or explicitly via reload().
+    Readers always get a complete snapshot; reloads swap it atomically.
+    """
+
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self._snapshot = CatalogSnapshot([], 'empty')
+        self._mtime_ns = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        """Reads the catalog file and rebuilds the indexes. Returns the new snapshot."""
+        with self._lock:
+            try:
+                st = os.stat(self.json_path)
+                with open(self.json_path, 'rb') as f:
+                    raw = f.read()
+                videos = json.loads(raw.decode('utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"Could not load catalog '{self.json_path}': {e}")
+                return self._snapshot
+            version = hashlib.sha1(raw).hexdigest()[:16]
+            self._snapshot = CatalogSnapshot(videos, version)
+            self._mtime_ns = st.st_mtime_ns
+            self._last_check = time.monotonic()
+            print(f"Loaded catalog with {len(videos)} video(s), version {version}")
+            return self._snapshot
+
+    def snapshot(self):
+        """Returns the current snapshot, reloading first if the file changed."""
+        now = time.monotonic()
+        if now - self._last_check >= RELOAD_CHECK_INTERVAL:
+            self._last_check = now
+            try:
+                mtime_ns = os.stat(self.json_path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns is not None and mtime_ns != self._mtime_ns:
+                return self.reload()
+        return self._snapshot
@@ -0,0 +1,171 @@
+import os
+import threading
+from collections import OrderedDict
+
+from streaming import iter_file_range
+
+# Size of a cached block. Blocks are aligned to multiples of this size.
+DEFAULT_BLOCK_SIZE = 256 * 1024
+# On eviction, this many of the least recently used blocks are compared and
+# the one with the fewest hits goes (approximated LFU on top of LRU, so a
+# single sequential read can't flush the blocks every viewer needs)
+EVICTION_SAMPLE = 8
+
+
+class BlockCache:
+    """
+    In-process cache of fixed-size, aligned file blocks shared by all requests.
+
+    Blocks are keyed by (path, block index) and tagged with the file's
+    (mtime_ns, size) version; when a file changes, all of its blocks are
+    dropped the next time it is read. Memory use is bounded by max_bytes.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, max_bytes, block_size=DEFAULT_BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._blocks = OrderedDict()  # (path, index) -> [data, hits]
+        self._versions = {}  # path -> (mtime_ns, size)
+        self._blocks_by_path = {}  # path -> set of block indexes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "blocks": len(self._blocks),
+                "files": len(self._blocks_by_path),
+            }
+
+    def _drop_file(self, path):
+        for index in self._blocks_by_path.pop(path, ()):
+            data, _ = self._blocks.pop((path, index))
+            self._bytes -= len(data)
+        self._versions.pop(path, None)
+
+    def invalidate(self, path):
+        """Drops every cached block of path."""
+        with self._lock:
+            self._drop_file(path)
+
+    def _evict_one(self):
+        candidates = []
+        for key in self._blocks:
+            candidates.append(key)
+            if len(candidates) >= EVICTION_SAMPLE:
+                break
+        victim = min(candidates, key=lambda key: self._blocks[key][1])
+        data, _ = self._blocks.pop(victim)
+        self._bytes -= len(data)
+        path, index = victim
+        indexes = self._blocks_by_path.get(path)
+        if indexes is not None:
+            indexes.discard(index)
+            if not indexes:
+                del self._blocks_by_path[path]
+                self._versions.pop(path, None)
+        self.evictions += 1
+
+    def get_block(self, file_obj, path, version, index):
+        """
+        Returns block `index` of the file, from memory if possible.
+        file_obj is an open handle on path used to fill misses.
+        """
+        key = (path, index)
+        with self._lock:
+            if self._versions.get(path, version) != version:
+                self._drop_file(path)  # File changed on disk
+            entry = self._blocks.get(key)
+            if entry is not None:
+                entry[1] += 1
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Read outside the lock so a slow disk doesn't stall cache hits
+        file_obj.seek(index * self.block_size)
+        data = file_obj.read(self.block_size)
+
+        with self._lock:
+            # Skip the insert if the file changed meanwhile (another reader saw a newer version)
+            if (key not in self._blocks and len(data) <= self.max_bytes
+                    and self._versions.get(path, version) == version):
+                self._versions[path] = version
+                self._blocks[key] = [data, 1]
+                self._blocks_by_path.setdefault(path, set()).add(index)
+                self._bytes += len(data)
+                while self._bytes > self.max_bytes:
+                    self._evict_one()
+        return data
+
+    def iter_range(self, file_obj, path, version, start, length):
+        """Yields `length` bytes of the file from `start`, block by block via the cache."""
+        end = start + length
+        position = start
+        while position < end:
+            index = position // self.block_size
+            block = self.get_block(file_obj, path, version, index)
+            offset = position - index * self.block_size
+            if offset >= len(block):
+                break  # File shorter than expected
+            chunk = block[offset:offset + (end - position)]
+            position += len(chunk)
+            yield chunk
+
+
+class CachedRangeIterator:
+    """
+    WSGI body for a byte range where the parts inside `regions` (sorted,
+    non-overlapping (start, end) byte ranges: the moov atom and first GOPs of
+    an MP4, which every viewer requests, or the GOP a seek lands in) are
+    served through the BlockCache and the rest is streamed straight from the
+    file. A single int is shorthand for the region (0, regions).
+    close() closes the file.
+    """
+
+    def __init__(self, cache, file_obj, start, length, regions):
+        self.cache = cache
+        self.file_obj = file_obj
+        self.start = start
+        self.length = length
+        self.regions = [(0, regions)] if isinstance(regions, int) else regions
+        st = os.fstat(file_obj.fileno())
+        self.path = os.path.abspath(file_obj.name)
+        self.version = (st.st_mtime_ns, st.st_size)
+
+    def __iter__(self):
+        end = self.start + self.length
+        position = self.start
+        for region_start, region_end in self.regions:
+            if region_end <= position:
+                continue
+            if region_start >= end:
+                break
+            if position < region_start:
+                yield from iter_file_range(self.file_obj, position, region_start - position)
+                position = region_start
+            cached_end = min(end, region_end)
+            yield from self.cache.iter_range(
+                self.file_obj, self.path, self.version, position, cached_end - position)
+            position = cached_end
+        if position < end:
+            yield from iter_file_range(self.file_obj, position, end - position)
+
+    def close(self):
+        self.file_obj.close()
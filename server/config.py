@@ -0,0 +1,103 @@
+# Shared configuration of the converter, the indexer and the streaming server.
+#
+# The converted library can be spread over several roots, e.g. one directory
+# per disk or mount, so reads are spread over several spindles and adding a disk
+# adds capacity and throughput. Every root has a short name; the catalog
+# records which root holds each title (see getInfo.py), new conversions go to
+# the root with the most free space (see convert_videos.py) and app.py finds
+# files through the catalog.
+#
+# Settings can be overridden with environment variables:
+#
+#   VIDEO_STREAMER_VIDEO_DIR       directory of original videos to convert
+#   VIDEO_STREAMER_LIBRARY_ROOTS   library roots as name=path entries separated
+#                                  by os.pathsep (';' on Windows, ':' elsewhere),
+#                                  e.g. "disk1=/mnt/disk1/videos:disk2=/mnt/disk2/videos"
+#   VIDEO_STREAMER_CONVERTED_DIR   single library root (used when
+#                                  VIDEO_STREAMER_LIBRARY_ROOTS isn't set)
+#   VIDEO_STREAMER_HLS_DIR         directory for HLS output
+#   VIDEO_STREAMER_REMUX_CACHE_DIR directory for live remuxes of unconverted sources
+#   VIDEO_STREAMER_METADATA_DB     ffprobe/keyframe index database (metadata_store.py)
+import os
+import tempfile
+
+# Directory where your original video files are stored
+VIDEO_DIR = os.environ.get('VIDEO_STREAMER_VIDEO_DIR', 'C:\\Users\\himan\\Videos\\Movies\\New folder')
+
+# Directory for adaptive bitrate (HLS) output, one sub-directory per title
+HLS_DIR = os.environ.get('VIDEO_STREAMER_HLS_DIR', 'C:\\Users\\himan\\Videos\\HLS')
+
+# Fragmented MP4s made on the fly by app.py for sources that aren't converted
+# yet. Only a cache: anything in it can be deleted at any time.
+REMUX_CACHE_DIR = os.environ.get('VIDEO_STREAMER_REMUX_CACHE_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'video-streamer-remux'))
+
+# Metadata database shared by app.py (/video_info, seeks) and getInfo.py (which
+# fills it while indexing), so files probed by one aren't probed again by the other
+METADATA_DB_PATH = os.environ.get('VIDEO_STREAMER_METADATA_DB', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'video_metadata.db'))
+
+# Source file extensions the converter (and the live remux in app.py) accept
+SUPPORTED_INPUT_EXTENSIONS = ['.mkv', '.webm', '.avi', '.mov']
+
+# Name of the root used when only a single directory is configured
+DEFAULT_ROOT_NAME = 'main'
+
+
+def parse_library_roots(value):
+    """
+    Parses a VIDEO_STREAMER_LIBRARY_ROOTS value into {name: directory}.
+    Entries without 'name=' are named root1, root2, ... by position.
+    """
+    roots = {}
+    for position, item in enumerate(filter(None, value.split(os.pathsep)), 1):
+        name, separator, path = item.partition('=')
+        if not separator:
+            name, path = f'root{position}', item
+        name = name.strip()
+        if not name or '/' in name or name in roots:
+            raise ValueError(f"Invalid or duplicate library root name '{name}'")
+        roots[name] = path.strip()
+    if not roots:
+        raise ValueError("No library roots configured")
+    return roots
+
+
+# Library roots: name -> directory holding converted MP4s. Titles keep their
+# root's name in the catalog, so a root's name must not change once indexed.
+if os.environ.get('VIDEO_STREAMER_LIBRARY_ROOTS'):
+    LIBRARY_ROOTS = parse_library_roots(os.environ['VIDEO_STREAMER_LIBRARY_ROOTS'])
+else:
+    LIBRARY_ROOTS = {DEFAULT_ROOT_NAME: os.environ.get(
+        'VIDEO_STREAMER_CONVERTED_DIR', 'C:\\Users\\himan\\Videos\\Music videos')}
+
+
+def library_path(root_name, relpath):
+    """Library-wide key of a file: '<root name>/<path relative to the root>' with '/' separators."""
+    return f"{root_name}/{relpath.replace(os.sep, '/')}"
+
+
+def split_library_path(libpath):
+    """Inverse of library_path: returns (root name, relative path)."""
+    root_name, _, relpath = libpath.partition('/')
+    return root_name, relpath
+
+
+def resolve_library_path(libpath, roots=None):
+    """Absolute file system path of a library path, or None if its root isn't configured."""
+    roots = LIBRARY_ROOTS if roots is None else roots
+    root_name, relpath = split_library_path(libpath)
+    if root_name not in roots:
+        return None
+    return os.path.join(roots[root_name], *relpath.split('/'))
+
+
+def find_library_path(path, roots=None):
+    """The library path of an absolute file system path, or None if it isn't under a root."""
+    roots = LIBRARY_ROOTS if roots is None else roots
+    path = os.path.abspath(path)
+    for root_name, directory in roots.items():
+        directory = os.path.abspath(directory)
+        if os.path.commonpath([path, directory]) == directory and path != directory:
+            return library_path(root_name, os.path.relpath(path, directory))
+    return None
@@ -3,24 +3,181 @@ import subprocess
 import sys
 import time
 import threading
+import shutil
+import argparse
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from metadata_store import probe_video, ProbeError
+from thumbnails import generate_thumbnails
+from job_queue import JobQueue, DONE, FAILED, PENDING, RUNNING, LEASE_SECONDS
+from transcode_telemetry import telemetry, iter_progress_blocks
+from metrics import start_metrics_server
+from encode_profiles import (ENCODE_PROFILES, DEFAULT_PROFILE, PROFILE_FILENAME, profile_for,
+                             analyze_crf, choose_conversion_path, PATH_COPY, PATH_AUDIO, PATH_FULL)
 
-# Directory where your original video files are stored
-VIDEO_DIR = 'C:\\Users\\himan\\Videos\\Movies\\New folder'
-# Directory to store converted MP4 files
-CONVERTED_DIR = 'C:\\Users\\himan\\Videos\\Movies'
+# Directory where your original video files are stored, the library roots
+# converted MP4s are spread over (the server streams from these) and the
+# directory for adaptive bitrate (HLS) output, and the source formats that are
+# converted; see config.py
+from config import VIDEO_DIR, LIBRARY_ROOTS, HLS_DIR, SUPPORTED_INPUT_EXTENSIONS
 
 # Ensure the directories exist
 if not os.path.exists(VIDEO_DIR):
     os.makedirs(VIDEO_DIR)
     print(f"Created directory for original videos: {VIDEO_DIR}")
 
-if not os.path.exists(CONVERTED_DIR):
-    os.makedirs(CONVERTED_DIR)
-    print(f"Created directory for converted videos: {CONVERTED_DIR}")
+for _library_root in LIBRARY_ROOTS.values():
+    if not os.path.exists(_library_root):
+        os.makedirs(_library_root)
+        print(f"Created directory for converted videos: {_library_root}")
 
-# Supported input file extensions for conversion (add more if needed)
-SUPPORTED_INPUT_EXTENSIONS = ['.mkv', '.webm', '.avi', '.mov']
+
+# Rendition ladder for the HLS mode: (name, height, video bitrate, audio bitrate).
+# Rungs taller than the source are skipped.
+HLS_LADDER = [
+    ('1080p', 1080, '5000k', '192k'),
+    ('720p', 720, '2800k', '128k'),
+    ('480p', 480, '1400k', '128k'),
+    ('360p', 360, '800k', '96k'),
+]
+# Target HLS segment length in seconds. Keyframes are forced on segment
+# boundaries so every rendition switches cleanly.
+HLS_SEGMENT_SECONDS = 4
+
+# MP4 output is written to '.<name>.part' next to the final file and renamed
+# into place only once ffmpeg has finished, so an interrupted conversion never
+# leaves a truncated MP4 that looks finished
+PARTIAL_SUFFIX = '.part'
+# An existing MP4 the job queue doesn't know about (converted before the queue
+# existed) is only trusted if its duration is at least this share of the source's
+LEGACY_MIN_DURATION_RATIO = 0.98
+
+# Default number of ffmpeg processes run at the same time. x264 stops scaling
+# well after a handful of threads, so several smaller jobs keep a big box busier
+# than one job using every core.
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) // 8)
+
+# Segment-parallel encoding (--parallel-segments): sources at least this long
+# (seconds) are split at keyframes and the pieces encoded by several ffmpeg
+# processes at once, then joined back together without re-encoding
+SEGMENT_MIN_DURATION = 20 * 60
+# Encoder threads per piece when the number of processes is picked automatically
+# (the job's thread budget / SEGMENT_THREADS processes)
+SEGMENT_THREADS = 4
+# Pieces are never shorter than this (seconds). There are twice as many pieces
+# as processes, so a process that finishes early picks up another piece
+# instead of idling while the hardest piece finishes.
+SEGMENT_MIN_PIECE = 60
+# Where the pieces are written (None = the system temp directory). Needs room
+# for about the size of the source's video stream plus the encoded video.
+SEGMENT_WORK_DIR = None
+
+# Serialises console output so messages from parallel jobs don't tear the progress line
+_output_lock = threading.Lock()
+# True while a ProgressBoard owns the current console line
+_progress_line_active = False
+
+
+def log(message, file=sys.stdout):
+    """
+    Prints a message on its own line, safe to call from any worker thread.
+    Clears the progress line first so the message isn't appended to it.
+    """
+    with _output_lock:
+        if _progress_line_active:
+            sys.stdout.write('\r\033[K')
+            sys.stdout.flush()
+        print(message, file=file)
+        file.flush()
+
+
+class ProgressBoard:
+    """
+    Aggregate progress display for several concurrent ffmpeg jobs.
+
+    Jobs report their own percentage via update(); a background thread redraws
+    a single console line with the overall progress (weighted by duration) and
+    the progress of each running job.
+    """
+
+    def __init__(self, total_jobs, total_duration, refresh_interval=0.5):
+        self.total_jobs = total_jobs
+        self.total_duration = total_duration or 0
+        self.refresh_interval = refresh_interval
+        self._running = {}  # job name -> (percentage, duration)
+        self._finished_jobs = 0
+        self._finished_duration = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+
+    def start(self):
+        global _progress_line_active
+        _progress_line_active = True
+        self._thread.start()
+
+    def stop(self):
+        global _progress_line_active
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        self._render()
+        with _output_lock:
+            _progress_line_active = False
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+    def add_job(self, name, duration):
+        with self._lock:
+            self._running[name] = (0.0, duration or 0)
+
+    def extend(self, duration):
+        """Counts one more job (a retry, or a job queued while running) in the totals."""
+        with self._lock:
+            self.total_jobs += 1
+            self.total_duration += duration or 0
+
+    def update(self, name, percentage):
+        with self._lock:
+            if name in self._running:
+                self._running[name] = (percentage, self._running[name][1])
+
+    def finish_job(self, name):
+        with self._lock:
+            _, duration = self._running.pop(name, (0.0, 0))
+            self._finished_jobs += 1
+            self._finished_duration += duration
+
+    def _overall_percentage(self):
+        if self.total_duration > 0:
+            done = self._finished_duration + sum(
+                pct / 100 * duration for pct, duration in self._running.values())
+            return max(0, min(100, done / self.total_duration * 100))
+        if self.total_jobs > 0:
+            return self._finished_jobs / self.total_jobs * 100
+        return 100.0
+
+    def _render(self):
+        with self._lock:
+            overall = self._overall_percentage()
+            running = sorted(self._running.items())
+            finished = self._finished_jobs
+
+        bar_length = 30
+        filled_length = int(bar_length * overall // 100)
+        bar = '█' * filled_length + '-' * (bar_length - filled_length)
+        line = f'[{finished}/{self.total_jobs}] [{bar}] {overall:.1f}%'
+        for name, (pct, _) in running:
+            line += f' | {name[:20]} {pct:.0f}%'
+
+        # Keep the line within the terminal so \r can overwrite it
+        width = shutil.get_terminal_size((120, 20)).columns
+        with _output_lock:
+            sys.stdout.write('\r\033[K' + line[:width - 1])
+            sys.stdout.flush()
+
+    def _render_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            self._render()
 
 
 def get_video_duration(file_path):
@@ -49,306 +206,957 @@ def get_video_duration(file_path):
         return None
 
 
-def monitor_ffmpeg_progress(progress_filepath, total_duration, stop_event):
-    """
-    Monitors the FFmpeg progress file and updates the console loading bar.
-    Runs in a separate thread to avoid blocking the main process while FFmpeg runs.
-    """
-    # Give FFmpeg a moment to start and create the file
-    time.sleep(0.5)
+def draw_progress_bar(percentage):
+    """Draws the single-file progress bar on the current console line."""
+    bar_length = 50  # Length of the progress bar in characters
+    filled_length = int(bar_length * percentage // 100)
+    bar = '█' * filled_length + '-' * (bar_length - filled_length)
+    # \r returns cursor to the beginning of the line
+    sys.stdout.write(f'\rProgress: [{bar}] {percentage:.1f}% ')
+    sys.stdout.flush()
 
-    try:
-        # Open the progress file for reading with line buffering
-        with open(progress_filepath, 'r', buffering=1) as f:
-            # Seek to the beginning initially
-            f.seek(0)
-            # Keep track of the last reported percentage, -1 to ensure initial print
-            last_percentage = -1
-
-            # Loop until the stop event is set (meaning FFmpeg finished)
-            while not stop_event.is_set():
-                line = f.readline()  # Read one line at a time
-                if not line:
-                    # If no line was read, we are at the end of the file.
-                    # Wait a bit before trying again.
-                    # Shorter sleep for more responsive updates
-                    time.sleep(0.05)
-                    continue  # Go back to the start of the while loop
-
-                # Process the line
-                if line.startswith('out_time_ms='):
-                    try:
-                        # Extract time in milliseconds and convert to seconds
-                        elapsed_time_ms = int(line.split('=')[1].strip())
-                        elapsed_time_sec = elapsed_time_ms / 1000.0
-
-                        if total_duration and total_duration > 0:
-                            percentage = (elapsed_time_sec /
-                                          total_duration) * 100
-                            # Clamp between 0 and 100
-                            percentage = max(0, min(100, percentage))
-
-                            # Only update the display if the percentage has changed significantly
-                            # or if it's 100%
-                            if percentage - last_percentage >= 0.1 or percentage == 100:  # Update if >= 0.1% change
-                                bar_length = 50  # Length of the progress bar in characters
-                                filled_length = int(
-                                    bar_length * percentage // 100)
-                                bar = '█' * filled_length + '-' * \
-                                    (bar_length - filled_length)
-
-                                # Print the progress bar dynamically on the same line
-                                # \r returns cursor to the beginning of the line
-                                sys.stdout.write(
-                                    f'\rProgress: [{bar}] {percentage:.1f}% ')
-                                sys.stdout.flush()  # Ensure the output is immediately visible
-
-                                last_percentage = percentage  # Update last reported percentage
-
-                    except (ValueError, IndexError):
-                        # Ignore lines that don't parse as expected
-                        pass
-                # Add other progress indicators if needed (e.g., 'frame=', 'speed=')
-
-            # After the loop finishes (stop_event is set), read any remaining lines
-            # to ensure we capture the final 100% if the thread stopped before reading it.
-            while True:
-                line = f.readline()
-                if not line:
-                    break  # No more lines
-                # Re-process the line to ensure final 100% is displayed
-                if line.startswith('out_time_ms='):
-                    try:
-                        elapsed_time_ms = int(line.split('=')[1].strip())
-                        elapsed_time_sec = elapsed_time_ms / 1000.0
-                        if total_duration and total_duration > 0:
-                            percentage = (elapsed_time_sec /
-                                          total_duration) * 100
-                            percentage = max(0, min(100, percentage))
-                            bar_length = 50
-                            filled_length = int(bar_length * percentage // 100)
-                            bar = '█' * filled_length + '-' * \
-                                (bar_length - filled_length)
-                            sys.stdout.write(
-                                f'\rProgress: [{bar}] {percentage:.1f}% ')
-                            sys.stdout.flush()
-                    except (ValueError, IndexError):
-                        pass
-
-            # Ensure a newline is printed at the very end to move to the next line
-            sys.stdout.write('\n')
-            sys.stdout.flush()
 
-    except FileNotFoundError:
-        print(
-            f"\nError: FFmpeg progress file not found at {progress_filepath}", file=sys.stderr)
-    except Exception as e:
-        print(
-            f"\nAn error occurred while monitoring progress: {e}", file=sys.stderr)
-
-
-def convert_to_mp4(input_path, output_path):
+def run_ffmpeg(ffmpeg_command, input_path, total_duration=None, progress_board=None, cleanup=None):
     """
-    Converts a video file to MP4 format using ffmpeg with progress monitoring.
+    Runs a complete ffmpeg command (inputs and outputs included) with progress
+    monitoring and error reporting. total_duration is probed if not given. When progress_board is
+    given, progress is reported to it instead of drawing a per-file bar.
+    cleanup is called to remove partial output if ffmpeg fails.
+
+    ffmpeg writes its progress reports (`-progress pipe:1`) to a pipe that is
+    parsed as it arrives; every report goes to transcode_telemetry (speed,
+    fps, ETA, CPU time as Prometheus metrics and JSON lines).
     Returns True on success, False on failure.
     """
     input_filename = os.path.basename(input_path)
-    output_filename = os.path.basename(output_path)
 
-    print(f"Converting '{input_filename}'...")
-
-    # Get the total duration using ffprobe
-    total_duration = get_video_duration(input_path)
+    # Get the total duration using ffprobe (unless the scheduler already did)
     if total_duration is None:
-        print(
+        total_duration = get_video_duration(input_path)
+    if total_duration is None:
+        log(
             f"Could not get duration for '{input_filename}'. Conversion will proceed without a progress bar.", file=sys.stderr)
         show_progress = False
     else:
-        print(f"Duration: {total_duration:.2f} seconds")
+        log(f"Duration: {total_duration:.2f} seconds")
         show_progress = True
 
-    # Create a temporary file for FFmpeg progress output
-    temp_progress_file = None
-    progress_filepath = None
-    if show_progress:
+    ffmpeg_command = list(ffmpeg_command)
+    # Progress reports go to stdout, and -nostats drops the status line ffmpeg
+    # would otherwise keep rewriting on stderr. Both are global options, so they
+    # go right after the program name.
+    ffmpeg_command[1:1] = ['-progress', 'pipe:1', '-nostats']
+
+    job = telemetry.start_job(input_path, total_duration)
+    ok = False
+    try:
+        process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, errors='replace')
+    except FileNotFoundError:
+        job.finish(False)
+        log("\nError: ffmpeg command not found.", file=sys.stderr)
+        log("Please ensure ffmpeg is installed and accessible in your system's PATH.", file=sys.stderr)
+        return False
+
+    # Error messages (-loglevel error) are collected in the background so a
+    # chatty ffmpeg can't block on a full stderr pipe
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr),
+                                     daemon=True)
+    stderr_thread.start()
+
+    try:
+        last_percentage = -1
+        for fields in iter_progress_blocks(process.stdout):
+            stats = job.update(fields, process.pid)
+            percentage = stats['percent']
+            if not show_progress or percentage is None:
+                continue
+            if progress_board is not None:
+                progress_board.update(input_filename, percentage)
+            elif percentage - last_percentage >= 0.1 or percentage == 100:  # Update if >= 0.1% change
+                draw_progress_bar(percentage)
+                last_percentage = percentage
+        returncode = process.wait()
+        stderr_thread.join(timeout=5)
+        ok = returncode == 0
+    except BaseException:
+        # Interrupted (Ctrl+C) or a bug in the progress handling: don't leave
+        # ffmpeg running in the background
+        process.kill()
+        process.wait()
+        if cleanup:
+            cleanup()
+        raise
+    finally:
+        job.finish(ok)
+
+    if show_progress and progress_board is None:
+        # Move past the progress bar
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+    if not ok:
+        log(f"\nError converting '{input_filename}' (ffmpeg exit code {returncode}).",
+            file=sys.stderr)
+        if stderr_lines:
+            log(f"ffmpeg stderr: {''.join(stderr_lines).strip()}", file=sys.stderr)
+        # Clean up the partially created output if conversion failed
+        if cleanup:
+            cleanup()
+        return False
+
+    if not show_progress:
+        # Print success if no progress bar was shown
+        log(f"Successfully converted '{input_filename}'.")
+    return True
+
+
+# Conversion paths reported in the summary
+PATH_DESCRIPTIONS = {
+    PATH_COPY: "remuxed (stream copy)",
+    PATH_AUDIO: "audio-only transcode",
+    PATH_FULL: "full transcode",
+    'hls': "HLS ladder",
+}
+
+
+def partial_output_path(output_path):
+    """Temporary path an MP4 is written to before being renamed to output_path."""
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, f".{name}{PARTIAL_SUFFIX}")
+
+
+def convert_to_mp4(input_path, output_path, threads=None, total_duration=None, progress_board=None,
+                   info=None, profile=DEFAULT_PROFILE, analyze=False, segments=None):
+    """
+    Converts a video file to MP4 format using ffmpeg with progress monitoring.
+    The source is probed first (unless info is passed in) and streams that are
+    already browser compatible are copied instead of re-encoded.
+    threads caps the number of encoder threads ffmpeg may use (None = ffmpeg default).
+    total_duration may be passed in when already probed. When progress_board is
+    given, progress is reported to it instead of drawing a per-file bar.
+    profile names the ENCODE_PROFILES entry used when the video is re-encoded;
+    with analyze set, its CRF is tuned for the title from sample encodes.
+    segments enables segment-parallel encoding of long sources (see
+    encode_segmented): the number of ffmpeg processes, 0 to derive it from
+    threads, None to encode in one process.
+    The MP4 appears at output_path only once it is complete.
+    Returns the conversion path taken (PATH_COPY, PATH_AUDIO or PATH_FULL)
+    on success, False on failure.
+    """
+    input_filename = os.path.basename(input_path)
+
+    if info is None:
         try:
-            # delete=False so the file is not deleted immediately when closed
-            temp_progress_file = tempfile.NamedTemporaryFile(
-                delete=False, suffix=".progress")
-            progress_filepath = temp_progress_file.name
-            # IMPORTANT: Close the file handle immediately so FFmpeg can write to it
-            temp_progress_file.close()
-        except Exception as e:
-            print(
-                f"\nWarning: Could not create temporary progress file: {e}. Conversion will proceed without a progress bar.", file=sys.stderr)
-            show_progress = False
+            info = probe_video(input_path, with_keyframes=False)
+        except (ProbeError, FileNotFoundError) as e:
+            log(f"Could not probe '{input_filename}' ({e}); doing a full transcode.", file=sys.stderr)
+    if total_duration is None and info:
+        total_duration = info.get('duration')
+
+    settings = ENCODE_PROFILES[profile]
+    path, codec_args = choose_conversion_path(info, settings)
+    description = PATH_DESCRIPTIONS[path]
+    if path == PATH_FULL:
+        crf = settings['crf']
+        if analyze:
+            log(f"Analysing '{input_filename}' to pick a CRF...")
+            analysis = analyze_crf(input_path, total_duration, settings, threads)
+            if analysis is not None:
+                crf, ssim = analysis
+                path, codec_args = choose_conversion_path(info, settings, crf)
+                log(f"'{input_filename}': CRF {crf} (sample SSIM {ssim:.4f}, "
+                    f"target {settings['target_ssim']})")
+        description += f", {profile} profile, CRF {crf}"
+    log(f"Converting '{input_filename}' ({description})...")
+
+    partial_path = partial_output_path(output_path)
+
+    def cleanup():
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    if (path == PATH_FULL and segments is not None and total_duration
+            and total_duration >= SEGMENT_MIN_DURATION):
+        processes = segments or max(1, (threads or os.cpu_count() or 1) // SEGMENT_THREADS)
+        if processes > 1:
+            if not encode_segmented(input_path, partial_path, codec_args, total_duration,
+                                    processes, threads, progress_board):
+                cleanup()
+                return False
+            os.replace(partial_path, output_path)
+            return path
 
     # FFmpeg command to convert to MP4
     ffmpeg_command = [
         'ffmpeg',
         '-i', input_path,
-        # Use libx264 for H.264 encoding. REQUIRES FFmpeg built with libx264 support.
-        '-c:v', 'libx264',
-        '-c:a', 'aac',
-        '-vf', 'format=yuv420p',  # Ensure YUV 4:2:0 pixel format
+        # First video and (if present) first audio stream; subtitle and data
+        # streams of MKV sources can't always be stored in MP4
+        '-map', '0:v:0', '-map', '0:a:0?',
+    ] + codec_args + [
         '-movflags', '+faststart',
         '-y',  # Overwrite output file without asking
         '-loglevel', 'error',  # Suppress verbose ffmpeg output, only show errors
     ]
 
-    # Add the progress flag if we are showing progress
-    if show_progress and progress_filepath:
-        ffmpeg_command.extend(['-progress', progress_filepath])
-        # If using -progress, ffmpeg sends progress to the file and other messages
-        # might still go to stderr. We suppress most output with -loglevel error.
-    else:
-        # If not showing progress, capture stderr for error reporting in case of failure
-        pass  # capture_output=True will be handled by subprocess.run args
+    # Per-job thread budget so parallel jobs don't oversubscribe the CPU
+    if threads and path != PATH_COPY:
+        ffmpeg_command.extend(['-threads', str(threads)])
+
+    # Write to a temporary file (the extension no longer says MP4, so name the
+    # muxer) and rename it into place once complete
+    ffmpeg_command.extend(['-f', 'mp4', partial_path])
+
+    if not run_ffmpeg(ffmpeg_command, input_path, total_duration, progress_board, cleanup):
+        return False
+    os.replace(partial_path, output_path)
+    return path
+
+
+class SegmentProgress:
+    """
+    Progress of a segment-parallel encode. run_ffmpeg reports each piece to it
+    as it would to a ProgressBoard; the percentage of the whole title
+    (weighted by piece duration) goes to the real board under the title's
+    name, or to the single-file progress bar when there is no board.
+    """
 
-    # Add the output file path
-    ffmpeg_command.append(output_path)
+    def __init__(self, name, weights, progress_board=None):
+        self.name = name
+        self.weights = weights  # piece name -> duration (or share of the work)
+        self.total = sum(weights.values()) or 1
+        self.progress_board = progress_board
+        self._percentages = {}
+        self._last_drawn = -1
+        self._lock = threading.Lock()
 
-    # Event to signal the progress monitoring thread to stop
-    stop_event = threading.Event()
-    progress_thread = None
+    def update(self, piece, percentage):
+        with self._lock:
+            self._percentages[piece] = percentage
+            done = sum(pct / 100 * self.weights.get(name, 0)
+                       for name, pct in self._percentages.items())
+            overall = min(100.0, done / self.total * 100)
+            if self.progress_board is not None:
+                self.progress_board.update(self.name, overall)
+            elif overall - self._last_drawn >= 0.1 or overall == 100:
+                draw_progress_bar(overall)
+                self._last_drawn = overall
 
+
+def split_at_keyframes(input_path, work_dir, total_duration, pieces):
+    """
+    Splits the first video stream of input_path into `pieces` parts of about
+    equal length without re-encoding (the segment muxer cuts at the first
+    keyframe after each cut point, so every part starts with a keyframe).
+    Returns [(path, duration), ...] in order, or None on failure.
+    """
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    cut_points = ','.join(f'{total_duration * i / pieces:.3f}' for i in range(1, pieces))
+    list_path = os.path.join(work_dir, 'pieces.csv')
     try:
-        # Start the progress monitoring thread if showing progress
-        if show_progress and progress_filepath:
-            progress_thread = threading.Thread(target=monitor_ffmpeg_progress, args=(
-                progress_filepath, total_duration, stop_event))
-            progress_thread.start()
-
-        # Execute the ffmpeg command
-        # Capture output only if NOT showing progress, otherwise let stderr pass through
-        # (suppressed by -loglevel error)
-        if show_progress:
-            # Let stderr go to console for real errors (suppressed by -loglevel error)
-            # stdout is typically not used by ffmpeg for regular output when converting
-            # check=True raises CalledProcessError on non-zero exit code
-            process = subprocess.run(ffmpeg_command, check=True)
-        else:
-            # Capture stdout/stderr for error reporting if progress is not shown
-            process = subprocess.run(
-                ffmpeg_command, capture_output=True, text=True, check=True)
-
-        # If we reach here, ffmpeg finished successfully
-        # The progress monitor thread should have printed the final 100% and a newline
-        # If progress wasn't shown, print a simple success message
-        if not show_progress:
-            # Print success if no progress bar was shown
-            print(f"Successfully converted '{input_filename}'.")
+        subprocess.run([
+            'ffmpeg', '-i', input_path,
+            '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_format', 'matroska',
+            '-segment_times', cut_points,
+            '-reset_timestamps', '1',
+            '-segment_list', list_path, '-segment_list_type', 'csv',
+            '-y', '-loglevel', 'error',
+            os.path.join(work_dir, f'{base}.%03d.mkv'),
+        ], capture_output=True, text=True, errors='replace', check=True)
+        # One line per piece: file name,start time,end time
+        result = []
+        with open(list_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                name, start, end = line.strip().rsplit(',', 2)
+                result.append((os.path.join(work_dir, os.path.basename(name)),
+                               float(end) - float(start)))
+        return result
+    except FileNotFoundError:
+        log("Error: ffmpeg command not found.", file=sys.stderr)
+    except subprocess.CalledProcessError as e:
+        log(f"Error splitting '{os.path.basename(input_path)}': {e.stderr.strip()}",
+            file=sys.stderr)
+    except (OSError, ValueError) as e:
+        log(f"Error reading the piece list of '{os.path.basename(input_path)}': {e}",
+            file=sys.stderr)
+    return None
+
 
+def encode_segmented(input_path, output_path, codec_args, total_duration, processes, threads=None,
+                     progress_board=None):
+    """
+    Encodes one long video with several ffmpeg processes at once: x264 stops
+    scaling after a handful of threads, so a multi-hour title encoded as
+    one job leaves most cores of a big machine idle.
+
+    The video stream is split at keyframes (stream copy) into 2 x processes
+    pieces, the pieces are encoded with the video part of codec_args by
+    `processes` concurrent ffmpeg runs, and the encoded pieces are joined
+    with the concat demuxer (stream copy) while the audio is taken from the
+    source with the audio part of codec_args. The result is written to
+    output_path as a faststart MP4. Returns True on success, False on failure.
+    """
+    input_filename = os.path.basename(input_path)
+    audio_index = codec_args.index('-c:a')
+    video_args, audio_args = codec_args[:audio_index], codec_args[audio_index:]
+    pieces = max(2, min(processes * 2, int(total_duration // SEGMENT_MIN_PIECE)))
+    piece_threads = max(1, (threads or os.cpu_count() or 1) // processes)
+
+    work_dir = tempfile.mkdtemp(prefix='segments-', dir=SEGMENT_WORK_DIR)
+    try:
+        log(f"Splitting '{input_filename}' into {pieces} pieces for "
+            f"{processes} parallel encodes...")
+        sources = split_at_keyframes(input_path, work_dir, total_duration, pieces)
+        if not sources:
+            return False
+
+        # Joining the pieces is counted as 2% of the work
+        concat_path = os.path.join(work_dir, 'concat.txt')
+        weights = {os.path.basename(path): duration for path, duration in sources}
+        weights[os.path.basename(concat_path)] = total_duration * 0.02
+        progress = SegmentProgress(input_filename, weights, progress_board)
+        failed = threading.Event()
+
+        def encode_piece(source_path, duration):
+            if failed.is_set():
+                return None  # Another piece failed; don't waste the time
+            encoded_path = os.path.splitext(source_path)[0] + '.encoded.mkv'
+            command = ['ffmpeg', '-i', source_path, '-map', '0:v:0'] + video_args + [
+                '-threads', str(piece_threads),
+                '-y', '-loglevel', 'error',
+                encoded_path]
+            if not run_ffmpeg(command, source_path, duration, progress):
+                failed.set()
+                return None
+            return encoded_path
+
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            encoded = list(executor.map(lambda piece: encode_piece(*piece), sources))
+        if failed.is_set() or None in encoded:
+            return False
+
+        with open(concat_path, 'w', encoding='utf-8') as f:
+            for path in encoded:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        command = [
+            'ffmpeg',
+            '-f', 'concat', '-safe', '0', '-i', concat_path,
+            '-i', input_path,
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy',
+        ] + audio_args + [
+            '-movflags', '+faststart',
+            '-y', '-loglevel', 'error',
+            '-f', 'mp4', output_path,
+        ]
+        if not run_ffmpeg(command, concat_path, total_duration, progress):
+            return False
+        if progress_board is None:
+            # Move past the progress bar
+            sys.stdout.write('\n')
+            sys.stdout.flush()
         return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-    except subprocess.CalledProcessError as e:
-        print(f"\nError converting '{input_filename}'.", file=sys.stderr)
-        if not show_progress:  # Only print captured output if not showing progress bar
-            print(f"ffmpeg stdout: {e.stdout}", file=sys.stderr)
-            print(f"ffmpeg stderr: {e.stderr}", file=sys.stderr)
-        # Clean up the partially created output file if conversion failed
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        return False
-    except FileNotFoundError:
-        print(f"\nError: ffmpeg command not found.", file=sys.stderr)
-        print("Please ensure ffmpeg is installed and accessible in your system's PATH.", file=sys.stderr)
+
+def _bitrate_kbps(bitrate):
+    return int(bitrate.rstrip('k'))
+
+
+def build_hls_command(input_path, build_dir, ladder, has_audio, threads=None,
+                      preset=ENCODE_PROFILES[DEFAULT_PROFILE]['preset']):
+    """
+    Builds the ffmpeg command that encodes every rung of `ladder` in one pass
+    and packages them as fMP4 (CMAF) HLS segments plus a master playlist in
+    build_dir/<rung name>/. The rungs have fixed bitrates; preset is the x264
+    speed/compression trade-off of the encoding profile.
+    """
+    split = ''.join(f'[v{i}]' for i in range(len(ladder)))
+    filters = [f'[0:v]split={len(ladder)}{split}']
+    for i, (_, height, _, _) in enumerate(ladder):
+        filters.append(f'[v{i}]scale=-2:{height},format=yuv420p[v{i}out]')
+
+    ffmpeg_command = [
+        'ffmpeg',
+        '-i', input_path,
+        '-filter_complex', ';'.join(filters),
+    ]
+
+    stream_map = []
+    for i, (name, _, video_bitrate, audio_bitrate) in enumerate(ladder):
+        kbps = _bitrate_kbps(video_bitrate)
+        ffmpeg_command.extend([
+            '-map', f'[v{i}out]',
+            f'-c:v:{i}', 'libx264',
+            f'-b:v:{i}', video_bitrate,
+            f'-maxrate:v:{i}', f'{int(kbps * 1.07)}k',
+            f'-bufsize:v:{i}', f'{int(kbps * 1.5)}k',
+        ])
+        entry = f'v:{i}'
+        if has_audio:
+            ffmpeg_command.extend([
+                '-map', '0:a:0',
+                f'-c:a:{i}', 'aac',
+                f'-b:a:{i}', audio_bitrate,
+            ])
+            entry += f',a:{i}'
+        stream_map.append(f'{entry},name:{name}')
+
+    ffmpeg_command.extend([
+        '-preset', preset,
+        # Aligned keyframes on segment boundaries in every rendition
+        '-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})',
+        '-sc_threshold', '0',
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        '-hls_flags', 'independent_segments',
+        '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_segment_filename', os.path.join(build_dir, '%v', 'seg_%05d.m4s'),
+        '-master_pl_name', 'master.m3u8',
+        '-var_stream_map', ' '.join(stream_map),
+        '-y',
+        '-loglevel', 'error',
+    ])
+    if threads:
+        ffmpeg_command.extend(['-threads', str(threads)])
+    ffmpeg_command.append(os.path.join(build_dir, '%v', 'index.m3u8'))
+    return ffmpeg_command
+
+
+def publish_hls_master(title_dir, build_id):
+    """
+    Copies the master playlist of a finished build up to title_dir/master.m3u8,
+    rewriting the variant URIs to point into the build directory. The file is
+    replaced atomically, so players never see a half-written playlist.
+
+    Every build lives in its own directory, so segment and variant playlist
+    URLs never change content and can be cached forever; only the top-level
+    master playlist changes when a title is re-encoded.
+    """
+    build_master = os.path.join(title_dir, build_id, 'master.m3u8')
+    with open(build_master, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    rewritten = []
+    for line in lines:
+        if line and not line.startswith('#'):
+            line = f'{build_id}/{line}'
+        rewritten.append(line)
+
+    temp_path = os.path.join(title_dir, 'master.m3u8.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(rewritten) + '\n')
+    os.replace(temp_path, os.path.join(title_dir, 'master.m3u8'))
+
+
+def convert_to_hls(input_path, title_dir, threads=None, total_duration=None, progress_board=None,
+                   ladder=HLS_LADDER, profile=DEFAULT_PROFILE):
+    """
+    Encodes a video into an adaptive bitrate ladder of HLS/CMAF renditions
+    under title_dir, with the x264 preset of the encoding profile.
+    Returns True on success, False on failure.
+    """
+    input_filename = os.path.basename(input_path)
+    log(f"Packaging '{input_filename}' as HLS...")
+
+    try:
+        info = probe_video(input_path, with_keyframes=False)
+    except (ProbeError, FileNotFoundError) as e:
+        log(f"\nError probing '{input_filename}': {e}", file=sys.stderr)
         return False
-    except Exception as e:
-        print(
-            f"\nAn unexpected error occurred during conversion of '{input_filename}': {e}", file=sys.stderr)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+
+    source_height = info.get('height') or 0
+    # Never upscale; always keep at least the smallest rung
+    rungs = [rung for rung in ladder if rung[1] <= source_height] or [ladder[-1]]
+
+    build_id = f"v{int(time.time())}"
+    build_dir = os.path.join(title_dir, build_id)
+    for name, _, _, _ in rungs:
+        os.makedirs(os.path.join(build_dir, name), exist_ok=True)
+
+    ffmpeg_command = build_hls_command(
+        input_path, build_dir, rungs, bool(info.get('audio_codec')), threads,
+        ENCODE_PROFILES[profile]['preset'])
+
+    def cleanup():
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    if total_duration is None:
+        total_duration = info.get('duration')
+    if not run_ffmpeg(ffmpeg_command, input_path, total_duration, progress_board, cleanup):
         return False
-    finally:
-        # Signal the progress thread to stop and wait for it to finish
-        if progress_thread and progress_thread.is_alive():
-            stop_event.set()
-            progress_thread.join(timeout=5)  # Join with a timeout
 
-        # Clean up the temporary progress file
-        if progress_filepath and os.path.exists(progress_filepath):
-            try:
-                os.remove(progress_filepath)
-            except OSError as e:
-                print(
-                    f"\nWarning: Could not delete temporary progress file {progress_filepath}: {e}", file=sys.stderr)
+    publish_hls_master(title_dir, build_id)
+    return True
+
 
+def done_marker_path(converted_path, mode='mp4'):
+    """The file whose existence means a conversion to converted_path finished."""
+    if mode == 'hls':
+        # The master playlist is only published after a complete build
+        return os.path.join(converted_path, 'master.m3u8')
+    return converted_path
 
-def main():
+
+# Space set aside on library roots for outputs that were placed but aren't
+# written yet, so a batch of new sources is spread over the roots instead of
+# all landing on the one that had the most free space when they were queued:
+# output filename -> (root directory, expected size in bytes)
+_reservations = {}
+_reservations_lock = threading.Lock()
+
+
+def _free_space(directory):
+    try:
+        return shutil.disk_usage(directory).free
+    except OSError:
+        return None  # Missing or unmounted root
+
+
+def least_loaded_root(filename, expected_size):
     """
-    Finds video files in VIDEO_DIR, lists those needing conversion,
-    and converts them to MP4 in CONVERTED_DIR one by one with a progress bar
-    for the current file.
+    Picks the library root a new MP4 called filename is written to: the one
+    with the most free space once the space reserved for outputs still to be
+    written is taken off, and reserves expected_size bytes there. Asking again
+    for the same filename returns the same root.
     """
-    print("Starting video conversion process...")
+    with _reservations_lock:
+        for name, (directory, _) in list(_reservations.items()):
+            if os.path.exists(os.path.join(directory, name)):
+                del _reservations[name]  # Written: disk_usage accounts for it now
+        if filename in _reservations:
+            return _reservations[filename][0]
 
-    files_to_convert = []
+        reserved = {}
+        for directory, size in _reservations.values():
+            reserved[directory] = reserved.get(directory, 0) + size
+        best, best_free = None, None
+        for directory in LIBRARY_ROOTS.values():
+            free = _free_space(directory)
+            if free is None:
+                continue
+            free -= reserved.get(directory, 0)
+            if best is None or free > best_free:
+                best, best_free = directory, free
+        if best is None:
+            best = next(iter(LIBRARY_ROOTS.values()))  # ffmpeg reports the actual error
+        _reservations[filename] = (best, expected_size)
+        return best
+
+
+def reserve_root(output_path, expected_size):
+    """Reserves expected_size bytes for output_path on its root (replacing any reservation of its name)."""
+    with _reservations_lock:
+        _reservations[os.path.basename(output_path)] = (os.path.dirname(output_path), expected_size)
+
+
+def release_root(output_path):
+    """Drops the reservation of output_path's name (nothing is going to be written there)."""
+    with _reservations_lock:
+        _reservations.pop(os.path.basename(output_path), None)
+
+
+def _expected_size(original_path):
+    try:
+        # The MP4 is rarely bigger than its source
+        return os.path.getsize(original_path)
+    except OSError:
+        return 0
+
+
+def conversion_target(original_path, mode='mp4'):
+    """
+    Returns where original_path is converted to (the MP4 in one of the
+    library roots, or the title's directory under HLS_DIR in 'hls' mode), or
+    None if the file isn't converted in this mode (unsupported format, or
+    already an MP4). An MP4 already on any root is used where it is; a new
+    one goes to the least loaded root (see least_loaded_root).
+    """
+    filename_base, file_extension = os.path.splitext(os.path.basename(original_path))
+    file_extension = file_extension.lower()
+
+    # Skip if it's already an MP4 in the original directory
+    # (MP4 sources still get packaged in HLS mode)
+    if file_extension == '.mp4' and mode != 'hls':
+        return None
+
+    # Check if the file extension is supported for conversion
+    if file_extension not in SUPPORTED_INPUT_EXTENSIONS and file_extension != '.mp4':
+        return None
+
+    if mode == 'hls':
+        return os.path.join(HLS_DIR, filename_base)
+    filename = f"{filename_base}.mp4"
+    for directory in LIBRARY_ROOTS.values():
+        if os.path.exists(os.path.join(directory, filename)):
+            return os.path.join(directory, filename)
+    return os.path.join(least_loaded_root(filename, _expected_size(original_path)), filename)
+
+
+def find_files_to_convert(mode='mp4'):
+    """
+    Walks VIDEO_DIR and returns (candidates, skipped_count), where candidates
+    is a list of (original_path, converted_path, filename) for every source
+    that can be converted. Whether each one still needs work is decided by
+    enqueue_files() from the job queue.
+    In 'hls' mode converted_path is the title's directory under HLS_DIR.
+    """
+    candidates = []
     skipped_count = 0
 
-    # First pass: Identify files that need conversion and count them
-    print("Scanning for videos to convert...")
     for root, _, files in os.walk(VIDEO_DIR):
         for filename in files:
             original_path = os.path.join(root, filename)
-            filename_base, file_extension = os.path.splitext(filename)
-            file_extension = file_extension.lower()
-
-            # Determine the output path in the converted directory
-            converted_filename = f"{filename_base}.mp4"
-            converted_path = os.path.join(CONVERTED_DIR, converted_filename)
-
-            # Skip if it's already an MP4 in the original directory
-            if file_extension == '.mp4':
+            converted_path = conversion_target(original_path, mode)
+            if converted_path is None:
                 skipped_count += 1
                 continue
+            candidates.append((original_path, converted_path, filename))
 
-            # Check if the file extension is supported for conversion
-            if file_extension not in SUPPORTED_INPUT_EXTENSIONS:
-                skipped_count += 1
+    return candidates, skipped_count
+
+
+def _probe_or_none(path):
+    try:
+        return probe_video(path, with_keyframes=False)
+    except (ProbeError, FileNotFoundError) as e:
+        log(f"Error probing {os.path.basename(path)}: {e}", file=sys.stderr)
+        return None
+
+
+def probe_sources(paths, workers):
+    """
+    Probes every path (duration, codecs, ...) with a small pool of ffprobe
+    processes. Returns a dict path -> probe_video() result (None if probing failed).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(paths, executor.map(_probe_or_none, paths)))
+
+
+def _legacy_output_complete(source_info, output_path):
+    """
+    True if an MP4 produced before the job queue existed looks complete: it
+    probes fine and is about as long as its source. A conversion killed
+    midway (before outputs were renamed into place) fails one of the two.
+    """
+    try:
+        output_info = probe_video(output_path, with_keyframes=False)
+    except (ProbeError, FileNotFoundError):
+        return False
+    if not source_info or not source_info.get('duration'):
+        return True  # Nothing to compare against
+    return output_info['duration'] >= source_info['duration'] * LEGACY_MIN_DURATION_RATIO
+
+
+def enqueue_files(queue, candidates, mode='mp4', workers=1):
+    """
+    Brings the job queue up to date with the sources found on disk:
+    new sources become pending jobs (prioritised by duration, with their probe
+    results stored for the converter), finished jobs whose output has since
+    disappeared are queued again, and outputs from before the queue existed
+    are checked and recorded as done or redone.
+    Returns a dict of counts: queued, requeued, done, failed.
+    """
+    counts = {'queued': 0, 'requeued': 0, 'done': 0, 'failed': 0}
+    unknown = []
+    for original_path, converted_path, filename in candidates:
+        job = queue.get(original_path, mode)
+        if job is not None:
+            placed_path = converted_path
+            converted_path = job['output']  # Placed when the job was queued
+        finished = os.path.exists(done_marker_path(converted_path, mode))
+        if job is None:
+            unknown.append((original_path, converted_path, finished))
+            continue
+        if job['state'] == DONE:
+            if finished:
+                counts['done'] += 1
+            else:
+                queue.requeue(original_path, mode)
+                counts['requeued'] += 1
+        elif job['state'] == FAILED:
+            counts['failed'] += 1
+        # pending/running jobs are picked up by run_conversions
+
+        # conversion_target may just have reserved space for a new placement;
+        # keep a reservation only for the job's own output, if it will be written
+        if mode == 'mp4':
+            if job['state'] in (PENDING, RUNNING) or (job['state'] == DONE and not finished):
+                reserve_root(converted_path, _expected_size(original_path))
+            else:
+                release_root(placed_path)
+
+    if not unknown:
+        return counts
+
+    log(f"Probing {len(unknown)} new file(s)...")
+    infos = probe_sources([original for original, _, _ in unknown], workers)
+    for original_path, converted_path, finished in unknown:
+        info = infos.get(original_path)
+        priority = (info or {}).get('duration') or 0
+        if finished and (mode == 'hls' or _legacy_output_complete(info, converted_path)):
+            queue.enqueue(original_path, mode, converted_path, priority, info, state=DONE)
+            counts['done'] += 1
+            continue
+        if finished:
+            log(f"'{os.path.basename(converted_path)}' looks incomplete; converting again.")
+        queue.enqueue(original_path, mode, converted_path, priority, info)
+        counts['queued'] += 1
+    return counts
+
+
+def run_conversions(queue, workers, threads, mode='mp4', thumbnails=True, on_complete=None,
+                    profile=DEFAULT_PROFILE, analyze=False, segments=None):
+    """
+    Works through the pending jobs of `mode` in the job queue with up to
+    `workers` concurrent ffmpeg processes, each limited to `threads` encoder
+    threads. Jobs are claimed longest first so the biggest files don't end up
+    running alone at the end (shorter total makespan). A failed job goes back
+    to the queue with a backoff and is retried by whichever worker is free
+    when it is due, until it runs out of attempts.
+    With thumbnails set, each converted MP4 also gets its posters and
+    seek-preview sprites (in the same worker, so they're made in parallel).
+    on_complete, if given, is called with each finished job (from the worker thread).
+    profile and analyze are the encoding defaults; a PROFILE_FILENAME file in a
+    source's directory (or a parent up to VIDEO_DIR) overrides them.
+    segments is passed on to convert_to_mp4 (segment-parallel encoding of long
+    sources; the pieces share the job's thread budget).
+    Returns (converted_count, error_count, paths) where paths maps each
+    converted filename to the conversion path it took.
+    """
+    pending = queue.pending_jobs(mode)
+    expected = {job['source'] for job in pending}
+    board = ProgressBoard(len(pending), sum(job['priority'] for job in pending))
+    counts_lock = threading.Lock()
+    converted_count = 0
+    error_count = 0
+    paths = {}
+
+    def run_job(job):
+        original_path = job['source']
+        converted_path = job['output']
+        filename = os.path.basename(original_path)
+        info = job['info']
+        duration = (info or {}).get('duration')
+        job_profile, job_analyze = profile_for(original_path, VIDEO_DIR, profile, analyze)
+        board.add_job(filename, duration)
+        try:
+            if mode == 'hls':
+                ok = convert_to_hls(original_path, converted_path, threads=threads,
+                                    total_duration=duration, progress_board=board,
+                                    profile=job_profile)
+            else:
+                ok = convert_to_mp4(original_path, converted_path, threads=threads,
+                                    total_duration=duration, progress_board=board,
+                                    info=info, profile=job_profile, analyze=job_analyze,
+                                    segments=segments)
+        except Exception as e:
+            log(f"Unexpected error converting '{filename}': {e}", file=sys.stderr)
+            ok = False
+        finally:
+            board.finish_job(filename)
+        return ok
+
+    def worker():
+        nonlocal converted_count, error_count
+        while True:
+            job = queue.claim(mode)
+            if job is None:
+                wait = queue.seconds_until_next(mode)
+                if wait is None:
+                    return  # Nothing left to do
+                # Every pending job is backing off; wait until one is due
+                time.sleep(min(wait, 5))
                 continue
 
-            # Check if the converted MP4 file already exists
-            if os.path.exists(converted_path):
-                skipped_count += 1
+            filename = os.path.basename(job['source'])
+            if job['source'] not in expected:
+                # Queued after this run started (e.g. by the watcher)
+                expected.add(job['source'])
+                board.extend((job['info'] or {}).get('duration'))
+            result = run_job(job)
+            if result:
+                if thumbnails and mode == 'mp4':
+                    # A failed thumbnail doesn't fail the conversion
+                    generate_thumbnails(job['output'])
+                queue.complete(job, result if isinstance(result, str) else mode)
+                log(f"Finished converting '{filename}'.")
+                if on_complete is not None:
+                    on_complete(job)
+                with counts_lock:
+                    paths[filename] = result if isinstance(result, str) else mode
+                    converted_count += 1
                 continue
 
-            # If none of the skip conditions met, add to the list to convert
-            files_to_convert.append((original_path, converted_path, filename))
+            # Error message already printed by convert_to_mp4
+            state = queue.fail(job, f"conversion failed (attempt {job['attempts']})")
+            if state == PENDING:
+                board.extend((job['info'] or {}).get('duration'))
+                wait = queue.get(job['source'], mode)['next_attempt_at'] - time.time()
+                log(f"Failed to convert '{filename}'; retrying in {wait:.0f}s.", file=sys.stderr)
+            else:
+                log(f"Failed to convert '{filename}' after {job['attempts']} attempt(s); giving up.",
+                    file=sys.stderr)
+                with counts_lock:
+                    error_count += 1
+
+    # Keeps the leases of this process's running jobs alive, so another
+    # process sharing the queue doesn't take them over (JobQueue.recover)
+    stop_renewing = threading.Event()
+
+    def renew_leases():
+        while not stop_renewing.wait(LEASE_SECONDS / 3):
+            queue.renew()
+
+    board.start()
+    renewer = threading.Thread(target=renew_leases, name='job-lease-renewer', daemon=True)
+    renewer.start()
+    try:
+        worker_threads = [threading.Thread(target=worker, name=f"convert-worker-{i}")
+                          for i in range(workers)]
+        for thread in worker_threads:
+            thread.start()
+        for thread in worker_threads:
+            thread.join()
+    finally:
+        stop_renewing.set()
+        board.stop()
+
+    return converted_count, error_count, paths
+
+
+def add_encoding_args(parser):
+    """Adds the encoding profile options (shared with watcher.py)."""
+    parser.add_argument('-p', '--profile', choices=sorted(ENCODE_PROFILES), default=DEFAULT_PROFILE,
+                        help="encoding profile for re-encoded videos: "
+                             + '; '.join(f"{name}: {settings['description']}"
+                                         for name, settings in ENCODE_PROFILES.items())
+                             + f" (default: {DEFAULT_PROFILE}; a {PROFILE_FILENAME} file in "
+                               f"a source directory overrides it)")
+    parser.add_argument('--analyze', action='store_true',
+                        help="pick each title's CRF from short sample encodes scored "
+                             "with SSIM against the source")
+    parser.add_argument('--parallel-segments', metavar='N', type=int, nargs='?', const=0,
+                        default=None,
+                        help=f"split sources longer than {SEGMENT_MIN_DURATION // 60} minutes "
+                             f"at keyframes and encode the pieces with N ffmpeg processes at "
+                             f"once (default N: the job's threads / {SEGMENT_THREADS}); "
+                             f"best combined with -w 1")
+
+
+def add_telemetry_args(parser):
+    """Adds the transcode telemetry options (shared with watcher.py)."""
+    parser.add_argument('--telemetry-log', metavar='PATH', default=None,
+                        help="append per-job progress and throughput events as JSON "
+                             "lines to PATH ('-' for stdout)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on http://0.0.0.0:PORT/metrics")
+
+
+def setup_telemetry(args):
+    if args.telemetry_log:
+        telemetry.open_log(args.telemetry_log)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+        print(f"Serving transcode metrics on port {args.metrics_port} (/metrics).")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert videos in VIDEO_DIR to MP4 in the library roots.")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"number of concurrent ffmpeg jobs (default: {DEFAULT_WORKERS})")
+    parser.add_argument('-t', '--threads', type=int, default=None,
+                        help="encoder threads per job (default: CPU count / workers)")
+    parser.add_argument('-m', '--mode', choices=['mp4', 'hls'], default='mp4',
+                        help="'mp4' for a single H.264 file, 'hls' for an adaptive "
+                             "bitrate ladder of HLS/CMAF renditions in HLS_DIR")
+    parser.add_argument('--no-thumbnails', action='store_true',
+                        help="don't generate posters and seek-preview sprites")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="give jobs that ran out of attempts another try")
+    add_encoding_args(parser)
+    add_telemetry_args(parser)
+    return parser.parse_args(argv)
+
 
-    total_videos_to_convert = len(files_to_convert)
+def main(argv=None):
+    """
+    Finds video files in VIDEO_DIR, records those needing conversion in the
+    persistent job queue, and converts them to MP4 in the library roots using a
+    pool of concurrent ffmpeg workers with an aggregate progress display.
+    Jobs left unfinished by an earlier run (crash, reboot, Ctrl+C) are resumed.
+    """
+    args = parse_args(argv)
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+
+    print("Starting video conversion process...")
+    setup_telemetry(args)
+
+    if args.mode == 'hls' and not os.path.exists(HLS_DIR):
+        os.makedirs(HLS_DIR)
+        print(f"Created directory for HLS output: {HLS_DIR}")
+
+    queue = JobQueue()
+    # Jobs still marked running were interrupted when the last run died
+    recovered = queue.recover()
+    if recovered:
+        print(f"Resuming {recovered} job(s) interrupted by a previous run.")
+
+    # First pass: Identify files that need conversion and queue them
+    print("Scanning for videos to convert...")
+    candidates, skipped_count = find_files_to_convert(args.mode)
+    counts = enqueue_files(queue, candidates, args.mode, workers * 2)
+    if args.retry_failed:
+        for original_path, _, _ in candidates:
+            job = queue.get(original_path, args.mode)
+            if job and job['state'] == FAILED:
+                queue.requeue(original_path, args.mode)
+                counts['failed'] -= 1
+
+    total_videos_to_convert = len(queue.pending_jobs(args.mode))
     print(f"Found {total_videos_to_convert} video(s) needing conversion.")
+    if counts['requeued']:
+        print(f"  ({counts['requeued']} converted before but their output is missing)")
+    skipped_count += counts['done']
     if skipped_count > 0:
         print(
             f"Skipped {skipped_count} file(s) (already MP4 or unsupported format or already converted).")
+    if counts['failed']:
+        print(f"Not retrying {counts['failed']} file(s) that failed repeatedly "
+              f"(use --retry-failed).")
 
     if total_videos_to_convert == 0:
         print("No videos to convert. Exiting.")
         return
 
-    print("\nStarting conversions:")
-    converted_count = 0
-    error_count = 0
+    print(
+        f"\nStarting conversions ({workers} worker(s), {threads} thread(s) per job, "
+        f"{args.profile} profile{', per-title CRF' if args.analyze else ''}):")
 
-    # Second pass: Perform the conversions one by one
-    for i, (original_path, converted_path, filename) in enumerate(files_to_convert):
-        current_video_number = i + 1
-        print(
-            f"\n--- Converting file {current_video_number} of {total_videos_to_convert}: '{filename}' ---")
-
-        if convert_to_mp4(original_path, converted_path):
-            # Print success message after the progress bar line
-            print(f"Finished converting '{filename}'.")
-            converted_count += 1
-        else:
-            # Error message already printed by convert_to_mp4
-            print(f"Failed to convert '{filename}'.", file=sys.stderr)
-            error_count += 1
+    # Second pass: Perform the conversions in parallel
+    converted_count, error_count, paths = run_conversions(
+        queue, workers, threads, args.mode, not args.no_thumbnails,
+        profile=args.profile, analyze=args.analyze, segments=args.parallel_segments)
 
     print("\nConversion process finished.")
     print(f"Total videos processed: {total_videos_to_convert}")
     print(f"Converted successfully: {converted_count}")
     print(f"Failed conversions: {error_count}")
+    for path, description in PATH_DESCRIPTIONS.items():
+        count = sum(1 for taken in paths.values() if taken == path)
+        if count:
+            print(f"  {description}: {count}")
+    for filename in sorted(paths):
+        print(f"    [{paths[filename]}] {filename}")
     print(f"Files skipped (already processed or unsupported): {skipped_count}")
 
 
@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+
+# Named x264 encoding profiles for convert_videos.py. Each one gives:
+#   preset        x264 speed/compression trade-off
+#   crf           constant rate factor used when the title isn't analysed
+#   crf_range     lowest and highest CRF the per-title analysis may pick
+#   target_ssim   quality the analysis aims for (SSIM against the source, 0-1)
+#   audio_bitrate AAC bitrate when the audio has to be transcoded
+ENCODE_PROFILES = {
+    # Quick turnaround (new arrivals, slow machines); bigger files
+    'speed': {
+        'description': "fast encode, larger files",
+        'preset': 'veryfast',
+        'crf': 24,
+        'crf_range': (20, 30),
+        'target_ssim': 0.970,
+        'audio_bitrate': '128k',
+    },
+    # Library default: a quicker preset than x264's own default (medium)
+    # with the same CRF, so encodes are faster at about the same size
+    'balanced': {
+        'description': "good quality at a reasonable encode time",
+        'preset': 'fast',
+        'crf': 23,
+        'crf_range': (18, 28),
+        'target_ssim': 0.980,
+        'audio_bitrate': '128k',
+    },
+    # Keepers: slow preset and low CRF, spending CPU to keep detail
+    'archival': {
+        'description': "slow encode, near-transparent quality",
+        'preset': 'slow',
+        'crf': 18,
+        'crf_range': (14, 22),
+        'target_ssim': 0.990,
+        'audio_bitrate': '192k',
+    },
+}
+DEFAULT_PROFILE = 'balanced'
+
+# A file with this name in a source directory sets the profile for the videos
+# in it and below (the nearest one wins over the command line). It holds the
+# profile name and optionally 'analyze' or 'no-analyze'; '#' starts a comment.
+PROFILE_FILENAME = '.encode_profile'
+
+# Per-title analysis: this many samples of SAMPLE_SECONDS each, spread over the
+# video, are encoded at candidate CRFs and compared with the source
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 4
+# Videos shorter than this are converted with the profile's CRF (the analysis
+# would cost about as much as the encode itself)
+MIN_ANALYSIS_DURATION = 60
+
+# "All:0.987654" in the summary line ffmpeg's ssim filter logs
+_SSIM_RE = re.compile(r'SSIM .*All:([0-9.]+)')
+
+
+def _read_profile_file(path):
+    """Returns (profile name or None, analyze flag or None) from a PROFILE_FILENAME file."""
+    name = None
+    analyze = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for word in line.split('#', 1)[0].split():
+                word = word.lower()
+                if word == 'analyze':
+                    analyze = True
+                elif word == 'no-analyze':
+                    analyze = False
+                elif word in ENCODE_PROFILES:
+                    name = word
+                else:
+                    print(f"Ignoring unknown word '{word}' in {path}", file=sys.stderr)
+    return name, analyze
+
+
+def profile_for(source_path, root, default=DEFAULT_PROFILE, analyze=False):
+    """
+    Picks the profile for one source: the nearest PROFILE_FILENAME between the
+    source's directory and root (inclusive), falling back to `default`.
+    Returns (profile name, whether to run the per-title analysis).
+    """
+    name = None
+    file_analyze = None
+    root = os.path.abspath(root)
+    directory = os.path.dirname(os.path.abspath(source_path))
+    while True:
+        path = os.path.join(directory, PROFILE_FILENAME)
+        if os.path.isfile(path):
+            try:
+                found_name, found_analyze = _read_profile_file(path)
+            except OSError as e:
+                print(f"Could not read {path}: {e}", file=sys.stderr)
+                found_name, found_analyze = None, None
+            # A file may set only one of the two; the nearest file wins for each
+            if name is None:
+                name = found_name
+            if file_analyze is None:
+                file_analyze = found_analyze
+        if directory == root or os.path.dirname(directory) == directory:
+            break
+        if os.path.commonpath([directory, root]) != root:
+            break  # Source outside root: only its own directory counts
+        directory = os.path.dirname(directory)
+    return name or default, analyze if file_analyze is None else file_analyze
+
+
+def x264_args(profile, crf=None):
+    """ffmpeg video codec arguments for a full transcode with `profile`."""
+    return ['-c:v', 'libx264',
+            '-preset', profile['preset'],
+            '-crf', str(profile['crf'] if crf is None else crf),
+            '-vf', 'format=yuv420p']
+
+
+# Sources already in these formats can be copied into the MP4 container
+# unchanged instead of being re-encoded (browsers play H.264 8-bit 4:2:0 + AAC)
+COMPATIBLE_VIDEO_CODECS = {'h264'}
+COMPATIBLE_PIXEL_FORMATS = {'yuv420p', 'yuvj420p'}
+COMPATIBLE_H264_PROFILES = {'Constrained Baseline', 'Baseline', 'Main', 'High'}
+COMPATIBLE_AUDIO_CODECS = {'aac'}
+
+# How a source is turned into a browser-playable MP4 (see choose_conversion_path)
+PATH_COPY = 'copy'  # Remux only, no re-encoding
+PATH_AUDIO = 'audio'  # Video copied, audio transcoded to AAC
+PATH_FULL = 'full'  # Video (and audio if needed) re-encoded
+
+
+def choose_conversion_path(info, profile=None, crf=None):
+    """
+    Decides per stream whether the source can be copied into MP4 or must be
+    transcoded, based on the probed codecs, pixel format and H.264 profile.
+    Transcoded streams use the encoding profile (an ENCODE_PROFILES entry,
+    default DEFAULT_PROFILE), with crf overriding the profile's CRF.
+    Returns (path, codec arguments for ffmpeg).
+    """
+    profile = profile or ENCODE_PROFILES[DEFAULT_PROFILE]
+    # Use libx264 for H.264 encoding. REQUIRES FFmpeg built with libx264 support.
+    # Ensure YUV 4:2:0 pixel format.
+    video_args = x264_args(profile, crf)
+    aac_args = ['-c:a', 'aac', '-b:a', profile['audio_bitrate']]
+    if info is None:
+        # Unknown source: the safe choice is a full transcode
+        return PATH_FULL, video_args + aac_args
+
+    video_ok = (info.get('video_codec') in COMPATIBLE_VIDEO_CODECS
+                and info.get('pix_fmt') in COMPATIBLE_PIXEL_FORMATS
+                and info.get('video_profile') in COMPATIBLE_H264_PROFILES)
+    audio_ok = info.get('audio_codec') is None or info.get('audio_codec') in COMPATIBLE_AUDIO_CODECS
+    audio_args = ['-c:a', 'copy'] if audio_ok else aac_args
+
+    if video_ok:
+        return (PATH_COPY if audio_ok else PATH_AUDIO), ['-c:v', 'copy'] + audio_args
+    return PATH_FULL, video_args + audio_args
+
+
+def _sample_offsets(duration):
+    """Start times of the analysis samples, spread over the middle of the video."""
+    return [duration * (i + 1) / (SAMPLE_COUNT + 1) - SAMPLE_SECONDS / 2
+            for i in range(SAMPLE_COUNT)]
+
+
+def _run(command):
+    return subprocess.run(command, capture_output=True, text=True, errors='replace', check=True)
+
+
+def measure_ssim(input_path, offset, profile, crf, work_dir, threads=None):
+    """
+    Encodes SAMPLE_SECONDS of input_path starting at offset with `profile` at
+    `crf` and returns the SSIM of the result against the same source frames.
+    """
+    sample_path = os.path.join(work_dir, f'sample-{offset:.0f}-{crf}.mp4')
+    command = ['ffmpeg', '-ss', f'{offset:.3f}', '-i', input_path, '-t', str(SAMPLE_SECONDS),
+               '-map', '0:v:0', '-an', '-sn'] + x264_args(profile, crf)
+    if threads:
+        command.extend(['-threads', str(threads)])
+    _run(command + ['-y', '-loglevel', 'error', sample_path])
+
+    # The ssim filter logs its summary at info level
+    result = _run(['ffmpeg', '-i', sample_path,
+                   '-ss', f'{offset:.3f}', '-t', str(SAMPLE_SECONDS), '-i', input_path,
+                   '-lavfi', '[0:v]format=yuv420p[encoded];[1:v:0]format=yuv420p[source];'
+                             '[encoded][source]ssim',
+                   '-f', 'null', '-'])
+    os.remove(sample_path)
+    match = _SSIM_RE.search(result.stderr)
+    if match is None:
+        raise ValueError("ffmpeg reported no SSIM")
+    return float(match.group(1))
+
+
+def analyze_crf(input_path, duration, profile, threads=None):
+    """
+    Per-title tuning: finds the highest CRF in the profile's crf_range whose
+    sample encodes still reach its target_ssim on average, so easy content
+    (animation, talking heads) gets fewer bits and hard content (grain, fast
+    motion) more. A binary search needs about four rounds of SAMPLE_COUNT
+    short encodes, a small fraction of encoding the whole title.
+    Returns (crf, ssim at that crf), or None if the title is too short or
+    the analysis failed (the caller then uses the profile's CRF).
+    """
+    if not duration or duration < MIN_ANALYSIS_DURATION:
+        return None
+
+    offsets = _sample_offsets(duration)
+    work_dir = tempfile.mkdtemp(prefix='crf-analysis-')
+    scores = {}  # crf -> average SSIM
+
+    def score(crf):
+        if crf not in scores:
+            values = [measure_ssim(input_path, offset, profile, crf, work_dir, threads)
+                      for offset in offsets]
+            scores[crf] = sum(values) / len(values)
+        return scores[crf]
+
+    low, high = profile['crf_range']
+    try:
+        if score(low) < profile['target_ssim']:
+            # Even the best quality allowed misses the target: use it anyway
+            return low, scores[low]
+        # Invariant: low meets the target; find the highest CRF that does
+        while low < high:
+            middle = (low + high + 1) // 2
+            if score(middle) >= profile['target_ssim']:
+                low = middle
+            else:
+                high = middle - 1
+        return low, scores[low]
+    except (subprocess.CalledProcessError, ValueError, OSError) as e:
+        details = getattr(e, 'stderr', None) or e
+        print(f"CRF analysis of '{os.path.basename(input_path)}' failed: {details}",
+              file=sys.stderr)
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,10 +1,33 @@
 import os
+import sys
+import stat
 import json
+import hashlib
+import tempfile
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+# Library roots holding converted MP4s (name -> directory, see config.py) and
+# the HLS output of `convert_videos.py --mode hls`
+from config import (LIBRARY_ROOTS, HLS_DIR, METADATA_DB_PATH, library_path, split_library_path,
+                    resolve_library_path)
 
-# Directory where your converted MP4 video files are stored
-CONVERTED_DIR = 'C:\\Users\\himan\\Videos\\Music videos'
 # Path to the output JSON file
 OUTPUT_JSON_FILE = './videos.json'
+# Persistent library index (inode/size/mtime/fingerprint/ID per file) that lets
+# re-runs skip files that haven't changed. Entries are keyed by library path
+# ('<root name>/<path in the root>', see config.library_path).
+INDEX_FILE = './library_index.json'
+# Layout of the index; version 1 was keyed by paths relative to the one
+# converted directory and is migrated on load
+INDEX_VERSION = 2
+# Bytes hashed from the start and from the end of a file for its fingerprint
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+# Number of ffprobe processes run at the same time when probing new files
+PROBE_WORKERS = os.cpu_count() or 1
+# Probe results copied into each videos.json record, so the player knows a
+# video's duration (and the catalog its resolution, codecs, ...) up front
+CATALOG_METADATA_FIELDS = ['duration', 'width', 'height', 'video_codec', 'audio_codec',
+                           'bit_rate', 'size']
 # Base path for poster images (relative to the static directory served by Flask)
 POSTER_BASE_PATH = './static/posters/'
 # Default poster image filename if a specific one doesn't exist (optional)
@@ -12,58 +35,360 @@ POSTER_BASE_PATH = './static/posters/'
 DEFAULT_POSTER = 'poster.jpg'
 
 
-def generate_video_list_json(converted_dir, output_json_file, poster_base_path, default_poster=None):
+def write_json_atomic(path, data, indent=2):
     """
-    Scans the converted video directory, collects video details,
-    and saves them to a JSON file.
+    Writes data as JSON to a temp file next to `path` and renames it into place,
+    so readers (e.g. the web server) never see a half-written file.
     """
-    video_list = []
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_index(index_file, roots=None):
+    """
+    Loads the library index. Returns an empty index if the file is missing
+    or unreadable (the next run then simply rebuilds it). A version 1 index
+    (single converted directory) is migrated by putting its entries under the
+    first library root, so titles keep their IDs.
+    """
+    roots = LIBRARY_ROOTS if roots is None else roots
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if isinstance(index.get('entries'), dict):
+            if index.get('version', 1) < INDEX_VERSION:
+                first_root = next(iter(roots))
+                index = {"version": INDEX_VERSION,
+                         "entries": {library_path(first_root, relpath): entry
+                                     for relpath, entry in index['entries'].items()}}
+            return index
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"version": INDEX_VERSION, "entries": {}}
+
+
+def is_partial_file(name):
+    """True for '.<name>.part' files, MP4s still being written by convert_videos.py."""
+    return name.startswith('.') and name.endswith('.part')
+
+
+def scan_files(converted_dir):
+    """
+    Recursively lists files under converted_dir with os.scandir.
+    Returns a dict relative path -> os.stat_result.
+    """
+    found = {}
+    pending = [converted_dir]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        if is_partial_file(entry.name):
+                            continue
+                        relpath = os.path.relpath(entry.path, converted_dir)
+                        found[relpath.replace(os.sep, '/')] = entry.stat()
+        except OSError as e:
+            print(f"Warning: could not scan '{directory}': {e}", file=sys.stderr)
+    return found
+
+
+def scan_library(roots):
+    """
+    Scans every library root (see scan_files). Returns a dict library path ->
+    os.stat_result. Roots that don't exist (e.g. an unmounted disk) are
+    reported and skipped.
+    """
+    found = {}
+    for root_name, directory in roots.items():
+        if not os.path.isdir(directory):
+            print(f"Warning: library root '{root_name}' ({directory}) not found", file=sys.stderr)
+            continue
+        for relpath, st in scan_files(directory).items():
+            found[library_path(root_name, relpath)] = st
+    return found
+
+
+def file_fingerprint(file_path, size):
+    """
+    Cheap content fingerprint: SHA-1 over the size plus the first and last
+    FINGERPRINT_SAMPLE_SIZE bytes. Enough to recognise a moved or renamed
+    file without reading it completely.
+    """
+    digest = hashlib.sha1(str(size).encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+        if size > FINGERPRINT_SAMPLE_SIZE:
+            f.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+            digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def stat_files(roots, libpaths):
+    """
+    Stats just the given library paths instead of scanning the roots.
+    Returns the same mapping as scan_library() for those that exist.
+    """
+    found = {}
+    for libpath in libpaths:
+        path = resolve_library_path(libpath, roots)
+        if path is None:
+            continue  # Root no longer configured
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # Deleted
+        if stat.S_ISREG(st.st_mode) and not is_partial_file(os.path.basename(path)):
+            found[libpath] = st
+    return found
+
+
+def update_index(index, roots, libpaths=None):
+    """
+    Brings the index entries in line with the files on disk.
+    Unchanged files (same inode, size and mtime) are not opened at all; new or
+    changed ones are fingerprinted. IDs are stable: a file keeps its ID while it
+    stays at the same path, a moved/renamed file keeps the ID of the vanished
+    entry with the same fingerprint, and new files get an ID derived from their
+    content fingerprint. A file moved to another root counts as a rename.
+    Returns the number of added, changed or removed entries.
+
+    With libpaths, only those library paths are checked (e.g. the files a
+    watcher saw change) and every other entry is kept as it is, without a
+    directory scan.
+    """
+    old_entries = index["entries"]
+    if libpaths is None:
+        on_disk = scan_library(roots)
+        checked = set(old_entries) | set(on_disk)
+    else:
+        checked = set(libpaths)
+        on_disk = stat_files(roots, checked)
+    new_entries = {libpath: entry for libpath, entry in old_entries.items()
+                   if libpath not in checked}
+    changes = 0
+
+    # Entries that disappeared from their path, by fingerprint, for rename detection
+    vanished = {entry["fingerprint"]: entry for libpath, entry in old_entries.items()
+                if libpath in checked and libpath not in on_disk}
+    used_ids = {entry["id"] for libpath, entry in old_entries.items()
+                if libpath not in checked or libpath in on_disk}
+
+    for libpath in sorted(on_disk):
+        st = on_disk[libpath]
+        old = old_entries.get(libpath)
+        if (old and old["inode"] == st.st_ino and old["size"] == st.st_size
+                and old["mtime_ns"] == st.st_mtime_ns):
+            new_entries[libpath] = old
+            continue
+
+        try:
+            fingerprint = file_fingerprint(resolve_library_path(libpath, roots), st.st_size)
+        except OSError as e:
+            print(f"Warning: could not read '{libpath}': {e}", file=sys.stderr)
+            continue
+
+        if old:
+            video_id = old["id"]  # Same path, new content: keep the ID
+        elif fingerprint in vanished:
+            video_id = vanished.pop(fingerprint)["id"]  # Moved or renamed
+        else:
+            video_id = f"video-{fingerprint[:12]}"
+            if video_id in used_ids:
+                # Identical copy already indexed: fall back to a path hash
+                video_id = f"video-{hashlib.sha1(libpath.encode('utf-8')).hexdigest()[:12]}"
+        used_ids.add(video_id)
+
+        new_entries[libpath] = {
+            "id": video_id,
+            "inode": st.st_ino,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "fingerprint": fingerprint,
+        }
+        changes += 1
 
-    print(f"Scanning directory: {converted_dir}")
+    changes += len(set(old_entries) - set(new_entries))
+    index["entries"] = new_entries
+    return changes
 
-    # Check if the converted directory exists
-    if not os.path.exists(converted_dir):
-        print(f"Error: Converted directory '{converted_dir}' not found.")
+
+def _probe_file(store, path):
+    """
+    Indexes one new or changed MP4 for the catalog and the server:
+    builds its keyframe index (mp4_index.py, used by app.py for /video_index
+    and for planning seeks) and returns its metadata, from the metadata
+    store if it has it, otherwise from a single ffprobe call (keyframes are
+    counted from the MP4 index instead of a second ffprobe pass over every
+    packet). Both end up in the metadata store. Returns None if the file
+    can't be probed.
+    """
+    from metadata_store import probe_video, ProbeError
+    from mp4_index import MP4IndexError
+
+    try:
+        st = os.stat(path)
+        try:
+            mp4_index = store.get_mp4_index(path)
+        except MP4IndexError as e:
+            print(f"Warning: could not index '{os.path.basename(path)}': {e}", file=sys.stderr)
+            mp4_index = None
+        info = store.lookup(path, st)
+        if info is not None:
+            return info
+        info = probe_video(path, with_keyframes=False)
+        if mp4_index is not None:
+            info["keyframe_count"] = len(mp4_index["keyframe_offsets"])
+        store.put(path, st.st_size, st.st_mtime_ns, info)
+        return info
+    except ProbeError as e:
+        print(f"Warning: could not probe '{os.path.basename(path)}': {e.details or e}",
+              file=sys.stderr)
+    except OSError as e:
+        print(f"Warning: could not probe '{os.path.basename(path)}': {e}", file=sys.stderr)
+    return None
+
+
+def probe_entries(roots, entries, workers=PROBE_WORKERS):
+    """
+    Fills in the "metadata" of every MP4 index entry that doesn't have it yet
+    (new or changed files: update_index replaces their entries) with up to
+    `workers` ffprobe processes at once (see _probe_file). Results also go
+    into the metadata store, so /video_info answers without probing.
+    Returns the number of entries probed.
+    """
+    from metadata_store import MetadataStore
+
+    missing = [libpath for libpath, entry in entries.items()
+               if libpath.lower().endswith('.mp4') and 'metadata' not in entry]
+    if not missing:
+        return 0
+
+    print(f"Probing {len(missing)} file(s) with {min(workers, len(missing))} worker(s)...")
+    store = MetadataStore(METADATA_DB_PATH)  # The database app.py reads
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(
+            lambda libpath: _probe_file(store, resolve_library_path(libpath, roots)), missing)
+        for libpath, info in zip(missing, results):
+            # None (probe failed) is kept too; the file is probed again once it changes
+            entries[libpath]["metadata"] = (
+                {field: info.get(field) for field in CATALOG_METADATA_FIELDS} if info else None)
+    return len(missing)
+
+
+def build_video_details(libpath, entry, poster_base_path, hls_dir=None, thumbnails=None):
+    """
+    Builds the videos.json record for one indexed file. thumbnails is the
+    thumbnail manifest (see thumbnails.py); generated posters and the seek
+    preview track are used when the video has an entry there.
+    """
+    root_name, relpath = split_library_path(libpath)
+    filename = os.path.basename(relpath)
+
+    # Create a simple title from the filename (replace underscores/dashes with spaces)
+    title = os.path.splitext(filename)[0].replace(
+        '_', ' ').replace('-', ' ').title()
+
+    # Generate poster path - assumes a poster image with the same base name exists
+    # in the static/posters directory. Falls back to default poster if specified.
+    poster_filename = "poster.jpg"  # Assuming poster is a JPG
+    poster_path = os.path.join(poster_base_path, poster_filename)
+
+    # The frontend's onerror handler on the <img> tag will handle missing images.
+
+    video_details = {
+        "id": entry["id"],
+        "title": title,
+        # Path relative to the web server's root (handled by Flask static)
+        "poster": poster_path,
+        "filename": filename,  # The actual filename in the library
+        # Library root holding the file and its path in there, so the server
+        # opens it without searching every disk
+        "root": root_name,
+        "path": relpath,
+    }
+
+    # Duration, resolution, codecs, bitrate and size probed by the indexer
+    video_details.update(entry.get("metadata") or {})
+
+    # Generated, content-hashed posters and seek-preview sprites
+    generated = (thumbnails or {}).get(libpath)
+    if generated and generated.get("posters"):
+        from thumbnails import THUMBNAIL_URL_PREFIX
+        posters = {width: {fmt: THUMBNAIL_URL_PREFIX + name for fmt, name in formats.items()}
+                   for width, formats in generated["posters"].items()}
+        smallest = posters[min(posters, key=int)]
+        video_details["poster"] = smallest.get("jpg") or next(iter(smallest.values()))
+        video_details["posters"] = posters
+        if generated.get("sprites_vtt"):
+            video_details["thumbnails"] = THUMBNAIL_URL_PREFIX + generated["sprites_vtt"]
+
+    # Adaptive bitrate version, if the converter produced one
+    filename_base = os.path.splitext(filename)[0]
+    if hls_dir and os.path.exists(os.path.join(hls_dir, filename_base, 'master.m3u8')):
+        video_details["hls"] = f"/hls/{quote(filename_base)}/master.m3u8"
+
+    return video_details
+
+
+def generate_video_list_json(library_roots, output_json_file, poster_base_path, default_poster=None,
+                             hls_dir=None, index_file=INDEX_FILE, changed=None):
+    """
+    Scans the library roots (name -> directory, see config.LIBRARY_ROOTS),
+    collects video details, and saves them to a JSON file. If hls_dir is given, titles that also have
+    an HLS package get an "hls" entry with their master playlist URL.
+
+    Every new or changed MP4 is probed once (ffprobe, PROBE_WORKERS at a time)
+    and its duration, resolution, codecs, bitrate and size are stored in the
+    index and written into its catalog record.
+
+    The scan is incremental: the persistent index in index_file remembers every
+    file's inode, size, mtime and ID, so only new or changed files are read and
+    an unchanged library is re-indexed with just a directory scan. When the
+    caller already knows which files changed (library paths in `changed`, as
+    the watcher does), even that scan is skipped; an empty list just rebuilds
+    the JSON, e.g. after new thumbnails or HLS packages.
+    """
+    if changed is None:
+        for root_name, directory in library_roots.items():
+            print(f"Scanning library root '{root_name}': {directory}")
+
+    # Check if at least one library root exists
+    if not any(os.path.exists(directory) for directory in library_roots.values()):
+        print("Error: None of the library roots were found.")
         print("Please run the conversion script first.")
         return
 
-    # Walk through the converted directory
-    for root, _, files in os.walk(converted_dir):
-        for filename in files:
-            # Only process MP4 files (since the server is set to stream only MP4)
-            # if filename.lower().endswith('.mp4'):
-            file_path = os.path.join(root, filename)
-            # Create a simple ID (can be improved for uniqueness if needed)
-            # Use filename without extension as ID
-            video_id = f"video{files.index(filename) + 1}"
-
-            # Create a simple title from the filename (replace underscores/dashes with spaces)
-            title = os.path.splitext(filename)[0].replace(
-                '_', ' ').replace('-', ' ').title()
-
-            # Generate poster path - assumes a poster image with the same base name exists
-            # in the static/posters directory. Falls back to default poster if specified.
-            poster_filename = "poster.jpg"  # Assuming poster is a JPG
-            poster_path = os.path.join(poster_base_path, poster_filename)
-
-            # If a default poster is specified, you could add logic here to check
-            # if the specific poster file exists on the filesystem and use the
-            # default if it doesn't. For simplicity here, we just construct the path.
-            # The frontend's onerror handler on the <img> tag will handle missing images.
-
-            video_details = {
-                "id": video_id,
-                "title": title,
-                # Path relative to the web server's root (handled by Flask static)
-                "poster": poster_path,
-                "filename": filename  # The actual filename in the converted directory
-            }
-            video_list.append(video_details)
-
-    # Write the video list to the JSON file
+    index = load_index(index_file, library_roots)
+    changes = update_index(index, library_roots, changed)
+    print(f"Index updated: {changes} new, changed or removed file(s).")
+    changes += probe_entries(library_roots, index["entries"])
+
+    from thumbnails import load_manifest
+    thumbnails = load_manifest()
+
+    video_list = [build_video_details(libpath, entry, poster_base_path, hls_dir, thumbnails)
+                  for libpath, entry in index["entries"].items()]
+
+    # Write the index and the video list atomically
     try:
-        with open(output_json_file, 'w', encoding='utf-8') as f:
-            json.dump(video_list, f, indent=2, ensure_ascii=False)
+        if changes or not os.path.exists(index_file):
+            write_json_atomic(index_file, index, indent=None)
+        write_json_atomic(output_json_file, video_list)
         print(f"\nSuccessfully generated video list in: {output_json_file}")
         print(f"Found {len(video_list)} MP4 video(s).")
     except IOError as e:
@@ -74,11 +399,12 @@ def generate_video_list_json(converted_dir, output_json_file, poster_base_path,
 
 
 if __name__ == "__main__":
-    # Ensure the converted directory exists before scanning
-    if not os.path.exists(CONVERTED_DIR):
-        print(f"Creating missing directory: {CONVERTED_DIR}")
-        os.makedirs(CONVERTED_DIR)
-        print("Please place your converted MP4 files in this directory.")
+    # Ensure the library roots exist before scanning
+    for directory in LIBRARY_ROOTS.values():
+        if not os.path.exists(directory):
+            print(f"Creating missing directory: {directory}")
+            os.makedirs(directory)
+            print("Please place your converted MP4 files in this directory.")
 
     # Ensure the static/posters directory exists (where posters are expected)
     static_posters_dir = './static/posters'
@@ -92,4 +418,4 @@ if __name__ == "__main__":
                 f"Consider adding a default poster image named '{DEFAULT_POSTER}' to {static_posters_dir}")
 
     generate_video_list_json(
-        CONVERTED_DIR, OUTPUT_JSON_FILE, POSTER_BASE_PATH, DEFAULT_POSTER)
+        LIBRARY_ROOTS, OUTPUT_JSON_FILE, POSTER_BASE_PATH, DEFAULT_POSTER, HLS_DIR)
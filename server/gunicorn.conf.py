@@ -0,0 +1,41 @@
+# gunicorn configuration for Linux deployments:
+#
+#   gunicorn -c server/gunicorn.conf.py
+#
+# Uses gevent workers when gevent is installed (thousands of cooperative
+# connections per worker), otherwise threaded workers. In both cases video
+# bodies go through gunicorn's wsgi.file_wrapper, i.e. os.sendfile, so file
+# data never passes through Python. On SIGTERM gunicorn stops accepting
+# connections and gives running requests graceful_timeout seconds to finish.
+import os
+import importlib.util
+import multiprocessing
+
+_has_gevent = importlib.util.find_spec('gevent') is not None
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+# Each worker builds its own app (and warms up on its own, see /ready)
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('VIDEO_STREAMER_BIND', '0.0.0.0:8000')
+
+workers = int(os.environ.get('VIDEO_STREAMER_WORKERS', multiprocessing.cpu_count()))
+if _has_gevent:
+    worker_class = 'gevent'
+    # Concurrent connections per worker
+    worker_connections = int(os.environ.get('VIDEO_STREAMER_WORKER_CONNECTIONS', '2000'))
+else:
+    worker_class = 'gthread'
+    # Each stream occupies a thread for the duration of the transfer
+    threads = int(os.environ.get('VIDEO_STREAMER_THREADS', '64'))
+
+# Long-lived streams must not be killed as "hung" workers
+timeout = 0 if _has_gevent else 120
+graceful_timeout = 30
+keepalive = 5
+sendfile = True
+
+
+def worker_exit(server, worker):
+    # Keep the view counts gathered since the last flush (they pick what is warmed)
+    from app import flush_views
+    flush_views()
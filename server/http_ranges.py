@@ -0,0 +1,191 @@
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from streaming import iter_file_range
+
+# More ranges than this in one request are treated as abuse and the Range
+# header is ignored (RFC 7233 section 6.1 allows that)
+MAX_RANGES = 32
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlaps the file (answered with 416)."""
+
+
+def make_etag(st):
+    """Strong validator from size and mtime, like most static file servers use."""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def _parse_http_date(value):
+    """Returns the POSIX timestamp of an HTTP date, or None if it doesn't parse."""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _etag_list(header):
+    """Splits an If-Match / If-None-Match header into its entity tags."""
+    return [tag.strip() for tag in header.split(',') if tag.strip()]
+
+
+def _weak_match(tag, etag):
+    """Weak comparison (RFC 7232 section 2.3.2): W/ prefixes are ignored."""
+    return tag.removeprefix('W/') == etag.removeprefix('W/')
+
+
+def none_match(if_none_match, etag):
+    """True if an If-None-Match header matches etag ('*' or a weak comparison hit)."""
+    tags = _etag_list(if_none_match or '')
+    return '*' in tags or any(_weak_match(tag, etag) for tag in tags)
+
+
+def evaluate_preconditions(headers, etag, last_modified):
+    """
+    Evaluates If-Match, If-Unmodified-Since, If-None-Match and If-Modified-Since
+    in the order of RFC 7232 section 6 for a GET/HEAD request.
+    Returns 412, 304, or None if the request should proceed.
+    """
+    whole_seconds = int(last_modified)
+
+    if_match = headers.get('If-Match')
+    if if_match:
+        tags = _etag_list(if_match)
+        if '*' not in tags and etag not in tags:  # strong comparison
+            return 412
+    else:
+        since = _parse_http_date(headers.get('If-Unmodified-Since'))
+        if since is not None and whole_seconds > since:
+            return 412
+
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        if none_match(if_none_match, etag):
+            return 304
+    else:
+        since = _parse_http_date(headers.get('If-Modified-Since'))
+        if since is not None and whole_seconds <= since:
+            return 304
+
+    return None
+
+
+def if_range_allows(if_range, etag, last_modified):
+    """
+    True if the Range header should be honoured given the If-Range header.
+    If-Range holds either an entity tag (strong comparison) or an HTTP date
+    (must equal Last-Modified exactly).
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag  # a weak tag never matches
+    since = _parse_http_date(if_range)
+    return since is not None and int(last_modified) == since
+
+
+def parse_range_header(header, file_size):
+    """
+    Parses a `bytes=` Range header (RFC 7233 section 2.1) into a sorted list of
+    inclusive (start, end) pairs, clamped to the file and with overlapping or
+    adjacent ranges merged. Supports `a-b`, `a-` and suffix `-n` specs.
+
+    Returns None if the header is malformed or uses another unit (the header
+    must then be ignored and the full file served). Raises RangeNotSatisfiable
+    if it is valid but no range overlaps the file.
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    spec_count = 0
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        spec_count += 1
+        first, dash, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or (not first and last.isdigit())):
+            return None
+        if last and not last.isdigit():
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - length), file_size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None  # Syntactically invalid, ignore the whole header
+        end = int(last) if last else file_size - 1
+        if start >= file_size:
+            continue  # Unsatisfiable on its own
+        ranges.append((start, min(end, file_size - 1)))
+
+    if spec_count == 0 or spec_count > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Merge overlapping and adjacent ranges so no byte is sent twice
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class MultipartRangeIterator:
+    """
+    multipart/byteranges body (RFC 7233 appendix A) for several ranges of one
+    open file. Part headers are precomputed so the exact Content-Length is
+    known up front; file data is streamed in bounded chunks straight from the
+    file. close() closes the file.
+    """
+
+    def __init__(self, file_obj, ranges, file_size, content_type, boundary=None):
+        self.file_obj = file_obj
+        self.ranges = ranges
+        self.boundary = boundary or uuid.uuid4().hex
+        self._part_headers = [
+            (f"\r\n--{self.boundary}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode('ascii')
+            for start, end in ranges
+        ]
+        self._closing = f"\r\n--{self.boundary}--\r\n".encode('ascii')
+
+    @property
+    def content_type(self):
+        return f"multipart/byteranges; boundary={self.boundary}"
+
+    @property
+    def content_length(self):
+        return (sum(len(header) for header in self._part_headers)
+                + sum(end - start + 1 for start, end in self.ranges)
+                + len(self._closing))
+
+    def __iter__(self):
+        for header, (start, end) in zip(self._part_headers, self.ranges):
+            yield header
+            yield from iter_file_range(self.file_obj, start, end - start + 1)
+        yield self._closing
+
+    def close(self):
+        self.file_obj.close()
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+# Default location of the conversion job database (next to this script)
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'conversion_jobs.db')
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# A job is given up (state 'failed') after this many attempts
+MAX_ATTEMPTS = 3
+# Retry delay after the n-th failed attempt: BACKOFF_BASE * 2**(n-1), capped
+BACKOFF_BASE = 30
+BACKOFF_MAX = 15 * 60
+# A claimed job is leased to the claiming process for this long and the lease
+# is renewed while it runs (see renew()). Another process only takes the job
+# back (recover()) once the lease has run out or its owner is gone.
+LEASE_SECONDS = 10 * 60
+
+
+class JobQueue:
+    """
+    Persistent conversion job queue in SQLite.
+
+    Each (source, mode) pair is one job moving through pending -> running ->
+    done, or back to pending with an exponential backoff when it fails, until
+    MAX_ATTEMPTS is reached and it is marked failed. Because the state is on
+    disk, a restarted converter continues where the previous one stopped:
+    recover() puts jobs that were running when the process died back to pending.
+    Running jobs record the process that claimed them, so several processes
+    (e.g. the watcher and a convert_videos.py run) can share one queue.
+    Safe to use from multiple threads of one process.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        # Identifies this process in the owner column of the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        # Serialises claim() so two workers never take the same job
+        self._claim_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' source TEXT NOT NULL,'
+            ' mode TEXT NOT NULL,'
+            ' output TEXT NOT NULL,'
+            ' state TEXT NOT NULL,'
+            ' priority REAL NOT NULL DEFAULT 0,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' next_attempt_at REAL NOT NULL DEFAULT 0,'
+            ' last_error TEXT,'
+            ' result TEXT,'
+            ' info TEXT,'
+            ' updated_at REAL NOT NULL,'
+            ' owner TEXT,'
+            ' lease_until REAL,'
+            ' PRIMARY KEY (source, mode))')
+        # Queues created before jobs had owners
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('owner', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        conn.commit()
+
+    def _connection(self):
+        """Returns this thread's SQLite connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def get(self, source, mode):
+        row = self._connection().execute(
+            'SELECT * FROM jobs WHERE source = ? AND mode = ?', (source, mode)).fetchone()
+        return dict(row) if row else None
+
+    def enqueue(self, source, mode, output, priority=0, info=None, state=PENDING):
+        """
+        Adds a job if it isn't known yet. Returns True if it was added.
+        Pass state=DONE to record work that was finished outside the queue.
+        """
+        cursor = self._connection().execute(
+            'INSERT OR IGNORE INTO jobs (source, mode, output, state, priority, info, updated_at)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (source, mode, output, state, priority,
+             json.dumps(info) if info is not None else None, time.time()))
+        return cursor.rowcount > 0
+
+    def requeue(self, source, mode):
+        """Puts a job back to pending with a fresh attempt budget (e.g. its output vanished)."""
+        self._connection().execute(
+            'UPDATE jobs SET state = ?, attempts = 0, next_attempt_at = 0, updated_at = ?'
+            ' WHERE source = ? AND mode = ?', (PENDING, time.time(), source, mode))
+
+    def _abandoned(self, owner, lease_until, now):
+        """True if a running job with this owner and lease is no longer being worked on."""
+        if owner is None or owner == self.owner:
+            return True  # Claimed before owners were recorded, or by this process
+        if lease_until is None or lease_until < now:
+            return True
+        # On this machine a dead owner is noticed right away (the PID check
+        # needs POSIX; elsewhere the lease has to run out)
+        host, _, pid = owner.rpartition(':')
+        if host == socket.gethostname() and os.name == 'posix' and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                pass  # Exists but belongs to another user
+        return False
+
+    def recover(self):
+        """
+        Puts jobs left 'running' by a crashed or killed converter back to
+        pending: jobs of this process and jobs whose owner is gone or whose
+        lease has run out. Jobs another live process is converting are left
+        alone. Call at startup, before any worker claims jobs. Returns how many.
+        """
+        conn = self._connection()
+        now = time.time()
+        rows = conn.execute(
+            'SELECT source, mode, owner, lease_until FROM jobs WHERE state = ?', (RUNNING,)).fetchall()
+        recovered = 0
+        for row in rows:
+            if not self._abandoned(row['owner'], row['lease_until'], now):
+                continue
+            cursor = conn.execute(
+                'UPDATE jobs SET state = ?, owner = NULL, lease_until = NULL, updated_at = ?'
+                ' WHERE source = ? AND mode = ? AND state = ? AND owner IS ?',
+                (PENDING, now, row['source'], row['mode'], RUNNING, row['owner']))
+            recovered += cursor.rowcount
+        return recovered
+
+    def renew(self):
+        """Extends the lease of every job this process is running. Returns how many."""
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE jobs SET lease_until = ? WHERE state = ? AND owner = ?',
+            (now + LEASE_SECONDS, RUNNING, self.owner))
+        return cursor.rowcount
+
+    def claim(self, mode=None):
+        """
+        Atomically takes the highest-priority pending job that is due, marks it
+        running and counts the attempt. Returns the job dict or None.
+        """
+        conn = self._connection()
+        with self._claim_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                query = 'SELECT * FROM jobs WHERE state = ? AND next_attempt_at <= ?'
+                params = [PENDING, time.time()]
+                if mode is not None:
+                    query += ' AND mode = ?'
+                    params.append(mode)
+                row = conn.execute(
+                    query + ' ORDER BY priority DESC LIMIT 1', params).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                now = time.time()
+                conn.execute(
+                    'UPDATE jobs SET state = ?, attempts = attempts + 1, owner = ?,'
+                    ' lease_until = ?, updated_at = ? WHERE source = ? AND mode = ?',
+                    (RUNNING, self.owner, now + LEASE_SECONDS, now, row['source'], row['mode']))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        job = dict(row)
+        job['attempts'] += 1
+        job['state'] = RUNNING
+        job['owner'] = self.owner
+        job['info'] = json.loads(job['info']) if job['info'] else None
+        return job
+
+    def complete(self, job, result=None):
+        self._connection().execute(
+            'UPDATE jobs SET state = ?, result = ?, last_error = NULL, updated_at = ?'
+            ' WHERE source = ? AND mode = ?',
+            (DONE, result, time.time(), job['source'], job['mode']))
+
+    def fail(self, job, error):
+        """
+        Records a failed attempt: back to pending with exponential backoff, or
+        failed for good after MAX_ATTEMPTS. Returns the new state.
+        """
+        attempts = job['attempts']
+        if attempts >= MAX_ATTEMPTS:
+            state, next_attempt_at = FAILED, 0
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+            state, next_attempt_at = PENDING, time.time() + delay
+        self._connection().execute(
+            'UPDATE jobs SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = ?'
+            ' WHERE source = ? AND mode = ?',
+            (state, next_attempt_at, str(error), time.time(), job['source'], job['mode']))
+        return state
+
+    def seconds_until_next(self, mode=None):
+        """
+        Seconds until the next pending job becomes due (0 if one is due now),
+        or None if nothing is pending.
+        """
+        query = 'SELECT MIN(next_attempt_at) FROM jobs WHERE state = ?'
+        params = [PENDING]
+        if mode is not None:
+            query += ' AND mode = ?'
+            params.append(mode)
+        next_at = self._connection().execute(query, params).fetchone()[0]
+        if next_at is None:
+            return None
+        return max(0.0, next_at - time.time())
+
+    def pending_jobs(self, mode=None):
+        query = 'SELECT source, priority FROM jobs WHERE state = ?'
+        params = [PENDING]
+        if mode is not None:
+            query += ' AND mode = ?'
+            params.append(mode)
+        return [dict(row) for row in self._connection().execute(query, params)]
+
+    def counts(self):
+        """Number of jobs per state."""
+        rows = self._connection().execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+from encode_profiles import choose_conversion_path, PATH_FULL
+
+# Bytes read from ffmpeg's output (and sent to viewers) at a time
+REMUX_CHUNK_SIZE = 256 * 1024
+# Viewers waiting for more output re-check the process this often (seconds)
+REMUX_WAIT_SECONDS = 1.0
+# Written next to a cache file once its remux has finished successfully
+COMPLETE_SUFFIX = '.complete'
+# A source name SourceIndex doesn't know triggers a rescan at most this often (seconds)
+SOURCE_RESCAN_INTERVAL = 10.0
+
+
+class RemuxUnsupported(Exception):
+    """The source's video can't be stream-copied; it needs the batch converter."""
+
+
+class RemuxBusy(Exception):
+    """The maximum number of live remux processes is already running."""
+
+
+def cache_key(source_path, st):
+    """Cache file name stem for a source; changes whenever the source does."""
+    identity = f"{os.path.abspath(source_path)}\0{st.st_size}\0{st.st_mtime_ns}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+
+def remux_command(source_path, codec_args):
+    """
+    ffmpeg command copying the first video and audio stream of source_path
+    into a fragmented MP4 on stdout. A fragment starts at every keyframe and
+    the moov box comes first (empty), so players can start before ffmpeg is
+    done and nothing has to be rewritten at the end.
+    """
+    return (['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', source_path,
+             '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn']
+            + codec_args
+            + ['-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+               '-f', 'mp4', 'pipe:1'])
+
+
+class LiveRemux:
+    """
+    One ffmpeg process remuxing a source, with its output teed into a cache
+    file. Viewers read the cache file as it grows (see RemuxBody); once the
+    process has finished successfully the file is marked complete and later
+    viewers get it as a plain file with range support.
+    """
+
+    def __init__(self, source_path, cache_path, codec_args, on_exit=None):
+        self.source_path = source_path
+        self.cache_path = cache_path
+        self.codec_args = codec_args
+        self.on_exit = on_exit
+        self.size = 0  # Bytes written to the cache file so far
+        self.finished = False
+        self.returncode = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        # The cache file exists before start() returns, so viewers can open it
+        output = open(self.cache_path, 'wb')
+        errors = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(remux_command(self.source_path, self.codec_args),
+                                            stdout=subprocess.PIPE, stderr=errors)
+        except OSError:
+            output.close()
+            errors.close()
+            os.remove(self.cache_path)
+            raise
+        threading.Thread(target=self._pump, args=(output, errors),
+                         name='live-remux', daemon=True).start()
+
+    def _pump(self, output, errors):
+        try:
+            with output:
+                while True:
+                    data = self.process.stdout.read1(REMUX_CHUNK_SIZE)
+                    if not data:
+                        break
+                    output.write(data)
+                    output.flush()
+                    with self._cond:
+                        self.size += len(data)
+                        self._cond.notify_all()
+            self.returncode = self.process.wait()
+        except OSError as e:
+            # Cache disk full or gone: stop ffmpeg, viewers get what was written
+            print(f"Live remux of '{os.path.basename(self.source_path)}' failed: {e}",
+                  file=sys.stderr)
+            self.process.kill()
+            self.process.wait()
+            self.returncode = -1
+
+        if self.returncode == 0:
+            open(self.cache_path + COMPLETE_SUFFIX, 'wb').close()
+        else:
+            errors.seek(0)
+            details = errors.read().decode('utf-8', 'replace').strip()[-500:]
+            print(f"Live remux of '{os.path.basename(self.source_path)}' exited with "
+                  f"code {self.returncode}: {details}", file=sys.stderr)
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass  # Still open by a viewer (Windows); LiveRemuxer.prune() removes it later
+        errors.close()
+
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def wait_for(self, offset):
+        """Blocks until more than `offset` bytes are written or the remux ended. Returns (size, finished)."""
+        with self._cond:
+            while self.size <= offset and not self.finished:
+                self._cond.wait(REMUX_WAIT_SECONDS)
+            return self.size, self.finished
+
+
+class RemuxBody:
+    """
+    WSGI response body sending a remux's cache file from the start while it
+    is being written, following ffmpeg until it exits. file_obj (opened on
+    remux.cache_path) is closed by close(), ending the stream.
+    """
+
+    def __init__(self, remux, file_obj):
+        self.remux = remux
+        self.file_obj = file_obj
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        while True:
+            available, _ = self.remux.wait_for(self.bytes_sent)
+            if self.bytes_sent >= available:
+                break  # ffmpeg exited and everything it wrote was sent
+            data = self.file_obj.read(min(REMUX_CHUNK_SIZE, available - self.bytes_sent))
+            if not data:
+                break
+            self.bytes_sent += len(data)
+            yield data
+
+    def close(self):
+        self.file_obj.close()
+
+
+class SourceIndex:
+    """
+    File name -> path of the sources below source_dir (with one of the given
+    extensions), kept in memory so requests don't walk the directory tree.
+    Names that aren't known (new uploads) trigger a rescan, at most every
+    rescan_interval seconds. A file at the top level wins over deeper ones.
+    """
+
+    def __init__(self, source_dir, extensions, rescan_interval=SOURCE_RESCAN_INTERVAL):
+        self.source_dir = source_dir
+        self.extensions = {extension.lower() for extension in extensions}
+        self.rescan_interval = rescan_interval
+        self._paths = {}
+        self._scanned = None  # time.monotonic() of the last scan
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def refresh(self):
+        """Rescans source_dir."""
+        paths = {}
+        for root, _, files in os.walk(self.source_dir):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in self.extensions:
+                    paths.setdefault(name, os.path.join(root, name))
+        with self._lock:
+            self._paths = paths
+            self._scanned = time.monotonic()
+
+    def find(self, filename):
+        """Path of the source named filename, or None if there is none."""
+        path = self._paths.get(filename)
+        if path is None or not os.path.isfile(path):
+            with self._lock:
+                now = time.monotonic()
+                due = self._scanned is None or now - self._scanned >= self.rescan_interval
+                if due:
+                    self._scanned = now  # Concurrent misses don't rescan as well
+            if due:
+                self.refresh()
+            path = self._paths.get(filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+
+
+class LiveRemuxer:
+    """
+    Live remuxes of sources that haven't been converted yet, at most
+    max_processes ffmpeg processes at a time. Viewers of a source that is
+    being remuxed share its process; finished remuxes stay in cache_dir
+    (least recently used ones are removed beyond cache_max_bytes).
+    """
+
+    def __init__(self, cache_dir, max_processes, cache_max_bytes):
+        self.cache_dir = cache_dir
+        self.max_processes = max_processes
+        self.cache_max_bytes = cache_max_bytes
+        self._running = {}  # cache path -> LiveRemux
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return len(self._running)
+
+    def cache_path(self, source_path, st):
+        return os.path.join(self.cache_dir, cache_key(source_path, st) + '.mp4')
+
+    def cached_path(self, source_path, st):
+        """The completed remux of the source in its current version, or None."""
+        path = self.cache_path(source_path, st)
+        if not os.path.exists(path + COMPLETE_SUFFIX):
+            return None
+        try:
+            os.utime(path)  # Recently used: pruned last
+        except OSError:
+            return None
+        return path
+
+    def open(self, source_path, st, info):
+        """
+        Returns the running remux of the source, starting one if needed.
+        info is the source's probe result; it decides whether the streams can
+        be copied (audio that isn't AAC is transcoded, which is cheap).
+        Returns None if the remux has meanwhile finished (use cached_path).
+        Raises RemuxUnsupported, RemuxBusy, or OSError if ffmpeg can't start.
+        """
+        path, codec_args = choose_conversion_path(info)
+        if path == PATH_FULL:
+            raise RemuxUnsupported(f"'{os.path.basename(source_path)}' needs a full transcode")
+        cache_path = self.cache_path(source_path, st)
+        with self._lock:
+            remux = self._running.get(cache_path)
+            if remux is not None:
+                return remux
+            if os.path.exists(cache_path + COMPLETE_SUFFIX):
+                return None
+            if len(self._running) >= self.max_processes:
+                raise RemuxBusy()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            remux = LiveRemux(source_path, cache_path, codec_args, self._finished)
+            remux.start()
+            self._running[cache_path] = remux
+        print(f"Started live remux of '{os.path.basename(source_path)}'")
+        return remux
+
+    def _finished(self, remux):
+        with self._lock:
+            self._running.pop(remux.cache_path, None)
+        self.prune()
+
+    def prune(self):
+        """Removes failed leftovers and, beyond cache_max_bytes, the least recently used remuxes."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        with self._lock:
+            running = set(self._running)
+        complete = []
+        for name in names:
+            if not name.endswith('.mp4'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            if path in running:
+                continue
+            try:
+                if not os.path.exists(path + COMPLETE_SUFFIX):
+                    os.remove(path)  # Interrupted or failed remux
+                    continue
+                st = os.stat(path)
+            except OSError:
+                continue
+            complete.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in complete)
+        for _, size, path in sorted(complete):
+            if total <= self.cache_max_bytes:
+                break
+            try:
+                os.remove(path + COMPLETE_SUFFIX)
+                os.remove(path)
+            except OSError:
+                continue  # Being streamed (Windows); try again next time
+            total -= size
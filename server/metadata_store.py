@@ -0,0 +1,349 @@
+import os
+import json
+import sqlite3
+import subprocess
+import threading
+from collections import OrderedDict
+
+from mp4_index import build_index, MP4IndexError, INDEX_VERSION
+
+# Default location of the on-disk metadata database (next to this script)
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'video_metadata.db')
+# Number of entries kept in the in-memory LRU in front of the database
+DEFAULT_CACHE_SIZE = 4096
+# Number of MP4 keyframe indexes kept in memory (tens of KB each for a long film)
+DEFAULT_INDEX_CACHE_SIZE = 256
+# Paths per query when loading many rows at once (SQLite's variable limit is 999)
+PRELOAD_BATCH_SIZE = 500
+
+
+class ProbeError(Exception):
+    """
+    Raised when ffprobe fails on a file. `details` holds ffprobe's stderr.
+    """
+
+    def __init__(self, message, details=''):
+        super().__init__(message)
+        self.details = details
+
+
+def _run_ffprobe(args):
+    """
+    Runs ffprobe with the given arguments and returns its stdout.
+    Raises ProbeError on a non-zero exit code. FileNotFoundError (ffprobe
+    not installed) is left to the caller.
+    """
+    try:
+        process = subprocess.run(
+            ['ffprobe', '-v', 'error'] + args, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise ProbeError("ffprobe failed", (e.stderr or '').strip())
+    return process.stdout
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def count_keyframes(file_path):
+    """
+    Counts the keyframes of the first video stream.
+    Reads packet flags only (no decoding), so it costs one pass over the container.
+    """
+    output = _run_ffprobe([
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=flags',
+        '-of', 'csv=p=0',
+        '-i', file_path
+    ])
+    return sum(1 for line in output.splitlines() if line.startswith('K'))
+
+
+def probe_video(file_path, with_keyframes=True):
+    """
+    Probes a video file with a single `ffprobe -show_format -show_streams` call
+    and returns a flat dict with duration, codecs, resolution, bitrate and size.
+    The keyframe count needs a second pass and can be skipped.
+    """
+    output = _run_ffprobe([
+        '-show_format', '-show_streams',
+        '-of', 'json',
+        '-i', file_path
+    ])
+    try:
+        data = json.loads(output)
+    except ValueError:
+        raise ProbeError("ffprobe returned invalid JSON", output[:200])
+
+    fmt = data.get('format', {})
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+
+    info = {
+        "duration": _to_float(fmt.get('duration')),
+        "size": _to_int(fmt.get('size')),
+        "bit_rate": _to_int(fmt.get('bit_rate')),
+        "format_name": fmt.get('format_name'),
+        "video_codec": video.get('codec_name'),
+        "video_profile": video.get('profile'),
+        "pix_fmt": video.get('pix_fmt'),
+        "width": _to_int(video.get('width')),
+        "height": _to_int(video.get('height')),
+        "frame_rate": video.get('avg_frame_rate'),
+        "audio_codec": audio.get('codec_name'),
+        "audio_channels": _to_int(audio.get('channels')),
+        "keyframe_count": None,
+    }
+    if info["duration"] is None:
+        raise ProbeError("ffprobe did not report a duration")
+    if with_keyframes and video:
+        info["keyframe_count"] = count_keyframes(file_path)
+    return info
+
+
+class MetadataStore:
+    """
+    Persistent video metadata keyed by (path, size, mtime).
+
+    Lookups go through an in-memory LRU first, then the SQLite database, and
+    only spawn ffprobe when the file is new or has changed on disk. Changes are
+    detected with a single os.stat per lookup, so edited or replaced files are
+    re-probed automatically. Safe to use from multiple threads.
+
+    MP4 keyframe indexes (see mp4_index.py) are kept the same way in a table
+    of their own, built by parsing the file instead of running ffprobe.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, cache_size=DEFAULT_CACHE_SIZE, with_keyframes=True,
+                 index_cache_size=DEFAULT_INDEX_CACHE_SIZE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.index_cache_size = index_cache_size
+        self.with_keyframes = with_keyframes
+        self._cache = OrderedDict()  # path -> (size, mtime_ns, info)
+        self._index_cache = OrderedDict()  # path -> (size, mtime_ns, index)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.probes = 0
+        self._init_db()
+
+    def _connection(self):
+        """Returns this thread's SQLite connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS metadata ('
+            ' path TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' info TEXT NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS mp4_index ('
+            ' path TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' version INTEGER NOT NULL,'
+            ' data TEXT NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS views ('
+            ' path TEXT PRIMARY KEY,'
+            ' count INTEGER NOT NULL)')
+        conn.commit()
+
+    def _remember(self, path, size, mtime_ns, info, cache=None, cache_size=None):
+        cache = self._cache if cache is None else cache
+        with self._lock:
+            cache[path] = (size, mtime_ns, info)
+            cache.move_to_end(path)
+            while len(cache) > (cache_size or self.cache_size):
+                cache.popitem(last=False)
+
+    def get(self, file_path, with_keyframes=None):
+        """
+        Returns the metadata dict for file_path, probing it only if needed.
+        with_keyframes overrides the store's setting for a probe. For MP4s the
+        keyframe count comes from the keyframe index (get_mp4_index); other
+        files need an extra ffprobe pass over every packet.
+        Raises FileNotFoundError if the file is missing, ProbeError if ffprobe fails.
+        """
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        info = self.lookup(path, st)
+        if info is None:
+            # New or changed file: probe once and persist the result
+            with self._lock:
+                self.probes += 1
+            if with_keyframes is None:
+                with_keyframes = self.with_keyframes
+            from_index = with_keyframes and path.lower().endswith('.mp4')
+            info = probe_video(path, with_keyframes=with_keyframes and not from_index)
+            if from_index:
+                try:
+                    info["keyframe_count"] = len(self.get_mp4_index(path)["keyframe_offsets"])
+                except MP4IndexError:
+                    pass  # Left unknown rather than reading the whole file
+            self.put(path, st.st_size, st.st_mtime_ns, info)
+        return info
+
+    def lookup(self, file_path, st=None):
+        """
+        Returns the stored metadata for file_path if it matches the file's
+        current size and mtime (st, when the caller already has it), else
+        None. Never runs ffprobe.
+        """
+        path = os.path.abspath(file_path)
+        st = st or os.stat(path)
+
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                self._cache.move_to_end(path)
+                self.memory_hits += 1
+                return cached[2]
+
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT size, mtime_ns, info FROM metadata WHERE path = ?', (path,)).fetchone()
+        if not (row and row[0] == st.st_size and row[1] == st.st_mtime_ns):
+            return None
+        info = json.loads(row[2])
+        with self._lock:
+            self.db_hits += 1
+        self._remember(path, st.st_size, st.st_mtime_ns, info)
+        return info
+
+    def get_mp4_index(self, file_path):
+        """
+        Returns the keyframe/box index of an MP4 (mp4_index.build_index),
+        parsing the file only if it is new or changed.
+        Raises FileNotFoundError if the file is missing, MP4IndexError if it
+        can't be indexed.
+        """
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+
+        index = None
+        with self._lock:
+            cached = self._index_cache.get(path)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                self._index_cache.move_to_end(path)
+                index = cached[2]
+
+        if index is None:
+            conn = self._connection()
+            row = conn.execute(
+                'SELECT size, mtime_ns, version, data FROM mp4_index WHERE path = ?', (path,)).fetchone()
+            if (row and row[0] == st.st_size and row[1] == st.st_mtime_ns
+                    and row[2] == INDEX_VERSION):
+                index = json.loads(row[3])
+            else:
+                try:
+                    index = build_index(path)
+                except MP4IndexError as e:
+                    # Remembered too, so an unindexable file isn't parsed on every request
+                    index = {"error": str(e)}
+                conn.execute(
+                    'INSERT OR REPLACE INTO mp4_index (path, size, mtime_ns, version, data) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (path, st.st_size, st.st_mtime_ns, INDEX_VERSION,
+                     json.dumps(index, separators=(',', ':'))))
+                conn.commit()
+            self._remember(path, st.st_size, st.st_mtime_ns, index,
+                           self._index_cache, self.index_cache_size)
+
+        # Unindexable files are remembered as {"error": ...}, whichever cache answered
+        if "error" in index:
+            raise MP4IndexError(index["error"])
+        return index
+
+    def preload(self, file_paths):
+        """
+        Loads the stored metadata of many files into the in-memory cache with
+        a few batched queries (a server warming up before taking traffic).
+        Entries that don't match the file's current size and mtime are
+        skipped; they are probed on first use as usual. Returns the number
+        of entries loaded.
+        """
+        current = {}
+        for file_path in file_paths:
+            path = os.path.abspath(file_path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (st.st_size, st.st_mtime_ns)
+
+        paths = list(current)[:self.cache_size]
+        conn = self._connection()
+        loaded = 0
+        for i in range(0, len(paths), PRELOAD_BATCH_SIZE):
+            batch = paths[i:i + PRELOAD_BATCH_SIZE]
+            rows = conn.execute(
+                'SELECT path, size, mtime_ns, info FROM metadata WHERE path IN (%s)'
+                % ','.join('?' * len(batch)), batch).fetchall()
+            for path, size, mtime_ns, info in rows:
+                if current[path] == (size, mtime_ns):
+                    self._remember(path, size, mtime_ns, json.loads(info))
+                    loaded += 1
+        return loaded
+
+    def record_views(self, counts):
+        """Adds stream counts ({path: number of streams}) to the persistent view totals."""
+        if not counts:
+            return
+        conn = self._connection()
+        conn.executemany(
+            'INSERT INTO views (path, count) VALUES (?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET count = count + excluded.count',
+            [(os.path.abspath(path), count) for path, count in counts.items()])
+        conn.commit()
+
+    def most_viewed(self, limit):
+        """Paths of the `limit` most streamed files, most viewed first."""
+        conn = self._connection()
+        rows = conn.execute(
+            'SELECT path FROM views ORDER BY count DESC LIMIT ?', (limit,)).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        """Lookup counters: answered from memory, from SQLite, or by running ffprobe."""
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.probes
+            return {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "probes": self.probes,
+                "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+                "cached": len(self._cache),
+            }
+
+    def put(self, file_path, size, mtime_ns, info):
+        """Stores already-probed metadata (e.g. from the bulk indexer)."""
+        path = os.path.abspath(file_path)
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO metadata (path, size, mtime_ns, info) VALUES (?, ?, ?, ?)',
+            (path, size, mtime_ns, json.dumps(info)))
+        conn.commit()
+        self._remember(path, size, mtime_ns, info)
@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import struct
+from array import array
+from bisect import bisect_right
+
+# Bumped whenever the layout of the index changes, so stored indexes are rebuilt
+# (2: keyframe times include the composition offset from ctts)
+INDEX_VERSION = 2
+# Largest moov box that is read into memory (a multi-hour film has a few MB)
+MAX_MOOV_SIZE = 256 * 1024 * 1024
+
+# Boxes whose children are parsed (everything else is skipped over)
+_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts'}
+
+
+class MP4IndexError(Exception):
+    """The file isn't an MP4 this parser understands (or is truncated)."""
+
+
+def _read_box_header(f, offset, end):
+    """Reads the box header at offset. Returns (type, header size, box size) or None at end."""
+    if offset + 8 > end:
+        return None
+    f.seek(offset)
+    header = f.read(16)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', header)
+    header_size = 8
+    if size == 1:
+        if len(header) < 16:
+            raise MP4IndexError(f"truncated box header at {offset}")
+        size = struct.unpack_from('>Q', header, 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset  # Box extends to the end of the file
+    if size < header_size:
+        raise MP4IndexError(f"invalid size of '{box_type.decode('latin-1')}' box at {offset}")
+    return box_type, header_size, size
+
+
+def top_level_boxes(f, file_size):
+    """Returns [(type, offset, size), ...] for the top-level boxes of an open MP4."""
+    boxes = []
+    offset = 0
+    while True:
+        header = _read_box_header(f, offset, file_size)
+        if header is None:
+            break
+        box_type, _, size = header
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _children(data, start, end):
+    """Yields (type, payload start, payload end) for the boxes in data[start:end]."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4IndexError(f"invalid '{box_type.decode('latin-1')}' box in moov")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find_boxes(data, start, end, path):
+    """Yields (payload start, payload end) of every box at path (a list of types) below data[start:end]."""
+    for box_type, payload_start, payload_end in _children(data, start, end):
+        if box_type != path[0]:
+            continue
+        if len(path) == 1:
+            yield payload_start, payload_end
+        elif box_type in _CONTAINER_BOXES:
+            yield from _find_boxes(data, payload_start, payload_end, path[1:])
+
+
+def _first_box(data, start, end, path):
+    return next(_find_boxes(data, start, end, path), None)
+
+
+def _payload(data, parent, path):
+    """
+    Payload of the first box at path below parent, as a memoryview bounded to
+    the box (so reads past a short box fail instead of running into the next
+    one), or None if there is no such box.
+    """
+    box = _first_box(data, *parent, path)
+    return memoryview(data)[box[0]:box[1]] if box is not None else None
+
+
+def _uint32_table(data, start, count, columns=1):
+    """Reads count * columns big-endian uint32 values starting at data[start]."""
+    table = array('I')
+    table.frombytes(data[start:start + count * columns * 4])
+    if len(table) != count * columns:
+        raise MP4IndexError("truncated sample table")
+    if sys.byteorder == 'little':
+        table.byteswap()
+    return table
+
+
+def _sample_sizes(data, stbl):
+    stsz = _payload(data, stbl, [b'stsz'])
+    if stsz is not None:
+        sample_size, count = struct.unpack_from('>II', stsz, 4)
+        if sample_size:
+            return [sample_size] * count
+        return _uint32_table(stsz, 12, count)
+    stz2 = _payload(data, stbl, [b'stz2'])
+    if stz2 is None:
+        raise MP4IndexError("no sample size table")
+    field_size = stz2[7]
+    count = struct.unpack_from('>I', stz2, 8)[0]
+    if field_size == 16:
+        return list(struct.unpack_from(f'>{count}H', stz2, 12))
+    if field_size == 8:
+        sizes = list(stz2[12:12 + count])
+    else:
+        sizes = []  # 4-bit fields, two per byte
+        for byte in stz2[12:12 + (count + 1) // 2]:
+            sizes.extend((byte >> 4, byte & 0x0F))
+        sizes = sizes[:count]
+    if len(sizes) != count:
+        raise MP4IndexError("truncated sample table")
+    return sizes
+
+
+def _chunk_offsets(data, stbl):
+    stco = _payload(data, stbl, [b'stco'])
+    if stco is not None:
+        count = struct.unpack_from('>I', stco, 4)[0]
+        return _uint32_table(stco, 8, count)
+    co64 = _payload(data, stbl, [b'co64'])
+    if co64 is None:
+        raise MP4IndexError("no chunk offset table")
+    count = struct.unpack_from('>I', co64, 4)[0]
+    return struct.unpack_from(f'>{count}Q', co64, 8)
+
+
+def _media_start(data, trak):
+    """Media time (in the track's timescale) where presentation starts, from the edit list."""
+    elst = _payload(data, trak, [b'edts', b'elst'])
+    if elst is None:
+        return 0
+    version = elst[0]
+    count = struct.unpack_from('>I', elst, 4)[0]
+    offset = 8
+    for _ in range(count):
+        if version == 1:
+            _, media_time = struct.unpack_from('>Qq', elst, offset)
+            offset += 20
+        else:
+            _, media_time = struct.unpack_from('>Ii', elst, offset)
+            offset += 12
+        if media_time >= 0:  # -1 is an empty edit (a delay)
+            return media_time
+    return 0
+
+
+def _composition_offsets(data, stbl):
+    """Iterator over the composition offset (ctts) of every sample; empty without ctts."""
+    ctts = _payload(data, stbl, [b'ctts'])
+    if ctts is None:
+        return iter(())
+    signed = ctts[0] == 1  # version 1 allows negative offsets
+    count = struct.unpack_from('>I', ctts, 4)[0]
+    table = _uint32_table(ctts, 8, count, 2)
+
+    def offsets():
+        for run in range(count):
+            offset = table[run * 2 + 1]
+            if signed and offset >= 1 << 31:
+                offset -= 1 << 32
+            for _ in range(table[run * 2]):
+                yield offset
+    return offsets()
+
+
+def _video_keyframes(data, trak):
+    """
+    Returns (timescale, duration in seconds, [(time in seconds, byte offset), ...])
+    for a video track, or None for any other kind of track.
+    """
+    hdlr = _payload(data, trak, [b'mdia', b'hdlr'])
+    if hdlr is None or hdlr[8:12] != b'vide':
+        return None
+    mdhd = _payload(data, trak, [b'mdia', b'mdhd'])
+    if mdhd is None:
+        raise MP4IndexError("video track without mdhd")
+    if mdhd[0] == 1:
+        timescale, duration = struct.unpack_from('>IQ', mdhd, 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', mdhd, 12)
+    if not timescale:
+        raise MP4IndexError("video track with a zero timescale")
+
+    stbl = _first_box(data, *trak, [b'mdia', b'minf', b'stbl'])
+    if stbl is None:
+        raise MP4IndexError("video track without a sample table")
+    sizes = _sample_sizes(data, stbl)
+    chunk_offsets = _chunk_offsets(data, stbl)
+
+    stts = _payload(data, stbl, [b'stts'])
+    stts_count = struct.unpack_from('>I', stts, 4)[0] if stts is not None else 0
+    stts_table = _uint32_table(stts, 8, stts_count, 2) if stts is not None else []
+
+    stsc = _payload(data, stbl, [b'stsc'])
+    stsc_count = struct.unpack_from('>I', stsc, 4)[0] if stsc is not None else 0
+    stsc_table = _uint32_table(stsc, 8, stsc_count, 3) if stsc is not None else []
+
+    # Sample numbers (1-based) of sync samples; without stss every sample is one
+    stss = _payload(data, stbl, [b'stss'])
+    if stss is not None:
+        count = struct.unpack_from('>I', stss, 4)[0]
+        sync = set(_uint32_table(stss, 8, count))
+    else:
+        sync = None
+
+    # Byte offset of every sample, from the chunk offsets and samples-per-chunk runs
+    sample_offsets = []
+    sample = 0
+    for run in range(stsc_count):
+        first_chunk = stsc_table[run * 3] - 1
+        per_chunk = stsc_table[run * 3 + 1]
+        last_chunk = (stsc_table[(run + 1) * 3] - 1 if run + 1 < stsc_count
+                      else len(chunk_offsets))
+        for chunk in range(first_chunk, min(last_chunk, len(chunk_offsets))):
+            offset = chunk_offsets[chunk]
+            for _ in range(per_chunk):
+                if sample >= len(sizes):
+                    break
+                sample_offsets.append(offset)
+                offset += sizes[sample]
+                sample += 1
+
+    # Presentation time of every sync sample: decode time plus composition
+    # offset (B-frames make the two differ), shifted by the edit list
+    offsets = _composition_offsets(data, stbl)
+    shift = _media_start(data, trak)
+    keyframes = []
+    sample = 0
+    time = 0
+    for run in range(stts_count):
+        count, delta = stts_table[run * 2], stts_table[run * 2 + 1]
+        for _ in range(count):
+            if sample >= len(sample_offsets):
+                break
+            if sync is None or sample + 1 in sync:
+                presentation = time + next(offsets, 0) - shift
+                keyframes.append((max(0.0, presentation / timescale), sample_offsets[sample]))
+            else:
+                next(offsets, 0)
+            time += delta
+            sample += 1
+    return timescale, duration / timescale, keyframes
+
+
+def _parse_moov(data):
+    """(timescale, duration, keyframes) of the first video track in a moov box."""
+    header_size = 16 if struct.unpack_from('>I', data)[0] == 1 else 8
+    for trak in _find_boxes(data, header_size, len(data), [b'trak']):
+        video = _video_keyframes(data, trak)
+        if video is not None:
+            return video
+    raise MP4IndexError("no video track")
+
+
+def build_index(file_path):
+    """
+    Parses an MP4 once (top-level boxes plus the moov box, no media data) and
+    returns a compact index:
+      size, faststart          file size; whether moov comes before mdat
+      moov, mdat               {"offset", "size"} of the boxes
+      duration, timescale      of the first video track
+      keyframe_times           presentation time of every keyframe (seconds,
+                               decode time + ctts offset - edit list start)
+      keyframe_offsets         byte offset of every keyframe, same order
+    Raises MP4IndexError for files it can't index, including truncated or
+    malformed sample tables (fragmented MP4s have their samples in moof boxes
+    and are reported with no keyframes).
+    """
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        boxes = top_level_boxes(f, file_size)
+        moov = next(((offset, size) for box_type, offset, size in boxes if box_type == b'moov'), None)
+        mdat = next(((offset, size) for box_type, offset, size in boxes if box_type == b'mdat'), None)
+        if moov is None:
+            raise MP4IndexError("no moov box")
+        if moov[1] > MAX_MOOV_SIZE:
+            raise MP4IndexError(f"moov box too large ({moov[1]} bytes)")
+        f.seek(moov[0])
+        data = f.read(moov[1])
+    if len(data) < moov[1]:
+        raise MP4IndexError("truncated moov box")
+
+    try:
+        timescale, duration, keyframes = _parse_moov(data)
+    except (struct.error, IndexError, ValueError) as e:
+        # A box shorter than its tables (truncated or corrupt file)
+        raise MP4IndexError(f"malformed moov box: {e}") from e
+
+    return {
+        "version": INDEX_VERSION,
+        "size": file_size,
+        "faststart": mdat is None or moov[0] < mdat[0],
+        "moov": {"offset": moov[0], "size": moov[1]},
+        "mdat": {"offset": mdat[0], "size": mdat[1]} if mdat else None,
+        "duration": duration,
+        "timescale": timescale,
+        "keyframe_times": [round(time, 3) for time, _ in keyframes],
+        "keyframe_offsets": [offset for _, offset in keyframes],
+    }
+
+
+def gop_range(index, offset):
+    """
+    Byte range [start, end) of the group of pictures (keyframe to next
+    keyframe, including interleaved audio) containing offset, or None if
+    offset lies outside the media data.
+    """
+    offsets = index["keyframe_offsets"]
+    position = bisect_right(offsets, offset) - 1
+    if position < 0:
+        return None
+    mdat = index.get("mdat")
+    media_end = mdat["offset"] + mdat["size"] if mdat else index["size"]
+    end = offsets[position + 1] if position + 1 < len(offsets) else media_end
+    return offsets[position], end
+
+
+def seek_plan(index, seconds):
+    """
+    What a player needs to start playing at `seconds`: the keyframe at or
+    before it and the byte range of its group of pictures.
+    Returns {"time", "start", "end"} (end inclusive, like a Range header).
+    """
+    times = index["keyframe_times"]
+    if not times:
+        return None
+    position = max(0, bisect_right(times, seconds) - 1)
+    start = index["keyframe_offsets"][position]
+    _, end = gop_range(index, start)
+    return {"time": times[position], "start": start, "end": end - 1}
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        index = build_index(path)
+        print(json.dumps({key: value for key, value in index.items()
+                          if not key.startswith('keyframe_')}))
+        print(f"{len(index['keyframe_times'])} keyframes")
@@ -0,0 +1,190 @@
+import math
+import time
+import threading
+
+# Per-client throughput is a moving average over roughly this many seconds
+THROUGHPUT_WINDOW = 10.0
+# Clients without active streams are forgotten after this many seconds
+CLIENT_STATS_TTL = 300.0
+
+
+class EgressBudget:
+    """
+    Global egress limit (bytes per second) shared fairly by the paced streams.
+
+    Each registered stream has a demand: the rate it would be paced at on its
+    own (math.inf while it is still sending its initial buffer, or when its
+    bitrate is unknown). The budget is split max-min fair: streams demanding
+    less than an equal share get their demand, and what they leave over is
+    split equally between the others. In practice that is a single "water
+    level" L, and every stream is allowed min(demand, L). A budget of 0 or
+    None means unlimited.
+    """
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second or None
+        self._demands = {}  # stream -> demand (bytes per second)
+        self._level = math.inf
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.bytes_per_second is not None
+
+    @property
+    def active(self):
+        return len(self._demands)
+
+    def register(self, stream, demand=math.inf):
+        with self._lock:
+            self._demands[stream] = demand
+            self._dirty = True
+
+    def set_demand(self, stream, demand):
+        with self._lock:
+            if stream in self._demands and self._demands[stream] != demand:
+                self._demands[stream] = demand
+                self._dirty = True
+
+    def unregister(self, stream):
+        with self._lock:
+            if self._demands.pop(stream, None) is not None:
+                self._dirty = True
+
+    def _water_level(self):
+        """The level L with sum(min(demand, L)) == budget (inf if the budget covers every demand)."""
+        remaining = self.bytes_per_second
+        demands = sorted(self._demands.values())
+        for position, demand in enumerate(demands):
+            share = remaining / (len(demands) - position)
+            if demand > share:
+                return share
+            remaining -= demand
+        return math.inf
+
+    def rate_for(self, stream):
+        """Bytes per second `stream` may send right now."""
+        with self._lock:
+            demand = self._demands.get(stream, math.inf)
+            if not self.enabled:
+                return demand
+            if self._dirty:
+                self._level = self._water_level()
+                self._dirty = False
+            return min(demand, self._level)
+
+
+class ClientThroughput:
+    """
+    Bytes sent and current throughput per client address, for /api/clients.
+    Throughput is an exponentially decaying average over THROUGHPUT_WINDOW
+    seconds, so it follows a client's actual rate without keeping history.
+    """
+
+    def __init__(self):
+        self._clients = {}  # address -> dict of counters
+        self._lock = threading.Lock()
+
+    def _client(self, address, now):
+        client = self._clients.get(address)
+        if client is None:
+            client = self._clients[address] = {
+                "active_streams": 0, "streams": 0, "bytes_sent": 0,
+                "rate": 0.0, "updated": now,
+            }
+        return client
+
+    @staticmethod
+    def _decay(client, now):
+        elapsed = now - client["updated"]
+        if elapsed > 0:
+            client["rate"] *= math.exp(-elapsed / THROUGHPUT_WINDOW)
+            client["updated"] = now
+
+    def stream_started(self, address):
+        with self._lock:
+            client = self._client(address, time.monotonic())
+            client["active_streams"] += 1
+            client["streams"] += 1
+
+    def stream_finished(self, address):
+        with self._lock:
+            client = self._clients.get(address)
+            if client is not None:
+                client["active_streams"] -= 1
+
+    def add_bytes(self, address, count):
+        now = time.monotonic()
+        with self._lock:
+            client = self._client(address, now)
+            self._decay(client, now)
+            client["bytes_sent"] += count
+            client["rate"] += count / THROUGHPUT_WINDOW
+
+    def snapshot(self):
+        """Returns {address: {active_streams, streams, bytes_sent, bytes_per_second}}."""
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for address, client in list(self._clients.items()):
+                self._decay(client, now)
+                if not client["active_streams"] and now - client["updated"] > CLIENT_STATS_TTL:
+                    del self._clients[address]
+                    continue
+                result[address] = {
+                    "active_streams": client["active_streams"],
+                    "streams": client["streams"],
+                    "bytes_sent": client["bytes_sent"],
+                    "bytes_per_second": round(client["rate"]),
+                }
+        return result
+
+    def __len__(self):
+        return len(self._clients)
+
+
+class PacedBody:
+    """
+    WSGI response body that sends the first burst_bytes of the wrapped body
+    (the player's initial buffer) as fast as the client takes them and the
+    rest at no more than rate_limit bytes per second, further limited by the
+    budget's share for this stream. Bytes are reported to `throughput` as
+    they are sent. close() unregisters from the budget and closes the body.
+
+    Pacing sleeps between chunks, so the serving thread (or greenlet) is held
+    for the whole transfer.
+    """
+
+    def __init__(self, body, client, throughput, budget, rate_limit=None, burst_bytes=0):
+        self.body = body
+        self.client = client
+        self.throughput = throughput
+        self.budget = budget
+        self.rate_limit = rate_limit or math.inf
+        self.burst_bytes = burst_bytes
+        self.bytes_sent = 0
+        budget.register(self, self.rate_limit if burst_bytes <= 0 else math.inf)
+
+    def __iter__(self):
+        due = time.monotonic()
+        for chunk in self.body:
+            rate = self.budget.rate_for(self)
+            if rate != math.inf:
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(due - now)
+                # Next chunk may go once this one has "drained" at the allowed rate;
+                # after a stall (slow client) the schedule restarts from now
+                due = max(due, now) + len(chunk) / rate
+            self.bytes_sent += len(chunk)
+            self.throughput.add_bytes(self.client, len(chunk))
+            if self.bytes_sent >= self.burst_bytes:
+                self.budget.set_demand(self, self.rate_limit)
+            yield chunk
+
+    def close(self):
+        self.budget.unregister(self)
+        close = getattr(self.body, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,197 @@
+import sys
+import json
+import time
+import random
+import threading
+
+from metrics import Counter, Histogram
+
+# Request durations (seconds): API calls are milliseconds, whole video
+# transfers take minutes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+# Time to first byte (seconds)
+TTFB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Key under which the per-request record is stored in the WSGI environ
+ENVIRON_KEY = 'video_streamer.request'
+
+
+class RequestRecord:
+    """
+    What is known about one request while it runs. The route is filled in by
+    the Flask app (see RequestMetrics.init_app), the title by stream_video.
+    finish() records the metrics once, when the response body is closed.
+    """
+
+    def __init__(self, metrics, environ):
+        self.metrics = metrics
+        self.environ = environ
+        self.started = time.perf_counter()
+        self.route = None
+        self.title = None
+        self.status = None
+        self.content_length = None
+        self.ttfb = None
+        self.bytes_sent = 0
+        # Set when the app finishes the record itself (see finish_on_close)
+        self.deferred = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def first_byte(self):
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.started
+
+    def finish_on_close(self, stream_file):
+        """
+        For bodies handed to the server's wsgi.file_wrapper (which can't be
+        wrapped without losing zero-copy sending): the request ends when the
+        server closes the file.
+        """
+        self.deferred = True
+
+        def closed():
+            # Files closed before the response started (304, 416, errors) are
+            # finished by the middleware as usual
+            if self.status is not None:
+                self.finish()
+
+        stream_file.call_on_close(closed)
+
+    def finish(self):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self.metrics._record(self, time.perf_counter() - self.started)
+
+
+class MeteredBody:
+    """Passes a WSGI response body through, timing the first chunk and counting bytes."""
+
+    def __init__(self, body, record):
+        self.body = body
+        self.record = record
+
+    def __iter__(self):
+        for chunk in self.body:
+            if chunk:
+                self.record.first_byte()
+                self.record.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.record.finish()
+
+
+class RequestMetrics:
+    """
+    WSGI middleware recording, per route: request count and latency by status,
+    time to first byte, and bytes served; plus bytes served per video title.
+    Optionally writes a sampled JSON lines access log.
+
+    Latency is measured until the response body is closed, i.e. it includes
+    the whole transfer for video streams; TTFB is the time to the first body
+    chunk (for zero-copy file bodies: until the app handed the file over).
+    """
+
+    def __init__(self, wsgi_app, registry=None, access_log=None, sample_rate=0.0):
+        self.wsgi_app = wsgi_app
+        self.sample_rate = sample_rate
+        self._access_log = None
+        self._log_lock = threading.Lock()
+        if access_log and sample_rate > 0:
+            self._access_log = (sys.stdout if access_log == '-'
+                                else open(access_log, 'a', encoding='utf-8', buffering=1))
+
+        self.requests = Counter(
+            'http_requests_total', 'Requests by route, method and status.',
+            ['route', 'method', 'status'], registry)
+        self.duration = Histogram(
+            'http_request_duration_seconds', 'Time until the response was fully sent, by route.',
+            ['route'], registry, DURATION_BUCKETS)
+        self.ttfb = Histogram(
+            'http_time_to_first_byte_seconds', 'Time until the first body byte, by route.',
+            ['route'], registry, TTFB_BUCKETS)
+        self.response_bytes = Counter(
+            'http_response_bytes_total', 'Response body bytes by route.', ['route'], registry)
+        self.title_bytes = Counter(
+            'video_bytes_served_total', 'Video bytes served per title.', ['title'], registry)
+
+    @staticmethod
+    def current(environ):
+        """The RequestRecord of the request being handled, or None."""
+        return environ.get(ENVIRON_KEY)
+
+    def init_app(self, app):
+        """Lets the Flask app label each request with its route pattern (e.g. /video/<filename>)."""
+        from flask import request
+
+        @app.before_request
+        def _label_route():
+            record = request.environ.get(ENVIRON_KEY)
+            if record is not None and request.url_rule is not None:
+                record.route = request.url_rule.rule
+
+    def __call__(self, environ, start_response):
+        record = RequestRecord(self, environ)
+        environ[ENVIRON_KEY] = record
+
+        def metered_start_response(status, headers, exc_info=None):
+            record.status = int(status.split(' ', 1)[0])
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    record.content_length = int(value)
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, metered_start_response)
+        except BaseException:
+            record.status = record.status or 500
+            record.finish()
+            raise
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            # Zero-copy body: the server sends Content-Length bytes from the file
+            record.first_byte()
+            record.bytes_sent = record.content_length or 0
+            if not record.deferred:
+                record.finish()
+            return body
+        return MeteredBody(body, record)
+
+    def _record(self, record, duration):
+        route = record.route or 'unmatched'
+        method = record.environ.get('REQUEST_METHOD', '')
+        self.requests.inc(route=route, method=method, status=record.status or 0)
+        self.duration.observe(duration, route=route)
+        if record.ttfb is not None:
+            self.ttfb.observe(record.ttfb, route=route)
+        self.response_bytes.inc(record.bytes_sent, route=route)
+        if record.title is not None:
+            self.title_bytes.inc(record.bytes_sent, title=record.title)
+
+        if self._access_log is not None and random.random() < self.sample_rate:
+            environ = record.environ
+            entry = {
+                "time": round(time.time(), 3),
+                "remote_addr": environ.get('REMOTE_ADDR'),
+                "method": method,
+                "path": environ.get('PATH_INFO'),
+                "query": environ.get('QUERY_STRING') or None,
+                "route": route,
+                "status": record.status,
+                "bytes": record.bytes_sent,
+                "duration": round(duration, 6),
+                "ttfb": round(record.ttfb, 6) if record.ttfb is not None else None,
+                "range": environ.get('HTTP_RANGE'),
+                "user_agent": environ.get('HTTP_USER_AGENT'),
+            }
+            with self._log_lock:
+                self._access_log.write(json.dumps(entry, ensure_ascii=False) + '\n')
@@ -0,0 +1,110 @@
+# Production entry point for the streaming server:
+#
+#   python server/serve.py [--host 0.0.0.0] [--port 8000] [--threads 16]
+#
+# Runs app.py under waitress (pure Python, works on Windows and Linux). Video
+# bodies are handed to waitress as file wrappers, which it sends from its
+# asynchronous I/O loop in small non-blocking writes. A worker thread is only
+# busy while a request is being handled, not for the whole transfer, so a few
+# threads can hold thousands of long-lived range streams. The number of open
+# connections is bounded by --connection-limit, the number of concurrent
+# streams by VIDEO_STREAMER_MAX_STREAMS (see app.py). Paced streams
+# (VIDEO_STREAMER_PACING / VIDEO_STREAMER_EGRESS_MBPS) are the exception: they
+# are sent from a worker thread that sleeps between chunks, so raise --threads
+# to the number of concurrent streams expected when pacing is on.
+#
+# The app starts accepting connections right away and warms up in the
+# background (catalog, stored metadata, heads of the most viewed titles); point
+# load balancer health checks at /ready, which answers 200 once that is done.
+#
+# On SIGTERM/SIGINT the server drains: new streams get 503 (so a load balancer
+# takes the node out), running streams get up to --grace seconds to finish,
+# then the server exits. A second signal exits immediately.
+#
+# Linux deployments can use gunicorn instead: gunicorn -c server/gunicorn.conf.py
+import os
+import sys
+import signal
+import argparse
+import threading
+import _thread
+
+from app import create_app, flush_views, stream_limiter
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the video streaming server in production mode (waitress).")
+    parser.add_argument('--host', default=os.environ.get('VIDEO_STREAMER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int,
+                        default=int(os.environ.get('VIDEO_STREAMER_PORT', '8000')))
+    parser.add_argument('--threads', type=int, default=16,
+                        help="worker threads handling requests (default: 16)")
+    parser.add_argument('--connection-limit', type=int, default=4000,
+                        help="maximum number of open client connections (default: 4000)")
+    parser.add_argument('--grace', type=float, default=30.0,
+                        help="seconds to let running streams finish on shutdown (default: 30)")
+    return parser.parse_args(argv)
+
+
+def install_shutdown_handlers(grace):
+    """
+    First SIGTERM/SIGINT: stop admitting streams and wait (in a background
+    thread) for active ones to finish, then interrupt the main thread.
+    Any further signal: stop right away.
+    """
+    state = {"draining": False}
+
+    def drain_and_stop():
+        print(f"Draining: waiting up to {grace:.0f}s for {stream_limiter.active} active stream(s)...")
+        if not stream_limiter.wait_idle(grace):
+            print(f"Grace period over, closing {stream_limiter.active} stream(s).")
+        _thread.interrupt_main()
+
+    def handle_signal(signum, frame):
+        if state["draining"]:
+            raise KeyboardInterrupt
+        state["draining"] = True
+        stream_limiter.drain()
+        threading.Thread(target=drain_and_stop, daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, handle_signal)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        from waitress import create_server
+    except ImportError:
+        print("Error: waitress is not installed (pip install waitress).", file=sys.stderr)
+        sys.exit(1)
+
+    server = create_server(
+        create_app(),
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connection_limit,
+        # poll() instead of select() so we aren't capped at 1024 sockets
+        asyncore_use_poll=True,
+        # Drop connections that stay idle between requests
+        channel_timeout=120,
+        ident='video-streamer',
+    )
+    install_shutdown_handlers(args.grace)
+    print(f"Serving on http://{args.host}:{args.port} "
+          f"({args.threads} threads, up to {args.connection_limit} connections)")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        flush_views()
+    print("Server stopped.")
+
+
+if __name__ == '__main__':
+    main()
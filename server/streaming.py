@@ -0,0 +1,123 @@
+import io
+import threading
+
+# Size of each read when streaming a byte range. Memory per request stays at
+# roughly one chunk no matter how large the requested range is.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StreamFile(io.BufferedReader):
+    """
+    Read-only file that runs registered callbacks once, when it is closed.
+
+    Response bodies close their file when the transfer finishes or the client
+    disconnects, so per-stream cleanup (releasing the stream slot, metrics, ...)
+    hooks in here. This also works when the body is handed to the server's
+    wsgi.file_wrapper, where Werkzeug's call_on_close would never run.
+    """
+
+    def __init__(self, path):
+        super().__init__(io.FileIO(path, 'rb'))
+        self._close_callbacks = []
+
+    def call_on_close(self, func):
+        self._close_callbacks.append(func)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            callbacks, self._close_callbacks = self._close_callbacks, []
+            for func in callbacks:
+                func()
+
+
+def iter_file_range(file_obj, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields `length` bytes of file_obj starting at `start`, at most chunk_size at a time.
+    Never holds more than one chunk in memory.
+    """
+    file_obj.seek(start)
+    remaining = length
+    while remaining > 0:
+        data = file_obj.read(min(chunk_size, remaining))
+        if not data:
+            # File was truncated while streaming; stop rather than spin
+            break
+        remaining -= len(data)
+        yield data
+
+
+class FileRangeIterator:
+    """
+    WSGI response body sending a byte range of a file in bounded chunks.
+    The server calls close() when the response ends, which closes the file.
+    """
+
+    def __init__(self, file_obj, start, length, chunk_size=STREAM_CHUNK_SIZE):
+        self.file_obj = file_obj
+        self.start = start
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return iter_file_range(self.file_obj, self.start, self.length, self.chunk_size)
+
+    def close(self):
+        self.file_obj.close()
+
+
+def file_range_body(environ, file_obj, start, length, use_file_wrapper=True):
+    """
+    Returns a WSGI response body that sends `length` bytes of file_obj from `start`
+    and closes file_obj when done.
+
+    Uses the server's wsgi.file_wrapper when available: gunicorn turns it into
+    os.sendfile (zero-copy) and waitress sends it from its non-blocking I/O loop,
+    and as PEP 3333 requires, both stop after Content-Length bytes. Otherwise
+    (e.g. on the Flask development server) a bounded chunk iterator is used.
+    """
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if use_file_wrapper and file_wrapper is not None:
+        # The server sends from the current position up to Content-Length
+        file_obj.seek(start)
+        return file_wrapper(file_obj, STREAM_CHUNK_SIZE)
+    return FileRangeIterator(file_obj, start, length)
+
+
+class StreamLimiter:
+    """
+    Counts active video streams and bounds them to `limit`.
+    While draining (graceful shutdown) no new streams are admitted, and
+    wait_idle() lets the shutdown code wait for the running ones to finish.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.draining = False
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        with self._cond:
+            if self.draining or self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def drain(self):
+        """Stops admitting new streams."""
+        with self._cond:
+            self.draining = True
+
+    def wait_idle(self, timeout):
+        """Waits up to timeout seconds for active streams to finish. Returns True if idle."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.active == 0, timeout)
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metadata_store import probe_video, ProbeError
+from getInfo import write_json_atomic
+
+# Where generated posters, sprite sheets and WebVTT thumbnail tracks are written.
+# Every file name contains a hash of its content, so the files never change and
+# are served with Cache-Control: immutable (see /thumbs in app.py).
+THUMBNAIL_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'static', 'thumbnails')
+# Maps each video's library path (config.library_path) to its generated images
+# (read by getInfo.py)
+MANIFEST_FILE = os.path.join(THUMBNAIL_DIR, 'manifest.json')
+# URL prefix under which app.py serves THUMBNAIL_DIR
+THUMBNAIL_URL_PREFIX = '/thumbs/'
+
+# Poster widths (pixels) and formats generated for each video
+POSTER_WIDTHS = [320, 640, 1280]
+POSTER_FORMATS = {
+    'jpg': ['-q:v', '3'],
+    'webp': ['-c:v', 'libwebp', '-quality', '80'],
+}
+# Seek-preview sprite sheets: tile size, grid and the maximum number of
+# thumbnails per video (the interval grows for long videos)
+SPRITE_TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_MAX_THUMBNAILS = 300
+SPRITE_MIN_INTERVAL = 2  # seconds
+
+# Guards read-modify-write of the manifest when several videos finish at once
+_manifest_lock = threading.Lock()
+
+
+def _run(command):
+    """Runs an ffmpeg command quietly, raising CalledProcessError on failure."""
+    subprocess.run(command + ['-y', '-loglevel', 'error'],
+                   capture_output=True, text=True, check=True)
+
+
+def _publish(temp_path, prefix, extension, output_dir):
+    """
+    Moves a generated file into output_dir under a content-hashed name
+    (<prefix>-<hash>.<extension>) and returns that name.
+    """
+    with open(temp_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    name = f"{prefix}-{digest}.{extension}"
+    os.replace(temp_path, os.path.join(output_dir, name))
+    return name
+
+
+def load_manifest(manifest_file=MANIFEST_FILE):
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def generate_posters(video_path, info, work_dir, output_dir):
+    """
+    Picks a representative frame (ffmpeg's thumbnail filter over a window
+    starting ~10% into the video, skipping intros and black frames) and renders
+    it at every POSTER_WIDTHS size in every POSTER_FORMATS format.
+    Returns {width: {format: file name}}.
+    """
+    frame_path = os.path.join(work_dir, 'frame.png')
+    seek = min(info['duration'] * 0.1, 60)
+    _run(['ffmpeg', '-ss', f'{seek:.3f}', '-i', video_path,
+          '-vf', 'thumbnail=100', '-frames:v', '1', frame_path])
+
+    posters = {}
+    for width in POSTER_WIDTHS:
+        if info.get('width') and width > info['width'] and width != POSTER_WIDTHS[0]:
+            continue  # Don't upscale (but always make the smallest size)
+        for extension, codec_args in POSTER_FORMATS.items():
+            temp_path = os.path.join(work_dir, f'poster-{width}.{extension}')
+            try:
+                _run(['ffmpeg', '-i', frame_path, '-vf', f'scale={width}:-2'] +
+                     codec_args + [temp_path])
+            except subprocess.CalledProcessError:
+                # e.g. ffmpeg built without libwebp; the other formats still work
+                continue
+            posters.setdefault(str(width), {})[extension] = _publish(
+                temp_path, f'poster-{width}', extension, output_dir)
+    return posters
+
+
+def _vtt_timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def generate_sprites(video_path, info, work_dir, output_dir):
+    """
+    Renders seek-preview thumbnails into SPRITE_COLUMNS x SPRITE_ROWS sprite
+    sheets and writes a WebVTT track mapping time ranges to sprite regions
+    (#xywh media fragments). Returns the file name of the VTT track.
+    """
+    duration = info['duration']
+    interval = max(SPRITE_MIN_INTERVAL, duration / SPRITE_MAX_THUMBNAILS)
+    tile_height = SPRITE_TILE_WIDTH * 9 // 16
+    if info.get('width') and info.get('height'):
+        tile_height = int(round(SPRITE_TILE_WIDTH * info['height'] / info['width'] / 2)) * 2
+
+    pattern = os.path.join(work_dir, 'sprite-%03d.jpg')
+    # Keyframe-only decoding (-skip_frame nokey) keeps this fast even for long videos
+    _run(['ffmpeg', '-skip_frame', 'nokey', '-i', video_path,
+          '-vf', f'fps=1/{interval:.3f},scale={SPRITE_TILE_WIDTH}:{tile_height},'
+                 f'tile={SPRITE_COLUMNS}x{SPRITE_ROWS}',
+          '-vsync', 'vfr', '-q:v', '4', pattern])
+
+    sheets = sorted(name for name in os.listdir(work_dir) if name.startswith('sprite-'))
+    sheet_names = [_publish(os.path.join(work_dir, name), 'sprite', 'jpg', output_dir)
+                   for name in sheets]
+
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    total = int(duration // interval) + 1
+    lines = ['WEBVTT', '']
+    for i in range(min(total, per_sheet * len(sheet_names))):
+        sheet, cell = divmod(i, per_sheet)
+        row, column = divmod(cell, SPRITE_COLUMNS)
+        start = i * interval
+        end = min(duration, (i + 1) * interval)
+        lines.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+        lines.append(f"{sheet_names[sheet]}#xywh={column * SPRITE_TILE_WIDTH},"
+                     f"{row * tile_height},{SPRITE_TILE_WIDTH},{tile_height}")
+        lines.append('')
+
+    vtt_path = os.path.join(work_dir, 'thumbnails.vtt')
+    with open(vtt_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    return _publish(vtt_path, 'thumbnails', 'vtt', output_dir)
+
+
+def manifest_key(video_path):
+    """
+    Manifest key of a video: its library path ('<root>/<relative path>'), so
+    equal file names in different roots or folders don't share images.
+    Videos outside every library root are keyed by their absolute path.
+    """
+    from config import find_library_path
+    return find_library_path(video_path) or os.path.abspath(video_path)
+
+
+def generate_thumbnails(video_path, output_dir=THUMBNAIL_DIR, manifest_file=MANIFEST_FILE, force=False):
+    """
+    Generates posters and the sprite/WebVTT seek preview for one video and
+    records them in the manifest under manifest_key(video_path).
+    Skips videos whose size and mtime match the manifest entry unless force is set.
+    Returns True if the video is up to date afterwards, False on error (it
+    never raises for a missing file or an unwritable manifest).
+    """
+    filename = os.path.basename(video_path)
+    key = manifest_key(video_path)
+    work_dir = None
+    try:
+        st = os.stat(video_path)
+        with _manifest_lock:
+            entry = load_manifest(manifest_file).get(key)
+        if (not force and entry and entry.get('size') == st.st_size
+                and entry.get('mtime_ns') == st.st_mtime_ns):
+            return True
+
+        os.makedirs(output_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='thumbs-')
+        info = probe_video(video_path, with_keyframes=False)
+        posters = generate_posters(video_path, info, work_dir, output_dir)
+        vtt = generate_sprites(video_path, info, work_dir, output_dir)
+
+        with _manifest_lock:
+            manifest = load_manifest(manifest_file)
+            manifest[key] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "posters": posters,
+                "sprites_vtt": vtt,
+            }
+            write_json_atomic(manifest_file, manifest)
+    except (ProbeError, subprocess.CalledProcessError, OSError) as e:
+        details = getattr(e, 'stderr', None) or getattr(e, 'details', None) or e
+        print(f"Error generating thumbnails for '{filename}': {details}", file=sys.stderr)
+        return False
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return True
+
+
+def generate_all(video_paths, workers=None, force=False):
+    """
+    Generates thumbnails for many videos in parallel.
+    Returns (generated_or_up_to_date_count, error_count).
+    """
+    workers = workers or max(1, (os.cpu_count() or 1) // 2)
+    ok_count = 0
+    error_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(generate_thumbnails, path, force=force): path
+                   for path in video_paths}
+        for future in as_completed(futures):
+            if future.result():
+                ok_count += 1
+            else:
+                error_count += 1
+    return ok_count, error_count
+
+
+def main(argv=None):
+    from config import LIBRARY_ROOTS
+
+    parser = argparse.ArgumentParser(
+        description="Generate posters and seek-preview sprites for converted videos.")
+    parser.add_argument('directory', nargs='*', default=list(LIBRARY_ROOTS.values()),
+                        help="directories to scan (default: every library root)")
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help="regenerate even if the video hasn't changed")
+    args = parser.parse_args(argv)
+
+    video_paths = [os.path.join(root, name)
+                   for directory in args.directory
+                   for root, _, files in os.walk(directory)
+                   for name in files if name.lower().endswith('.mp4')]
+    print(f"Generating thumbnails for {len(video_paths)} video(s)...")
+    ok_count, error_count = generate_all(video_paths, args.workers, args.force)
+    print(f"Done: {ok_count} up to date, {error_count} failed.")
+
+
+if __name__ == '__main__':
+    main()
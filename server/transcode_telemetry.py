@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+
+from metrics import Counter, Gauge, Histogram
+
+# Per-job progress events are written to the JSON lines log at most this often
+# (ffmpeg reports every 0.5 s; Prometheus gauges are updated on every report)
+EVENT_INTERVAL = 5.0
+# Buckets for the wall time of whole jobs (seconds) and their average speed (x realtime)
+JOB_SECONDS_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+JOB_SPEED_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+# Clock ticks per second for /proc/<pid>/stat CPU times (Linux only)
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = None
+
+
+def iter_progress_blocks(stream):
+    """
+    Reads ffmpeg `-progress` output (key=value lines, each report ending with
+    progress=continue or progress=end) and yields one dict per report.
+    """
+    fields = {}
+    for line in stream:
+        key, separator, value = line.strip().partition('=')
+        if not separator:
+            continue
+        fields[key] = value.strip()
+        if key == 'progress':
+            yield fields
+            fields = {}
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None  # 'N/A' and missing fields
+
+
+def parse_progress(fields):
+    """
+    Turns one raw progress report into typed values:
+    frame, fps, bitrate_kbps, total_size (bytes), out_time (seconds of output
+    written), speed (x realtime), dup_frames, drop_frames and done (bool).
+    Unknown values are None.
+    """
+    out_time_us = _number(fields.get('out_time_us'), int)
+    if out_time_us is None:
+        # Despite its name, out_time_ms is in microseconds as well
+        out_time_us = _number(fields.get('out_time_ms'), int)
+    bitrate = fields.get('bitrate', '')
+    speed = fields.get('speed', '')
+    return {
+        "frame": _number(fields.get('frame'), int),
+        "fps": _number(fields.get('fps')),
+        "bitrate_kbps": _number(bitrate[:-len('kbits/s')]) if bitrate.endswith('kbits/s') else None,
+        "total_size": _number(fields.get('total_size'), int),
+        "out_time": max(0.0, out_time_us / 1e6) if out_time_us is not None else None,
+        "speed": _number(speed[:-1]) if speed.endswith('x') else None,
+        "dup_frames": _number(fields.get('dup_frames'), int),
+        "drop_frames": _number(fields.get('drop_frames'), int),
+        "done": fields.get('progress') == 'end',
+    }
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a running process from /proc, or None where unavailable."""
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name (field 2) may contain spaces, so split after its ')'
+    fields = stat.rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+
+class JobTelemetry:
+    """
+    Progress and resource use of one ffmpeg run, fed by TranscodeTelemetry.
+    id is unique within the process (name plus a counter) and labels the job's
+    metrics and events; name is what the job works on (e.g. the input path).
+    """
+
+    def __init__(self, telemetry, job_id, name, duration):
+        self.telemetry = telemetry
+        self.id = job_id
+        self.name = name
+        self.duration = duration
+        self.started = time.monotonic()
+        self.stats = {}
+        self.cpu_seconds = None
+        self._last_event = 0.0
+
+    def update(self, fields, pid=None):
+        """
+        Records one raw progress report from ffmpeg. Returns the job's current
+        stats: the parsed report plus percent, eta (seconds), elapsed and cpu_seconds.
+        """
+        stats = parse_progress(fields)
+        now = time.monotonic()
+        elapsed = now - self.started
+        out_time = stats['out_time']
+        percent = None
+        eta = None
+        if self.duration and out_time is not None:
+            percent = max(0.0, min(100.0, out_time / self.duration * 100))
+            remaining = max(0.0, self.duration - out_time)
+            if stats['speed']:
+                eta = remaining / stats['speed']
+            elif out_time > 0:
+                eta = remaining * elapsed / out_time
+        if stats['done']:
+            percent, eta = (100.0 if self.duration else None), 0.0
+        if pid is not None:
+            cpu_seconds = process_cpu_seconds(pid)
+            if cpu_seconds is not None:
+                self.cpu_seconds = cpu_seconds
+
+        stats.update(percent=percent, eta=eta, elapsed=elapsed, cpu_seconds=self.cpu_seconds)
+        self.telemetry._job_progress(self, stats)
+        self.stats = stats
+
+        if stats['done'] or now - self._last_event >= self.telemetry.event_interval:
+            self._last_event = now
+            self.telemetry.emit(dict(event='job_progress', job=self.id, duration=self.duration,
+                                     **{key: value for key, value in stats.items() if key != 'done'}))
+        return stats
+
+    def finish(self, ok):
+        self.telemetry._job_finished(self, ok)
+
+
+class TranscodeTelemetry:
+    """
+    Collects structured progress from every ffmpeg job of the process.
+
+    Per-job values (speed, fps, progress, ETA, CPU time) and farm-wide totals are
+    kept as Prometheus metrics (see metrics.start_metrics_server) and, when a
+    log is opened, also written as JSON lines: 'job_start', throttled
+    'job_progress', 'job_end' and an 'aggregate' summary whenever a job starts
+    or ends.
+    """
+
+    def __init__(self, event_interval=EVENT_INTERVAL, registry=None):
+        self.event_interval = event_interval
+        self._sink = None
+        self._sink_lock = threading.Lock()
+        self._jobs = {}  # id -> JobTelemetry
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+        self.jobs_active = Gauge(
+            'transcode_jobs_active', 'ffmpeg jobs currently running.', registry=registry)
+        self.jobs_total = Counter(
+            'transcode_jobs_total', 'Finished ffmpeg jobs by result.', ['result'], registry)
+        self.media_seconds = Counter(
+            'transcode_media_seconds_total', 'Seconds of video written by ffmpeg.', registry=registry)
+        self.frames = Counter(
+            'transcode_frames_total', 'Frames written by ffmpeg.', registry=registry)
+        self.cpu_seconds = Counter(
+            'transcode_cpu_seconds_total', 'CPU time used by finished ffmpeg jobs.', registry=registry)
+        self.job_seconds = Histogram(
+            'transcode_job_seconds', 'Wall time of finished ffmpeg jobs.', ['result'], registry,
+            JOB_SECONDS_BUCKETS)
+        self.job_speed = Histogram(
+            'transcode_job_speed_ratio', 'Average speed of successful jobs (x realtime).',
+            registry=registry, buckets=JOB_SPEED_BUCKETS)
+        self.speed = Gauge(
+            'transcode_speed_ratio', 'Current encode speed per running job (x realtime).',
+            ['job'], registry)
+        self.fps = Gauge('transcode_fps', 'Current frames per second per running job.',
+                         ['job'], registry)
+        self.progress = Gauge('transcode_progress_ratio', 'Completed share per running job (0-1).',
+                              ['job'], registry)
+        self.eta = Gauge('transcode_eta_seconds', 'Estimated time left per running job.',
+                         ['job'], registry)
+        self.job_cpu = Gauge('transcode_job_cpu_seconds', 'CPU time used so far per running job.',
+                             ['job'], registry)
+
+    def open_log(self, path):
+        """Writes JSON lines events to path ('-' for stdout), appending to existing files."""
+        self._sink = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8', buffering=1)
+
+    def emit(self, event):
+        if self._sink is None:
+            return
+        event = dict(time=round(time.time(), 3), **event)
+        line = json.dumps(event, ensure_ascii=False)
+        with self._sink_lock:
+            self._sink.write(line + '\n')
+            self._sink.flush()
+
+    def aggregate(self):
+        """Farm-wide totals across the jobs running right now and those finished."""
+        with self._lock:
+            running = [job.stats for job in self._jobs.values()]
+        return {
+            "active_jobs": len(running),
+            "speed": sum(stats.get('speed') or 0 for stats in running),
+            "fps": sum(stats.get('fps') or 0 for stats in running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "media_seconds": self.media_seconds.get(),
+            "cpu_seconds": self.cpu_seconds.get(),
+        }
+
+    def start_job(self, name, duration=None):
+        """
+        Starts tracking one ffmpeg run. Several runs may share a name (e.g. the
+        concat step of every segmented title); each gets its own id.
+        """
+        with self._lock:
+            job = JobTelemetry(self, f"{name}#{next(self._job_ids)}", name, duration)
+            self._jobs[job.id] = job
+        self.jobs_active.inc()
+        self.emit({"event": "job_start", "job": job.id, "name": name, "duration": duration})
+        self.emit(dict(event='aggregate', **self.aggregate()))
+        return job
+
+    def _job_progress(self, job, stats):
+        previous = job.stats
+        if stats['out_time'] is not None:
+            self.media_seconds.inc(max(0.0, stats['out_time'] - (previous.get('out_time') or 0)))
+        if stats['frame'] is not None:
+            self.frames.inc(max(0, stats['frame'] - (previous.get('frame') or 0)))
+        if stats['speed'] is not None:
+            self.speed.set(stats['speed'], job=job.id)
+        if stats['fps'] is not None:
+            self.fps.set(stats['fps'], job=job.id)
+        if stats['percent'] is not None:
+            self.progress.set(stats['percent'] / 100, job=job.id)
+        if stats['eta'] is not None:
+            self.eta.set(stats['eta'], job=job.id)
+        if stats['cpu_seconds'] is not None:
+            self.job_cpu.set(stats['cpu_seconds'], job=job.id)
+
+    def _job_finished(self, job, ok):
+        elapsed = time.monotonic() - job.started
+        result = 'ok' if ok else 'failed'
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self.jobs_active.dec()
+        self.jobs_total.inc(result=result)
+        self.job_seconds.observe(elapsed, result=result)
+        if job.cpu_seconds is not None:
+            self.cpu_seconds.inc(job.cpu_seconds)
+        average_speed = None
+        out_time = job.stats.get('out_time')
+        if ok and out_time and elapsed > 0:
+            average_speed = out_time / elapsed
+            self.job_speed.observe(average_speed)
+        for gauge in (self.speed, self.fps, self.progress, self.eta, self.job_cpu):
+            gauge.remove(job=job.id)
+
+        self.emit({"event": "job_end", "job": job.id, "result": result,
+                   "elapsed": elapsed, "media_seconds": out_time,
+                   "average_speed": average_speed, "cpu_seconds": job.cpu_seconds})
+        self.emit(dict(event='aggregate', **self.aggregate()))
+
+
+# Telemetry of this process's ffmpeg jobs (convert_videos.run_ffmpeg reports here)
+telemetry = TranscodeTelemetry()
@@ -0,0 +1,381 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import traceback
+import urllib.request
+import urllib.error
+
+from config import LIBRARY_ROOTS, HLS_DIR, find_library_path
+from convert_videos import (VIDEO_DIR, DEFAULT_WORKERS, conversion_target, enqueue_files,
+                            find_files_to_convert, run_conversions, log,
+                            add_encoding_args, add_telemetry_args, setup_telemetry)
+from encode_profiles import DEFAULT_PROFILE
+from getInfo import is_partial_file, generate_video_list_json, POSTER_BASE_PATH, DEFAULT_POSTER
+from job_queue import JobQueue
+
+# watchdog is optional: it uses inotify on Linux (ReadDirectoryChangesW on
+# Windows, FSEvents on macOS). Without it the directories are polled.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# A new or changed file is only acted on once its size and mtime have stayed the
+# same for this many seconds (it may still be copied or uploaded until then)
+SETTLE_SECONDS = 5
+# How often settled files are looked for
+CHECK_INTERVAL = 1.0
+# Scan interval of the polling fallback
+POLL_INTERVAL = 2.0
+# Without a wake-up, the conversion thread still looks at the queue this often
+# (retries whose backoff has expired)
+QUEUE_CHECK_INTERVAL = 30
+
+# Catalog served by app.py (the same file its /api/videos reads)
+CATALOG_JSON = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'videos.json')
+# app.py endpoint that makes the running server re-read the catalog right away.
+# Empty to disable (the server also notices the new file within a second).
+RELOAD_URL = os.environ.get(
+    'VIDEO_STREAMER_RELOAD_URL', 'http://127.0.0.1:5000/api/catalog/reload')
+
+
+class ChangeTracker:
+    """
+    Debounces file system events. touch() records that a path changed; ready()
+    returns the paths that have been quiet for `settle` seconds and whose size
+    and mtime didn't move since they were last looked at. Deleted paths are
+    returned too. Safe to use from multiple threads.
+    """
+
+    def __init__(self, settle=SETTLE_SECONDS):
+        self.settle = settle
+        self._changed = {}  # path -> [time of last change, (size, mtime_ns) or 'deleted']
+        self._lock = threading.Lock()
+
+    def touch(self, path):
+        with self._lock:
+            self._changed[path] = [time.monotonic(), self._signature(path)]
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 'deleted'
+        return (st.st_size, st.st_mtime_ns)
+
+    def _readable(self, path):
+        try:
+            # Files still being written are locked on Windows
+            with open(path, 'rb'):
+                return True
+        except FileNotFoundError:
+            return True  # Deleted
+        except OSError:
+            return False
+
+    def ready(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [path for path, (changed_at, _) in self._changed.items()
+                   if now - changed_at >= self.settle]
+        settled = []
+        for path in due:
+            signature = self._signature(path)
+            readable = self._readable(path)
+            with self._lock:
+                entry = self._changed.get(path)
+                if entry is None or now - entry[0] < self.settle:
+                    continue  # Touched again meanwhile
+                if readable and signature == entry[1]:
+                    del self._changed[path]
+                    settled.append(path)
+                else:
+                    # Still changing (or locked): wait another settle period
+                    entry[0] = now
+                    entry[1] = signature
+        return settled
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Forwards watchdog file events to a callback."""
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        self.callback(event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self.callback(dest_path)  # Moves and renames
+
+
+class DirectoryPoller:
+    """
+    Polling fallback for when watchdog isn't installed: rescans the directories
+    every POLL_INTERVAL seconds and reports every file that appeared, changed
+    size or mtime, or disappeared.
+    """
+
+    def __init__(self, directories, callback, interval=POLL_INTERVAL):
+        self.directories = directories
+        self.callback = callback
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _snapshot(self):
+        snapshot = {}
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _run(self, previous):
+        while not self._stop_event.wait(self.interval):
+            current = self._snapshot()
+            for path in current.keys() | previous.keys():
+                if current.get(path) != previous.get(path):
+                    self.callback(path)
+            previous = current
+
+    def start(self):
+        # The baseline is taken before returning, so every change made after
+        # start() is reported
+        self._thread = threading.Thread(target=self._run, args=(self._snapshot(),),
+                                        name='directory-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+
+
+def notify_app(reload_url=RELOAD_URL):
+    """Asks the running app.py to reload its catalog. Failures are only reported."""
+    if not reload_url:
+        return
+    try:
+        with urllib.request.urlopen(urllib.request.Request(reload_url, method='POST'), timeout=5):
+            pass
+    except (urllib.error.URLError, OSError) as e:
+        log(f"Could not notify the server at {reload_url}: {e}", file=sys.stderr)
+
+
+class LibraryWatcher:
+    """
+    Long-running replacement for running convert_videos.py and getInfo.py by hand.
+
+    Watches VIDEO_DIR for new sources and queues them in the conversion job
+    queue once they have finished copying; a background thread converts them
+    as they arrive. Watches the library roots (config.LIBRARY_ROOTS) for
+    MP4s appearing, changing or disappearing, updates the catalog for just
+    those files and tells app.py to reload it.
+    """
+
+    def __init__(self, mode='mp4', workers=DEFAULT_WORKERS, threads=None, thumbnails=True,
+                 use_polling=False, settle=SETTLE_SECONDS, reload_url=RELOAD_URL,
+                 catalog_json=CATALOG_JSON, profile=DEFAULT_PROFILE, analyze=False,
+                 segments=None):
+        self.mode = mode
+        self.profile = profile
+        self.analyze = analyze
+        self.segments = segments
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.thumbnails = thumbnails
+        self.use_polling = use_polling or Observer is None
+        self.reload_url = reload_url
+        self.catalog_json = catalog_json
+        self.source_dir = os.path.abspath(VIDEO_DIR)
+        self.library_roots = {name: os.path.abspath(directory)
+                              for name, directory in LIBRARY_ROOTS.items()}
+        self.queue = JobQueue()
+        self.tracker = ChangeTracker(settle)
+        self._wake_converter = threading.Event()
+        # Library files to re-index, and whether the catalog needs rebuilding
+        # (new thumbnails or HLS packages), filled in by the conversion thread
+        self._pending_library = set()
+        self._catalog_stale = False
+        self._pending_lock = threading.Lock()
+        self._observer = None
+
+    def _in_dir(self, path, directory):
+        return os.path.commonpath([os.path.abspath(path), directory]) == directory
+
+    def _on_change(self, path):
+        self.tracker.touch(os.path.abspath(path))
+
+    def _on_job_complete(self, job):
+        # The catalog entry of an MP4 is rebuilt once its thumbnails exist
+        with self._pending_lock:
+            self._catalog_stale = True
+            libpath = find_library_path(job['output'], self.library_roots)
+            if self.mode == 'mp4' and libpath is not None:
+                self._pending_library.add(libpath)
+
+    def _conversion_loop(self):
+        while True:
+            self._wake_converter.wait(QUEUE_CHECK_INTERVAL)
+            self._wake_converter.clear()
+            try:
+                if self.queue.seconds_until_next(self.mode) is None:
+                    continue  # Nothing pending
+                run_conversions(self.queue, self.workers, self.threads, self.mode,
+                                self.thumbnails, on_complete=self._on_job_complete,
+                                profile=self.profile, analyze=self.analyze,
+                                segments=self.segments)
+            except Exception:
+                # Keep the thread alive so later arrivals are still converted
+                log(f"Conversion run failed:\n{traceback.format_exc()}", file=sys.stderr)
+
+    def queue_sources(self, paths):
+        """Queues the given source files for conversion. Returns how many were added."""
+        candidates = []
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            converted_path = conversion_target(path, self.mode)
+            if converted_path is not None:
+                candidates.append((path, converted_path, os.path.basename(path)))
+        if not candidates:
+            return 0
+        counts = enqueue_files(self.queue, candidates, self.mode, self.workers * 2)
+        added = counts['queued'] + counts['requeued']
+        if added:
+            log(f"Queued {added} new video(s) for conversion.")
+            self._wake_converter.set()
+        return added
+
+    def update_catalog(self, libpaths=None):
+        """
+        Updates videos.json for the given library paths (all files when None)
+        and notifies the server.
+        """
+        generate_video_list_json(self.library_roots, self.catalog_json, POSTER_BASE_PATH,
+                                 DEFAULT_POSTER, HLS_DIR, changed=libpaths)
+        notify_app(self.reload_url)
+
+    def catch_up(self):
+        """
+        Handles everything that happened while the watcher wasn't running:
+        resumes interrupted jobs, queues unconverted sources and re-indexes the
+        library (the incremental index makes this cheap when little changed).
+        """
+        recovered = self.queue.recover()
+        if recovered:
+            log(f"Resuming {recovered} job(s) interrupted by a previous run.")
+        candidates, _ = find_files_to_convert(self.mode)
+        enqueue_files(self.queue, candidates, self.mode, self.workers * 2)
+        self.update_catalog()
+        self._wake_converter.set()
+
+    def handle_settled(self):
+        """Acts on every file that has settled since the last call."""
+        sources = []
+        library = []
+        for path in self.tracker.ready():
+            if is_partial_file(os.path.basename(path)):
+                continue
+            libpath = find_library_path(path, self.library_roots)
+            if libpath is not None:
+                library.append(libpath)
+            elif self._in_dir(path, self.source_dir):
+                sources.append(path)
+        if sources:
+            self.queue_sources(sources)
+
+        with self._pending_lock:
+            library.extend(self._pending_library)
+            stale = self._catalog_stale
+            self._pending_library = set()
+            self._catalog_stale = False
+        if library or stale:
+            self.update_catalog(sorted(set(library)))
+
+    def start(self):
+        # Watch first, then catch up, so nothing slips through in between
+        directories = [self.source_dir] + list(self.library_roots.values())
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.use_polling:
+            log("Watching for changes by polling.")
+            self._observer = DirectoryPoller(directories, self._on_change)
+        else:
+            log("Watching for changes with file system events.")
+            self._observer = Observer()
+            handler = _EventHandler(self._on_change)
+            for directory in directories:
+                self._observer.schedule(handler, directory, recursive=True)
+        self._observer.start()
+        self.catch_up()
+        threading.Thread(target=self._conversion_loop, name='converter', daemon=True).start()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(CHECK_INTERVAL)
+                self.handle_settled()
+        finally:
+            self._observer.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Watch VIDEO_DIR and the library roots; convert new videos "
+                    "and keep the catalog up to date.")
+    parser.add_argument('-m', '--mode', choices=['mp4', 'hls'], default='mp4')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"number of concurrent ffmpeg jobs (default: {DEFAULT_WORKERS})")
+    parser.add_argument('-t', '--threads', type=int, default=None,
+                        help="encoder threads per job (default: CPU count / workers)")
+    parser.add_argument('--no-thumbnails', action='store_true',
+                        help="don't generate posters and seek-preview sprites")
+    parser.add_argument('--poll', action='store_true',
+                        help="poll the directories even if watchdog is installed")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                        help=f"seconds a file must stay unchanged before it is "
+                             f"processed (default: {SETTLE_SECONDS})")
+    parser.add_argument('--reload-url', default=RELOAD_URL,
+                        help="app.py catalog reload endpoint ('' to disable)")
+    add_encoding_args(parser)
+    add_telemetry_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_telemetry(args)
+    if args.mode == 'hls':
+        os.makedirs(HLS_DIR, exist_ok=True)
+    watcher = LibraryWatcher(args.mode, args.workers, args.threads, not args.no_thumbnails,
+                             args.poll, args.settle, args.reload_url,
+                             profile=args.profile, analyze=args.analyze,
+                             segments=args.parallel_segments)
+    library = ', '.join(f"'{directory}'" for directory in watcher.library_roots.values())
+    print(f"Watching '{watcher.source_dir}' for new videos and "
+          f"{library} for library changes. Press Ctrl+C to stop.")
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        # Jobs still running are resumed by the next start (JobQueue.recover)
+        print("\nStopping watcher.")
+
+
+if __name__ == '__main__':
+    main()
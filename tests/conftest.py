@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+# The server's modules import each other by plain name (they run from server/)
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+sys.path.insert(0, SERVER_DIR)
+
+# Point every server setting into a scratch directory before any server module
+# reads them, so the tests never touch a real library, database or catalog
+STATE_DIR = tempfile.mkdtemp(prefix='video-streamer-tests-')
+LIBRARY_DIR = os.path.join(STATE_DIR, 'library')
+SOURCE_DIR = os.path.join(STATE_DIR, 'sources')
+os.makedirs(LIBRARY_DIR)
+os.makedirs(SOURCE_DIR)
+os.environ.update({
+    'VIDEO_STREAMER_LIBRARY_ROOTS': f'test={LIBRARY_DIR}',
+    'VIDEO_STREAMER_VIDEO_DIR': SOURCE_DIR,
+    'VIDEO_STREAMER_HLS_DIR': os.path.join(STATE_DIR, 'hls'),
+    'VIDEO_STREAMER_REMUX_CACHE_DIR': os.path.join(STATE_DIR, 'remux'),
+    'VIDEO_STREAMER_METADATA_DB': os.path.join(STATE_DIR, 'video_metadata.db'),
+    'VIDEO_STREAMER_CATALOG': os.path.join(STATE_DIR, 'videos.json'),
+})
+os.environ.pop('VIDEO_STREAMER_ACCESS_LOG', None)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def server():
+    """The app module with its Flask app created (without the background warm-up)."""
+    import app
+    app.create_app(warm=False)
+    return app
+
+
+@pytest.fixture
+def client(server):
+    return server.create_app().test_client()
+
+
+@pytest.fixture
+def library_video():
+    """Writes an MP4 (see mp4_builder.write_mp4) into the library root; returns its path."""
+    from mp4_builder import write_mp4
+
+    def make(filename, **options):
+        path = os.path.join(LIBRARY_DIR, filename)
+        write_mp4(path, **options)
+        return path
+    return make
@@ -0,0 +1,73 @@
+"""Writes small but structurally valid MP4 files for the tests."""
+import struct
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, struct.pack('>I', version << 24) + payload)
+
+
+def _table(box_type, rows):
+    payload = struct.pack('>I', len(rows))
+    for row in rows:
+        payload += struct.pack(f'>{len(row)}I', *row)
+    return full_box(box_type, payload)
+
+
+def _trak(handler, timescale, sample_sizes, chunk_offsets, delta, sync_samples,
+          composition_offset=0, truncate=None):
+    hdlr = full_box(b'hdlr', b'\0' * 4 + handler + b'\0' * 12 + b'test\0')
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, delta * len(sample_sizes))
+                    + b'\0' * 4)
+    tables = [full_box(b'stsz', struct.pack('>II', 0, len(sample_sizes))
+                       + struct.pack(f'>{len(sample_sizes)}I', *sample_sizes)),
+              _table(b'stco', [(offset,) for offset in chunk_offsets]),
+              _table(b'stts', [(len(sample_sizes), delta)]),
+              _table(b'stsc', [(1, 1, 1)])]
+    if sync_samples is not None:
+        tables.append(_table(b'stss', [(sample,) for sample in sync_samples]))
+    if composition_offset:
+        tables.append(_table(b'ctts', [(len(sample_sizes), composition_offset)]))
+    # A truncated table keeps only its version and flags
+    tables = [full_box(table[4:8], b'') if table[4:8] == truncate else table for table in tables]
+    stbl = box(b'stbl', b''.join(tables))
+    return box(b'trak', box(b'mdia', hdlr + mdhd + box(b'minf', stbl)))
+
+
+def write_mp4(path, samples=30, sample_size=1000, gop=10, fps=10, faststart=True,
+              handler=b'vide', padding=b'', composition_offset=0, truncate=None):
+    """
+    Writes an MP4 with one track of `samples` samples (one per chunk, each
+    sample_size bytes of a repeating pattern), a keyframe every `gop` samples
+    and `fps` samples per second. faststart puts moov before mdat. padding is
+    a 'free' box payload written before the media (makes the head larger).
+    composition_offset adds a ctts box shifting every sample by that many
+    timescale units (1/100 of a frame). truncate names a sample table box
+    (e.g. b'stsz') written without its entries.
+    Returns the keyframe byte offsets.
+    """
+    timescale = fps * 100
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    free = box(b'free', padding) if padding else b''
+    sync = [sample + 1 for sample in range(0, samples, gop)]
+
+    def moov(offsets):
+        trak = _trak(handler, timescale, [sample_size] * samples, offsets, 100, sync,
+                     composition_offset, truncate)
+        return box(b'moov', full_box(b'mvhd', b'\0' * 96) + trak)
+
+    moov_size = len(moov([0] * samples))
+    media_start = len(ftyp) + len(free) + 8 + (moov_size if faststart else 0)
+    offsets = [media_start + sample * sample_size for sample in range(samples)]
+    media = (bytes(range(251)) * (samples * sample_size // 251 + 1))[:samples * sample_size]
+    mdat = box(b'mdat', media)
+    with open(path, 'wb') as f:
+        f.write(ftyp + free)
+        if faststart:
+            f.write(moov(offsets) + mdat)
+        else:
+            f.write(mdat + moov(offsets))
+    return [offsets[sample - 1] for sample in sync]
@@ -0,0 +1,38 @@
+import os
+import json
+
+import pytest
+
+from conftest import STATE_DIR
+
+
+@pytest.fixture
+def catalog_videos(server):
+    """Writes a catalog of 5 videos and loads it."""
+    videos = [{"id": f"v{number}", "title": f"Video {number}", "filename": f"video{number}.mp4",
+               "root": "test", "path": f"video{number}.mp4"} for number in range(5)]
+    with open(os.path.join(STATE_DIR, 'videos.json'), 'w', encoding='utf-8') as f:
+        json.dump(videos, f)
+    server.catalog.reload()
+    return videos
+
+
+def test_pages_and_revalidation(client, catalog_videos):
+    response = client.get('/api/videos?limit=2')
+    page = response.get_json()
+    assert [video["id"] for video in page["items"]] == ["v0", "v1"]
+    assert page["total"] == 5
+
+    rest = client.get(f'/api/videos?limit=10&cursor={page["next_cursor"]}').get_json()
+    assert [video["id"] for video in rest["items"]] == ["v2", "v3", "v4"]
+    assert rest["next_cursor"] is None
+
+    etag = response.headers['ETag']
+    assert client.get('/api/videos?limit=2', headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.parametrize('query', ['cursor=WzFd', 'cursor=%%%', 'sort=size', 'limit=many'])
+def test_bad_queries_are_400(client, catalog_videos, query):
+    response = client.get(f'/api/videos?{query}')
+    assert response.status_code == 400
+    assert "error" in response.get_json()
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from catalog import Catalog, CatalogSnapshot, InvalidQuery, encode_cursor
+
+VIDEOS = [{"id": f"v{number:02d}", "title": title} for number, title in enumerate([
+    "Alpha Song", "beta dance", "Gamma Live", "Delta Song", "epsilon", "Zeta Song Remix",
+])]
+
+
+def all_pages(snapshot, **query):
+    items, cursor = [], None
+    while True:
+        page, cursor, total = snapshot.query(cursor=cursor, limit=2, **query)
+        items.extend(video["id"] for video in page)
+        if cursor is None:
+            return items, total
+
+
+def test_cursor_pagination_visits_every_video_once():
+    snapshot = CatalogSnapshot(VIDEOS, 'v1')
+    by_title = sorted(VIDEOS, key=lambda video: video["title"].lower())
+
+    assert all_pages(snapshot) == ([video["id"] for video in by_title], len(VIDEOS))
+    assert all_pages(snapshot, descending=True)[0] == [video["id"] for video in reversed(by_title)]
+    assert all_pages(snapshot, sort='id')[0] == [video["id"] for video in VIDEOS]
+
+
+def test_filters():
+    snapshot = CatalogSnapshot(VIDEOS, 'v1')
+    assert all_pages(snapshot, search='song') == (["v00", "v03", "v05"], 3)
+    assert all_pages(snapshot, prefix='re') == (["v05"], 1)
+    assert all_pages(snapshot, search='ong', prefix='delta') == (["v03"], 1)
+
+
+def test_cursor_survives_reload_with_new_items():
+    snapshot = CatalogSnapshot(VIDEOS, 'v1')
+    page, cursor, _ = snapshot.query(limit=3)
+    reloaded = CatalogSnapshot(VIDEOS + [{"id": "v99", "title": "aardvark"}], 'v2')
+    rest, _, _ = reloaded.query(cursor=cursor, limit=10)
+    assert [video["id"] for video in page + rest] == ["v00", "v01", "v03", "v04", "v02", "v05"]
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    encode_cursor(("x",)),       # Wrong length for the title sort
+    'WzFd',                      # [1]
+    encode_cursor((1, "v01")),   # Not strings
+    'e30',                       # {}
+])
+def test_invalid_cursor(cursor):
+    snapshot = CatalogSnapshot(VIDEOS, 'v1')
+    with pytest.raises(InvalidQuery):
+        snapshot.query(cursor=cursor)
+
+
+def test_unknown_sort():
+    with pytest.raises(InvalidQuery):
+        CatalogSnapshot(VIDEOS, 'v1').query(sort='size')
+
+
+def test_catalog_reload(tmp_path):
+    path = tmp_path / 'videos.json'
+    catalog = Catalog(str(path))
+    assert catalog.reload().videos == []  # Missing file: keeps the empty catalog
+    path.write_text(json.dumps(VIDEOS), encoding='utf-8')
+    snapshot = catalog.reload()
+    assert len(snapshot.videos) == len(VIDEOS)
+    assert snapshot.by_id["v02"]["title"] == "Gamma Live"
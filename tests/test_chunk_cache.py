@@ -0,0 +1,67 @@
+import os
+
+from chunk_cache import BlockCache, CachedRangeIterator
+
+BLOCK = 1024
+
+
+def write(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return data
+
+
+def version(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def test_hits_misses_and_partial_blocks(tmp_path):
+    path = tmp_path / 'f'
+    data = write(path, 10 * BLOCK + 100)
+    cache = BlockCache(100 * BLOCK, block_size=BLOCK)
+    with open(path, 'rb') as f:
+        assert b''.join(cache.iter_range(f, str(path), version(path), 500, 2000)) == data[500:2500]
+        assert (cache.hits, cache.misses) == (0, 3)
+        assert b''.join(cache.iter_range(f, str(path), version(path), 1024, 1024)) == data[1024:2048]
+        assert cache.hits == 1
+        # Ranges past the end stop at the end of the file
+        assert b''.join(cache.iter_range(f, str(path), version(path), 10 * BLOCK, 5000)) == data[10 * BLOCK:]
+
+
+def test_changed_file_is_reread(tmp_path):
+    path = tmp_path / 'f'
+    write(path, 4 * BLOCK)
+    cache = BlockCache(100 * BLOCK, block_size=BLOCK)
+    with open(path, 'rb') as f:
+        b''.join(cache.iter_range(f, str(path), version(path), 0, 4 * BLOCK))
+    data = write(path, 3 * BLOCK)
+    os.utime(path, ns=(1, 1))
+    with open(path, 'rb') as f:
+        assert b''.join(cache.iter_range(f, str(path), version(path), 0, 3 * BLOCK)) == data
+    assert cache.stats()["blocks"] == 3
+
+
+def test_memory_is_bounded(tmp_path):
+    path = tmp_path / 'f'
+    write(path, 50 * BLOCK)
+    cache = BlockCache(8 * BLOCK, block_size=BLOCK)
+    with open(path, 'rb') as f:
+        b''.join(cache.iter_range(f, str(path), version(path), 0, 50 * BLOCK))
+    stats = cache.stats()
+    assert stats["bytes"] <= 8 * BLOCK
+    assert stats["evictions"] == 42
+
+
+def test_cached_range_iterator_mixes_cache_and_disk(tmp_path):
+    path = tmp_path / 'f'
+    data = write(path, 20 * BLOCK)
+    cache = BlockCache(100 * BLOCK, block_size=BLOCK)
+    regions = [(0, 2 * BLOCK), (10 * BLOCK, 12 * BLOCK)]
+    for start, length in [(0, 20 * BLOCK), (100, 50), (BLOCK, 15 * BLOCK), (15 * BLOCK, 5 * BLOCK)]:
+        body = CachedRangeIterator(cache, open(path, 'rb'), start, length, regions)
+        assert b''.join(body) == data[start:start + length]
+        body.close()
+        assert body.file_obj.closed
+    # Only blocks inside the regions were cached
+    assert cache.stats()["blocks"] == 4
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import convert_videos
+from job_queue import JobQueue, FAILED
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    """Two library roots, 'a' with 10 GB free and 'b' with 8 GB free; no reservations."""
+    directories = {'a': str(tmp_path / 'a'), 'b': str(tmp_path / 'b')}
+    free = {directories['a']: 10 * GB, directories['b']: 8 * GB}
+    for directory in directories.values():
+        os.makedirs(directory)
+    monkeypatch.setattr(convert_videos, 'LIBRARY_ROOTS', directories)
+    monkeypatch.setattr(convert_videos, '_free_space', free.get)
+    monkeypatch.setattr(convert_videos, '_reservations', {})
+    return directories
+
+
+def test_least_loaded_root_spreads_reserved_outputs(roots):
+    assert convert_videos.least_loaded_root('one.mp4', 3 * GB) == roots['a']  # a: 7 GB left
+    assert convert_videos.least_loaded_root('two.mp4', 3 * GB) == roots['b']  # b: 5 GB left
+    assert convert_videos.least_loaded_root('three.mp4', 1 * GB) == roots['a']
+    assert convert_videos.least_loaded_root('one.mp4', 3 * GB) == roots['a']  # Same name, same root
+
+
+def test_written_outputs_no_longer_count_as_reserved(roots):
+    assert convert_videos.least_loaded_root('one.mp4', 5 * GB) == roots['a']
+    open(os.path.join(roots['a'], 'one.mp4'), 'wb').close()  # disk_usage (faked) has it now
+    assert convert_videos.least_loaded_root('two.mp4', 1 * GB) == roots['a']
+
+
+def test_unreachable_root_is_skipped(roots, monkeypatch):
+    monkeypatch.setattr(convert_videos, '_free_space', {roots['b']: GB}.get)
+    assert convert_videos.least_loaded_root('one.mp4', 0) == roots['b']
+
+
+def test_conversion_target_uses_an_existing_output(roots, tmp_path):
+    source = tmp_path / 'movie.mkv'
+    source.write_bytes(b'x' * 100)
+    open(os.path.join(roots['b'], 'movie.mp4'), 'wb').close()
+    assert convert_videos.conversion_target(str(source)) == os.path.join(roots['b'], 'movie.mp4')
+    assert convert_videos._reservations == {}
+    assert convert_videos.conversion_target(str(tmp_path / 'movie.mp4')) is None
+    assert convert_videos.conversion_target(str(tmp_path / 'notes.txt')) is None
+
+
+def test_already_queued_sources_keep_only_their_own_reservation(roots, tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    pending = tmp_path / 'pending.mkv'
+    failed = tmp_path / 'failed.mkv'
+    for source in (pending, failed):
+        source.write_bytes(b'x' * 1000)
+    # Queued by an earlier run: pending on 'b', failed on 'a'
+    queue.enqueue(str(pending), 'mp4', os.path.join(roots['b'], 'pending.mp4'))
+    queue.enqueue(str(failed), 'mp4', os.path.join(roots['a'], 'failed.mp4'), state=FAILED)
+
+    # A rescan places both again ('a' has the most space) before looking at the queue
+    candidates = [(str(source), convert_videos.conversion_target(str(source)), source.name)
+                  for source in (pending, failed)]
+    assert all(path.startswith(roots['a']) for _, path, _ in candidates)
+
+    counts = convert_videos.enqueue_files(queue, candidates)
+    assert counts['failed'] == 1 and counts['queued'] == 0
+    assert convert_videos._reservations == {'pending.mp4': (roots['b'], 1000)}
+
+
+def test_new_sources_are_queued_longest_first(roots, tmp_path, monkeypatch):
+    durations = {'short.mkv': 60.0, 'long.mkv': 7200.0, 'unknown.mkv': None}
+
+    def probe_sources(paths, workers):
+        infos = {path: durations[os.path.basename(path)] for path in paths}
+        return {path: {"duration": duration} if duration else None  # None: probe failed
+                for path, duration in infos.items()}
+    monkeypatch.setattr(convert_videos, 'probe_sources', probe_sources)
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    candidates = []
+    for name in durations:
+        source = tmp_path / name
+        source.write_bytes(b'x')
+        candidates.append((str(source), convert_videos.conversion_target(str(source)), name))
+
+    assert convert_videos.enqueue_files(queue, candidates)['queued'] == 3
+    order = [os.path.basename(queue.claim('mp4')['source']) for _ in durations]
+    assert order == ['long.mkv', 'short.mkv', 'unknown.mkv']
+
+    # Finished jobs whose output has disappeared are queued again
+    for job in [queue.get(source, 'mp4') for source, _, _ in candidates]:
+        queue.complete(job)
+    counts = convert_videos.enqueue_files(queue, candidates)
+    assert counts == {'queued': 0, 'requeued': 3, 'done': 0, 'failed': 0}
@@ -0,0 +1,87 @@
+import pytest
+
+import encode_profiles
+from encode_profiles import (ENCODE_PROFILES, PROFILE_FILENAME, PATH_COPY, PATH_AUDIO, PATH_FULL,
+                             analyze_crf, choose_conversion_path, profile_for)
+
+H264 = {"video_codec": 'h264', "pix_fmt": 'yuv420p', "video_profile": 'High', "audio_codec": 'aac'}
+
+
+@pytest.mark.parametrize('info, path, video, audio', [
+    (H264, PATH_COPY, 'copy', 'copy'),
+    (dict(H264, audio_codec=None), PATH_COPY, 'copy', 'copy'),
+    (dict(H264, audio_codec='ac3'), PATH_AUDIO, 'copy', 'aac'),
+    (dict(H264, pix_fmt='yuv420p10le'), PATH_FULL, 'libx264', 'copy'),
+    (dict(H264, video_profile='High 4:4:4 Predictive'), PATH_FULL, 'libx264', 'copy'),
+    (dict(H264, video_codec='hevc', audio_codec='opus'), PATH_FULL, 'libx264', 'aac'),
+    (None, PATH_FULL, 'libx264', 'aac'),
+])
+def test_choose_conversion_path(info, path, video, audio):
+    chosen, args = choose_conversion_path(info)
+    assert chosen == path
+    assert args[args.index('-c:v') + 1] == video
+    assert args[args.index('-c:a') + 1] == audio
+
+
+def test_transcodes_use_the_profile_and_crf():
+    _, args = choose_conversion_path(None, ENCODE_PROFILES['archival'], crf=16)
+    assert args[args.index('-preset') + 1] == 'slow'
+    assert args[args.index('-crf') + 1] == '16'
+    assert args[args.index('-b:a') + 1] == '192k'
+
+
+def test_profile_for_takes_the_nearest_file_for_each_setting(tmp_path):
+    nested = tmp_path / 'films' / 'classics'
+    nested.mkdir(parents=True)
+    source = nested / 'movie.mkv'
+    assert profile_for(str(source), str(tmp_path)) == ('balanced', False)
+
+    (tmp_path / PROFILE_FILENAME).write_text('archival analyze  # keepers\n')
+    assert profile_for(str(source), str(tmp_path)) == ('archival', True)
+
+    (nested / PROFILE_FILENAME).write_text('speed\n')
+    assert profile_for(str(source), str(tmp_path)) == ('speed', True)  # analyze from above
+
+    (nested / PROFILE_FILENAME).write_text('no-analyze bogus\n')
+    assert profile_for(str(source), str(tmp_path), default='speed') == ('archival', False)
+
+
+def test_profile_files_above_the_root_are_ignored(tmp_path):
+    root = tmp_path / 'sources'
+    root.mkdir()
+    (tmp_path / PROFILE_FILENAME).write_text('archival\n')
+    assert profile_for(str(root / 'movie.mkv'), str(root)) == ('balanced', False)
+
+
+def fake_ssim(monkeypatch, quality):
+    """Makes measure_ssim return quality(crf); returns the list of CRFs measured."""
+    measured = []
+
+    def measure_ssim(input_path, offset, profile, crf, work_dir, threads=None):
+        measured.append(crf)
+        return quality(crf)
+    monkeypatch.setattr(encode_profiles, 'measure_ssim', measure_ssim)
+    return measured
+
+
+def test_analyze_crf_finds_the_highest_crf_meeting_the_target(monkeypatch):
+    profile = ENCODE_PROFILES['balanced']  # crf_range 18-28, target 0.980
+    measured = fake_ssim(monkeypatch, lambda crf: 1 - crf / 1000)  # 0.980 at 20
+    assert analyze_crf('movie.mkv', 600, profile) == (20, pytest.approx(0.980))
+    # A binary search: a few CRFs, each sampled SAMPLE_COUNT times
+    assert len(set(measured)) <= 5
+    assert len(measured) == len(set(measured)) * encode_profiles.SAMPLE_COUNT
+
+
+def test_analyze_crf_edge_cases(monkeypatch):
+    profile = ENCODE_PROFILES['balanced']
+    fake_ssim(monkeypatch, lambda crf: 0.5)
+    assert analyze_crf('movie.mkv', 600, profile) == (18, 0.5)  # Best allowed, even if short of target
+    fake_ssim(monkeypatch, lambda crf: 0.999)
+    assert analyze_crf('movie.mkv', 600, profile) == (28, 0.999)
+    assert analyze_crf('movie.mkv', encode_profiles.MIN_ANALYSIS_DURATION - 1, profile) is None
+
+    def broken(crf):
+        raise ValueError("ffmpeg reported no SSIM")
+    fake_ssim(monkeypatch, broken)
+    assert analyze_crf('movie.mkv', 600, profile) is None
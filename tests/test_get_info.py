@@ -0,0 +1,88 @@
+import os
+import json
+
+import pytest
+
+from getInfo import load_index, update_index, INDEX_VERSION
+
+
+@pytest.fixture
+def roots(tmp_path):
+    roots = {'a': str(tmp_path / 'a'), 'b': str(tmp_path / 'b')}
+    for directory in roots.values():
+        os.makedirs(directory)
+    return roots
+
+
+def write(roots, libpath, data):
+    root_name, _, relpath = libpath.partition('/')
+    path = os.path.join(roots[root_name], *relpath.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def ids(index):
+    return {libpath: entry["id"] for libpath, entry in index["entries"].items()}
+
+
+def test_unchanged_files_keep_their_entries(roots):
+    write(roots, 'a/one.mp4', b'one')
+    write(roots, 'b/sub/two.mp4', b'two')
+    write(roots, 'a/.three.mp4.part', b'still converting')
+    index = {"version": INDEX_VERSION, "entries": {}}
+    assert update_index(index, roots) == 2
+    before = ids(index)
+    assert set(before) == {'a/one.mp4', 'b/sub/two.mp4'}
+    assert update_index(index, roots) == 0
+    assert ids(index) == before
+
+
+def test_renamed_edited_and_moved_files_keep_their_ids(roots):
+    path = write(roots, 'a/one.mp4', b'one')
+    index = {"version": INDEX_VERSION, "entries": {}}
+    update_index(index, roots)
+    video_id = index["entries"]['a/one.mp4']["id"]
+
+    os.rename(path, os.path.join(roots['a'], 'renamed.mp4'))
+    assert update_index(index, roots) == 2  # One added, one removed
+    assert ids(index) == {'a/renamed.mp4': video_id}
+
+    write(roots, 'a/renamed.mp4', b'edited in place')
+    assert update_index(index, roots) == 1
+    assert ids(index) == {'a/renamed.mp4': video_id}
+
+    os.replace(os.path.join(roots['a'], 'renamed.mp4'), os.path.join(roots['b'], 'renamed.mp4'))
+    update_index(index, roots)
+    assert ids(index) == {'b/renamed.mp4': video_id}
+
+
+def test_identical_copies_get_distinct_ids(roots):
+    write(roots, 'a/one.mp4', b'same')
+    write(roots, 'b/one.mp4', b'same')
+    index = {"version": INDEX_VERSION, "entries": {}}
+    update_index(index, roots)
+    assert len(set(ids(index).values())) == 2
+
+
+def test_only_the_given_paths_are_checked(roots):
+    write(roots, 'a/one.mp4', b'one')
+    index = {"version": INDEX_VERSION, "entries": {}}
+    update_index(index, roots)
+    write(roots, 'a/two.mp4', b'two')
+    os.remove(os.path.join(roots['a'], 'one.mp4'))
+
+    assert update_index(index, roots, ['a/two.mp4']) == 1
+    assert set(index["entries"]) == {'a/one.mp4', 'a/two.mp4'}  # one.mp4 wasn't checked
+    assert update_index(index, roots, ['a/one.mp4']) == 1
+    assert set(index["entries"]) == {'a/two.mp4'}
+
+
+def test_version_1_index_moves_under_the_first_root(roots, tmp_path):
+    index_file = tmp_path / 'library_index.json'
+    index_file.write_text(json.dumps({"entries": {"sub/one.mp4": {"id": "video-1"}}}))
+    assert load_index(str(index_file), roots) == {
+        "version": INDEX_VERSION, "entries": {"a/sub/one.mp4": {"id": "video-1"}}}
+    index_file.write_text('not json')
+    assert load_index(str(index_file), roots) == {"version": INDEX_VERSION, "entries": {}}
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from http_ranges import (RangeNotSatisfiable, MultipartRangeIterator, MAX_RANGES, parse_range_header,
+                         evaluate_preconditions, if_range_allows, make_etag, http_date)
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=0-', [(0, 999)]),
+    ('bytes=500-5000', [(500, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=0-0,-1', [(0, 0), (999, 999)]),
+    ('bytes=10-20, 15-30, 31-40', [(10, 40)]),    # Overlapping and adjacent: merged
+    ('bytes=500-599,0-99', [(0, 99), (500, 599)]),
+    ('bytes=0-99,2000-3000', [(0, 99)]),          # Unsatisfiable parts are dropped
+    ('BYTES = 0-1', [(0, 1)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, SIZE) == expected
+
+
+@pytest.mark.parametrize('header', [
+    'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5-1', 'bytes=1-2-3', 'bytes=--5', 'bytes=0-x',
+    'bytes=' + ','.join(f'{i * 2}-{i * 2}' for i in range(MAX_RANGES + 1)),
+])
+def test_malformed_range_is_ignored(header):
+    assert parse_range_header(header, SIZE) is None
+
+
+@pytest.mark.parametrize('header, size', [('bytes=1000-', SIZE), ('bytes=-0', SIZE), ('bytes=-1', 0)])
+def test_unsatisfiable_range(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, size)
+
+
+class Stat:
+    st_size = SIZE
+    st_mtime_ns = 1_700_000_000_250_000_000
+    st_mtime = st_mtime_ns / 1e9
+
+
+ETAG = make_etag(Stat)
+MTIME = Stat.st_mtime
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, None),
+    ({'If-None-Match': ETAG}, 304),
+    ({'If-None-Match': 'W/' + ETAG}, 304),
+    ({'If-None-Match': '"other", ' + ETAG}, 304),
+    ({'If-None-Match': '*'}, 304),
+    ({'If-None-Match': '"other"'}, None),
+    ({'If-Modified-Since': http_date(MTIME)}, 304),
+    ({'If-Modified-Since': http_date(MTIME - 10)}, None),
+    # If-None-Match takes precedence over If-Modified-Since
+    ({'If-None-Match': '"other"', 'If-Modified-Since': http_date(MTIME)}, None),
+    ({'If-Match': ETAG}, None),
+    ({'If-Match': 'W/' + ETAG}, 412),  # Strong comparison
+    ({'If-Match': '"other"'}, 412),
+    ({'If-Unmodified-Since': http_date(MTIME - 10)}, 412),
+    ({'If-Unmodified-Since': http_date(MTIME)}, None),
+    ({'If-Modified-Since': 'not a date'}, None),
+])
+def test_evaluate_preconditions(headers, expected):
+    assert evaluate_preconditions(headers, ETAG, MTIME) == expected
+
+
+def test_if_range():
+    assert if_range_allows(None, ETAG, MTIME)
+    assert if_range_allows(ETAG, ETAG, MTIME)
+    assert not if_range_allows('"other"', ETAG, MTIME)
+    assert not if_range_allows('W/' + ETAG, ETAG, MTIME)
+    assert if_range_allows(http_date(MTIME), ETAG, MTIME)
+    assert not if_range_allows(http_date(MTIME - 1), ETAG, MTIME)
+
+
+def test_multipart_body(tmp_path):
+    data = os.urandom(SIZE)
+    path = tmp_path / 'file'
+    path.write_bytes(data)
+    ranges = [(0, 9), (500, 599)]
+    body = MultipartRangeIterator(open(path, 'rb'), ranges, SIZE, 'video/mp4', boundary='XYZ')
+    payload = b''.join(body)
+    body.close()
+
+    assert body.content_type == 'multipart/byteranges; boundary=XYZ'
+    assert len(payload) == body.content_length
+    assert payload.endswith(b'\r\n--XYZ--\r\n')
+    parts = payload.split(b'\r\n--XYZ')[1:-1]
+    for part, (start, end) in zip(parts, ranges):
+        headers, content = part.split(b'\r\n\r\n', 1)
+        assert f'Content-Range: bytes {start}-{end}/{SIZE}'.encode() in headers
+        assert content == data[start:end + 1]
+    assert body.file_obj.closed
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, PENDING, RUNNING, DONE, FAILED, MAX_ATTEMPTS
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.db'))
+
+
+def test_claim_by_priority_and_complete(queue):
+    assert queue.enqueue('a.mkv', 'mp4', 'a.mp4', priority=1)
+    assert queue.enqueue('b.mkv', 'mp4', 'b.mp4', priority=5, info={"size": 10})
+    assert not queue.enqueue('a.mkv', 'mp4', 'other.mp4')  # Already known
+
+    job = queue.claim()
+    assert (job['source'], job['state'], job['attempts'], job['info']) == ('b.mkv', RUNNING, 1, {"size": 10})
+    queue.complete(job, result='ok')
+    assert queue.get('b.mkv', 'mp4')['state'] == DONE
+    assert queue.claim(mode='hls') is None
+    assert queue.claim()['source'] == 'a.mkv'
+    assert queue.claim() is None
+    assert queue.counts() == {DONE: 1, RUNNING: 1}
+
+
+def test_failures_back_off_then_give_up(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    queue.enqueue('a.mkv', 'mp4', 'a.mp4')
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        job = queue.claim()
+        assert job['attempts'] == attempt
+        state = queue.fail(job, 'ffmpeg exited with 1')
+        if attempt < MAX_ATTEMPTS:
+            assert state == PENDING
+            assert queue.claim() is None  # Not due yet
+            delay = queue.seconds_until_next()
+            assert delay == job_queue.BACKOFF_BASE * 2 ** (attempt - 1)
+            now[0] += delay
+    assert state == FAILED
+    assert queue.get('a.mkv', 'mp4')['last_error'] == 'ffmpeg exited with 1'
+
+    queue.requeue('a.mkv', 'mp4')
+    assert queue.claim()['attempts'] == 1
+
+
+def test_recover_running_jobs_after_a_crash(queue):
+    queue.enqueue('a.mkv', 'mp4', 'a.mp4')
+    queue.claim()
+    restarted = JobQueue(queue.db_path)
+    assert restarted.recover() == 1
+    assert restarted.get('a.mkv', 'mp4')['state'] == PENDING
+    assert restarted.pending_jobs() == [{"source": 'a.mkv', "priority": 0}]
+
+
+def test_concurrent_workers_never_share_a_job(queue):
+    for number in range(50):
+        queue.enqueue(f'{number}.mkv', 'mp4', f'{number}.mp4')
+    claimed = []
+
+    def worker():
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            claimed.append(job['source'])
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(f'{number}.mkv' for number in range(50))
+
+
+def test_recover_leaves_jobs_of_other_live_processes_alone(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    host = queue.owner.rpartition(':')[0]
+    # Claimed in turn by: this process, a live process elsewhere, one elsewhere
+    # that stopped renewing, and one on this machine that has exited
+    owners = [(None, 4), ('elsewhere:1', 3), ('elsewhere:2', 2), (f'{host}:999999999', 1)]
+    for owner, priority in owners:
+        queue.enqueue(f'{priority}.mkv', 'mp4', f'{priority}.mp4', priority=priority)
+        claimer = JobQueue(queue.db_path)
+        claimer.owner = owner or queue.owner
+        if owner == 'elsewhere:2':
+            now[0] -= job_queue.LEASE_SECONDS + 1
+        claimer.claim()
+        now[0] = 1000.0
+
+    assert queue.recover() == 3
+    assert queue.get('3.mkv', 'mp4')['state'] == RUNNING
+    assert {job['source'] for job in queue.pending_jobs()} == {'4.mkv', '2.mkv', '1.mkv'}
+
+
+def test_renew_extends_only_this_process_leases(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    queue.enqueue('a.mkv', 'mp4', 'a.mp4')
+    queue.claim()
+    now[0] += job_queue.LEASE_SECONDS - 1
+    assert queue.renew() == 1
+    assert queue.get('a.mkv', 'mp4')['lease_until'] == now[0] + job_queue.LEASE_SECONDS
+
+    other = JobQueue(queue.db_path)
+    other.owner = 'elsewhere:1'
+    assert other.renew() == 0
+    now[0] += 2  # Past the original lease, but it was renewed
+    assert other.recover() == 0
@@ -0,0 +1,57 @@
+import os
+import json
+
+import pytest
+
+from config import (parse_library_roots, library_path, split_library_path, resolve_library_path,
+                    find_library_path)
+from conftest import STATE_DIR, LIBRARY_DIR
+
+
+def test_parse_library_roots():
+    value = os.pathsep.join(['disk1=/mnt/disk1', '/mnt/disk2', ' disk3 = /mnt/disk3 '])
+    assert parse_library_roots(value) == {
+        'disk1': '/mnt/disk1', 'root2': '/mnt/disk2', 'disk3': '/mnt/disk3'}
+    for bad in ('', os.pathsep.join(['a=/x', 'a=/y']), 'a/b=/x', '=/x'):
+        with pytest.raises(ValueError):
+            parse_library_roots(bad)
+
+
+def test_library_paths_round_trip(tmp_path):
+    roots = {'a': str(tmp_path / 'a'), 'b': str(tmp_path / 'b')}
+    path = os.path.join(roots['b'], 'sub', 'movie.mp4')
+    libpath = find_library_path(path, roots)
+    assert libpath == 'b/sub/movie.mp4' == library_path('b', os.path.join('sub', 'movie.mp4'))
+    assert split_library_path(libpath) == ('b', 'sub/movie.mp4')
+    assert resolve_library_path(libpath, roots) == path
+    assert resolve_library_path('gone/movie.mp4', roots) is None  # Root not configured
+    assert find_library_path(str(tmp_path / 'elsewhere.mp4'), roots) is None
+    assert find_library_path(roots['a'], roots) is None  # The root itself
+
+
+@pytest.fixture
+def catalog_entries(server):
+    """Writes the given catalog entries to videos.json and loads them."""
+    def load(*videos):
+        with open(os.path.join(STATE_DIR, 'videos.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(videos), f)
+        server.catalog.reload()
+    yield load
+    load()
+
+
+def test_files_are_found_through_the_catalog(client, library_video, catalog_entries):
+    os.makedirs(os.path.join(LIBRARY_DIR, 'shows'), exist_ok=True)
+    nested = library_video(os.path.join('shows', 'episode.mp4'), samples=10)
+    catalog_entries({"id": "e", "title": "Episode", "filename": "episode.mp4",
+                     "root": "test", "path": "shows/episode.mp4"},
+                    {"id": "m", "title": "Moved", "filename": "moved.mp4",
+                     "root": "unplugged", "path": "moved.mp4"})
+
+    with open(nested, 'rb') as f:
+        assert client.get('/video/episode.mp4').get_data() == f.read()
+    # Not where the catalog says (its root is gone): found at the top of a root
+    top = library_video('moved.mp4', samples=10)
+    with open(top, 'rb') as f:
+        assert client.get('/video/moved.mp4').get_data() == f.read()
+    assert client.get('/video/unknown.mp4').status_code == 404
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import textwrap
+
+import pytest
+
+from conftest import SOURCE_DIR
+from live_remux import SourceIndex
+
+# What the fake ffmpeg "remuxes" every source into
+REMUX_OUTPUT = bytes(range(256)) * 1024
+
+FAKE_FFPROBE = '''
+import sys, json, os
+with open(os.environ['FAKE_TOOL_LOG'], 'a') as log:
+    log.write('ffprobe ' + ' '.join(sys.argv[1:]) + '\\n')
+if '-show_format' in sys.argv:
+    codec = 'hevc' if 'hevc' in sys.argv[-1] else 'h264'
+    print(json.dumps({
+        'format': {'duration': '10.0', 'size': '1000', 'bit_rate': '800', 'format_name': 'matroska'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': codec, 'profile': 'High', 'pix_fmt': 'yuv420p',
+             'width': 640, 'height': 360, 'avg_frame_rate': '25/1'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'channels': 2},
+        ]}))
+else:
+    print('K_')
+'''
+
+FAKE_FFMPEG = '''
+import sys, os, time
+with open(os.environ['FAKE_TOOL_LOG'], 'a') as log:
+    log.write('ffmpeg ' + ' '.join(sys.argv[1:]) + '\\n')
+data = bytes(range(256)) * 1024
+for i in range(0, len(data), 65536):
+    sys.stdout.buffer.write(data[i:i + 65536])
+    sys.stdout.buffer.flush()
+    time.sleep(0.01)
+'''
+
+
+@pytest.fixture
+def fake_tools(server, tmp_path, monkeypatch):
+    """
+    Puts fake ffprobe/ffmpeg first on PATH; returns a function reading their
+    call log. New sources are found right away (no rescan interval).
+    """
+    monkeypatch.setattr(server.source_index, 'rescan_interval', 0)
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, source in (('ffprobe', FAKE_FFPROBE), ('ffmpeg', FAKE_FFMPEG)):
+        path = bin_dir / name
+        path.write_text(f'#!{sys.executable}\n' + textwrap.dedent(source))
+        path.chmod(0o755)
+    log = tmp_path / 'calls.log'
+    log.write_text('')
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_TOOL_LOG', str(log))
+    return lambda: log.read_text().splitlines()
+
+
+def add_source(relpath):
+    path = os.path.join(SOURCE_DIR, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(1000))
+    return path
+
+
+def wait_idle(remuxer, timeout=5):
+    deadline = time.monotonic() + timeout
+    while remuxer.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not remuxer.active
+
+
+def test_source_index(tmp_path, monkeypatch):
+    (tmp_path / 'nested').mkdir()
+    for relpath in ('a.mkv', 'nested/a.mkv', 'nested/b.AVI', 'notes.txt'):
+        (tmp_path / relpath).write_bytes(b'x')
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(os, 'walk', lambda top: walks.append(top) or real_walk(top))
+
+    index = SourceIndex(str(tmp_path), ['.mkv', '.avi'], rescan_interval=60)
+    assert index.find('a.mkv') == str(tmp_path / 'a.mkv')  # Top level wins
+    assert index.find('b.AVI') == str(tmp_path / 'nested' / 'b.AVI')
+    assert index.find('notes.txt') is None
+    assert index.find('new.mkv') is None
+    assert len(walks) == 1  # Misses within the interval don't rescan
+
+    (tmp_path / 'new.mkv').write_bytes(b'x')
+    index.rescan_interval = 0
+    assert index.find('new.mkv') == str(tmp_path / 'new.mkv')
+    (tmp_path / 'a.mkv').unlink()
+    assert index.find('a.mkv') == str(tmp_path / 'nested' / 'a.mkv')
+
+
+def test_live_remux_then_cached(client, server, fake_tools):
+    add_source('shows/episode.mkv')
+
+    with client.get('/video/episode.mkv') as response:
+        assert response.status_code == 200
+        assert response.headers['Accept-Ranges'] == 'none'
+        assert response.get_data() == REMUX_OUTPUT
+    wait_idle(server.live_remuxer)
+
+    calls = fake_tools()
+    # One probe, without the keyframe counting pass, and one remux
+    assert [call.split()[0] for call in calls] == ['ffprobe', 'ffmpeg']
+    assert '-show_format' in calls[0]
+
+    # Finished remuxes are plain files with range support
+    with client.get('/video/episode.mkv', headers={'Range': 'bytes=0-99'}) as response:
+        assert response.status_code == 206
+        assert response.get_data() == REMUX_OUTPUT[:100]
+    assert len(fake_tools()) == 2
+    assert server.stream_limiter.active == 0
+
+
+def test_sources_needing_a_transcode_are_refused(client, fake_tools):
+    add_source('clip-hevc.mkv')
+    assert client.get('/video/clip-hevc.mkv').status_code == 415
+    assert not any(call.startswith('ffmpeg') for call in fake_tools())
+
+
+def test_missing_source(client, fake_tools):
+    assert client.get('/video/nothing-here.mkv').status_code == 404
+    assert fake_tools() == []
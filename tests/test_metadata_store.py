@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from mp4_builder import write_mp4
+from mp4_index import MP4IndexError
+from metadata_store import MetadataStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MetadataStore(str(tmp_path / 'metadata.db'))
+
+
+def test_lookup_matches_size_and_mtime(store, tmp_path):
+    path = tmp_path / 'a.mp4'
+    path.write_bytes(b'x' * 10)
+    st = os.stat(path)
+    store.put(str(path), st.st_size, st.st_mtime_ns, {"duration": 1.0})
+
+    assert store.lookup(str(path)) == {"duration": 1.0}
+    path.write_bytes(b'x' * 11)
+    assert store.lookup(str(path)) is None
+
+
+def test_mp4_index_is_cached(store, tmp_path):
+    path = tmp_path / 'a.mp4'
+    write_mp4(path)
+    first = store.get_mp4_index(str(path))
+    assert store.get_mp4_index(str(path)) is first
+
+    reopened = MetadataStore(store.db_path)
+    assert reopened.get_mp4_index(str(path)) == first
+
+
+def test_unindexable_file_raises_from_every_cache(store, tmp_path):
+    path = tmp_path / 'audio.mp4'
+    write_mp4(path, handler=b'soun')
+
+    # Parsed, then answered from memory, then from the database
+    for current in (store, store, MetadataStore(store.db_path)):
+        with pytest.raises(MP4IndexError, match="no video track"):
+            current.get_mp4_index(str(path))
+
+
+def test_mp4_keyframes_are_counted_from_the_index(store, tmp_path, monkeypatch):
+    import metadata_store
+    probes = []
+
+    def probe_video(path, with_keyframes=True):
+        probes.append(with_keyframes)
+        return {"duration": 3.0, "keyframe_count": None}
+    monkeypatch.setattr(metadata_store, 'probe_video', probe_video)
+
+    write_mp4(tmp_path / 'a.mp4', samples=30, gop=10)
+    assert store.get(str(tmp_path / 'a.mp4'))["keyframe_count"] == 3
+    write_mp4(tmp_path / 'audio.mp4', handler=b'soun')
+    assert store.get(str(tmp_path / 'audio.mp4'))["keyframe_count"] is None
+    assert probes == [False, False]  # No packet pass over the files
+
+
+def test_preload_and_views(store, tmp_path):
+    paths = []
+    for name in ('a.mp4', 'b.mp4'):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 10)
+        st = os.stat(path)
+        store.put(str(path), st.st_size, st.st_mtime_ns, {"name": name})
+        paths.append(str(path))
+
+    reopened = MetadataStore(store.db_path)
+    assert reopened.preload(paths + [str(tmp_path / 'missing.mp4')]) == 2
+    assert reopened.lookup(paths[1]) == {"name": 'b.mp4'}
+    assert reopened.db_hits == 0
+
+    reopened.record_views({paths[0]: 1, paths[1]: 2})
+    reopened.record_views({paths[0]: 5})
+    assert reopened.most_viewed(5) == paths
+    assert reopened.most_viewed(1) == paths[:1]
@@ -0,0 +1,71 @@
+import pytest
+
+from mp4_builder import write_mp4
+from mp4_index import MP4IndexError, build_index, gop_range, seek_plan
+
+
+def test_faststart_index(tmp_path):
+    path = tmp_path / 'a.mp4'
+    keyframes = write_mp4(path, samples=30, gop=10, fps=10)
+    index = build_index(str(path))
+
+    assert index["faststart"] is True
+    assert index["size"] == path.stat().st_size
+    assert index["moov"]["offset"] < index["mdat"]["offset"]
+    assert index["duration"] == pytest.approx(3.0)
+    assert index["keyframe_times"] == [0.0, 1.0, 2.0]
+    assert index["keyframe_offsets"] == keyframes
+
+
+def test_moov_at_end(tmp_path):
+    path = tmp_path / 'a.mp4'
+    keyframes = write_mp4(path, faststart=False)
+    index = build_index(str(path))
+
+    assert index["faststart"] is False
+    assert index["moov"]["offset"] > index["mdat"]["offset"]
+    assert index["keyframe_offsets"] == keyframes
+
+
+def test_gop_range_and_seek_plan(tmp_path):
+    path = tmp_path / 'a.mp4'
+    keyframes = write_mp4(path, samples=30, sample_size=1000, gop=10, fps=10)
+    index = build_index(str(path))
+    media_end = index["mdat"]["offset"] + index["mdat"]["size"]
+
+    assert gop_range(index, 0) is None  # Before the media data
+    assert gop_range(index, keyframes[0]) == (keyframes[0], keyframes[1])
+    assert gop_range(index, keyframes[1] + 5) == (keyframes[1], keyframes[2])
+    assert gop_range(index, media_end - 1) == (keyframes[2], media_end)
+
+    plan = seek_plan(index, 1.5)
+    assert plan == {"time": 1.0, "start": keyframes[1], "end": keyframes[2] - 1}
+    assert seek_plan(index, -3)["start"] == keyframes[0]
+
+
+def test_audio_only_file_is_rejected(tmp_path):
+    path = tmp_path / 'audio.mp4'
+    write_mp4(path, handler=b'soun')
+    with pytest.raises(MP4IndexError, match="no video track"):
+        build_index(str(path))
+
+
+def test_keyframe_times_include_the_composition_offset(tmp_path):
+    path = tmp_path / 'a.mp4'
+    write_mp4(path, samples=30, gop=10, fps=10, composition_offset=200)
+    assert build_index(str(path))["keyframe_times"] == [0.2, 1.2, 2.2]
+
+
+@pytest.mark.parametrize('table', [b'stsz', b'stco', b'stts', b'stsc', b'stss', b'ctts'])
+def test_truncated_sample_table_is_rejected(tmp_path, table):
+    path = tmp_path / 'truncated.mp4'
+    write_mp4(path, composition_offset=100, truncate=table)
+    with pytest.raises(MP4IndexError):
+        build_index(str(path))
+
+
+def test_file_without_moov_is_rejected(tmp_path):
+    path = tmp_path / 'broken.mp4'
+    path.write_bytes(b'\0\0\0\x10ftypisom\0\0\0\0' + b'\0' * 100)
+    with pytest.raises(MP4IndexError):
+        build_index(str(path))
@@ -0,0 +1,82 @@
+import math
+import time
+
+import pytest
+
+from pacing import EgressBudget, ClientThroughput, PacedBody
+
+
+def test_budget_is_shared_max_min_fair():
+    budget = EgressBudget(1000)
+    small, large, unknown = object(), object(), object()
+    budget.register(small, 100)
+    budget.register(large, 800)
+    budget.register(unknown)  # Still in its initial burst: unlimited demand
+
+    # small gets its 100, the other two split the remaining 900
+    assert budget.rate_for(small) == 100
+    assert budget.rate_for(large) == pytest.approx(450)
+    assert budget.rate_for(unknown) == pytest.approx(450)
+
+    budget.unregister(unknown)
+    assert budget.rate_for(large) == 800  # Demand below the level now
+    assert budget.active == 2
+
+
+def test_unlimited_budget():
+    budget = EgressBudget(0)
+    stream = object()
+    budget.register(stream, 300)
+    assert not budget.enabled
+    assert budget.rate_for(stream) == 300
+
+
+def test_client_throughput():
+    throughput = ClientThroughput()
+    throughput.stream_started('10.0.0.1')
+    throughput.add_bytes('10.0.0.1', 5000)
+    stats = throughput.snapshot()['10.0.0.1']
+    assert (stats['active_streams'], stats['streams'], stats['bytes_sent']) == (1, 1, 5000)
+    assert 0 < stats['bytes_per_second'] <= 500
+    throughput.stream_finished('10.0.0.1')
+    assert throughput.snapshot()['10.0.0.1']['active_streams'] == 0
+    assert len(throughput) == 1
+
+
+class Body:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_paced_body_sends_the_burst_then_the_rate():
+    budget = EgressBudget()
+    throughput = ClientThroughput()
+    body = Body([b'x' * 1000] * 6)
+    paced = PacedBody(body, 'client', throughput, budget, rate_limit=10_000, burst_bytes=2000)
+
+    started = time.monotonic()
+    assert b''.join(paced) == b'x' * 6000
+    elapsed = time.monotonic() - started
+    paced.close()
+
+    # 2000 bytes of burst, then 4000 bytes at 10 kB/s (the last chunk isn't waited for)
+    assert 0.25 <= elapsed < 1.0
+    assert throughput.snapshot()['client']['bytes_sent'] == 6000
+    assert body.closed and budget.active == 0
+
+
+def test_paced_body_unpaced_without_limits():
+    budget = EgressBudget()
+    paced = PacedBody(Body([b'x' * 100] * 100), 'client', ClientThroughput(), budget)
+    assert budget.rate_for(paced) == math.inf
+    started = time.monotonic()
+    assert len(b''.join(paced)) == 10_000
+    assert time.monotonic() - started < 0.1
+    paced.close()
@@ -0,0 +1,103 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+import convert_videos
+
+# Stands in for ffmpeg: the segment muxer writes one piece per cut, an encode
+# writes "<codec>(<input>)" and the concat demuxer joins the listed files
+FAKE_FFMPEG = '''
+import os, sys
+args = sys.argv[1:]
+with open(os.environ['FAKE_TOOL_LOG'], 'a') as log:
+    log.write(' '.join(args) + '\\n')
+source = args[args.index('-i') + 1]
+output = args[-1]
+if '-segment_list' in args:
+    cuts = [0.0] + [float(t) for t in args[args.index('-segment_times') + 1].split(',')]
+    cuts.append(float(os.environ['FAKE_DURATION']))
+    with open(args[args.index('-segment_list') + 1], 'w') as pieces:
+        for number, (start, end) in enumerate(zip(cuts, cuts[1:])):
+            name = output % number
+            with open(name, 'w') as f:
+                f.write(f'piece{number}')
+            pieces.write(f'{os.path.basename(name)},{start},{end}\\n')
+    sys.exit(0)
+if source.endswith(os.environ.get('FAKE_FAIL_INPUT', '\\0')):
+    sys.exit(1)
+if '-f' in args and args[args.index('-f') + 1] == 'concat':
+    with open(source) as f:
+        parts = [line.split("'")[1] for line in f if line.strip()]
+    data = '+'.join(open(part).read() for part in parts)
+else:
+    data = f"{args[args.index('-c:v') + 1]}({open(source).read()})"
+with open(output, 'w') as f:
+    f.write(data)
+print('out_time_us=1000000')
+print('progress=end')
+'''
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Puts FAKE_FFMPEG first on PATH; returns a function reading its call log."""
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    path = bin_dir / 'ffmpeg'
+    path.write_text(f'#!{sys.executable}\n' + textwrap.dedent(FAKE_FFMPEG))
+    path.chmod(0o755)
+    log = tmp_path / 'calls.log'
+    log.write_text('')
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_TOOL_LOG', str(log))
+    monkeypatch.setattr(convert_videos, 'SEGMENT_WORK_DIR', str(work_dir))
+    return lambda: log.read_text().splitlines()
+
+
+def test_split_at_keyframes_cuts_into_equal_parts(tmp_path, fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_DURATION', '3600')
+    source = tmp_path / 'film.mkv'
+    source.write_text('film')
+    pieces = convert_videos.split_at_keyframes(str(source), str(tmp_path), 3600, 4)
+
+    assert '-segment_times 900.000,1800.000,2700.000' in fake_ffmpeg()[0]
+    assert [(os.path.basename(path), duration) for path, duration in pieces] == [
+        (f'film.{number:03d}.mkv', 900.0) for number in range(4)]
+
+
+def test_encode_segmented_joins_the_encoded_pieces_in_order(tmp_path, fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_DURATION', '1800')
+    source = tmp_path / 'film.mkv'
+    source.write_text('film')
+    output = tmp_path / 'film.mp4'
+    codec_args = ['-c:v', 'libx264', '-crf', '23', '-c:a', 'aac', '-b:a', '128k']
+
+    # 1800 s allows 30 pieces of SEGMENT_MIN_PIECE; 2 processes make 4
+    board = convert_videos.ProgressBoard(1, 1800)  # Not started: nothing is drawn
+    assert convert_videos.encode_segmented(str(source), str(output), codec_args, 1800, 2,
+                                           threads=8, progress_board=board)
+    assert output.read_text() == '+'.join(f'libx264(piece{number})' for number in range(4))
+
+    calls = fake_ffmpeg()
+    encodes = [call for call in calls if '-c:v libx264' in call]
+    assert len(encodes) == 4 and all('-threads 4' in call for call in encodes)
+    assert '-c:a aac -b:a 128k' in calls[-1] and '-c:a' not in ' '.join(encodes)
+    assert os.listdir(convert_videos.SEGMENT_WORK_DIR) == []
+
+
+def test_encode_segmented_fails_when_a_piece_fails(tmp_path, fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_DURATION', '1800')
+    monkeypatch.setenv('FAKE_FAIL_INPUT', '.002.mkv')
+    source = tmp_path / 'film.mkv'
+    source.write_text('film')
+    output = tmp_path / 'film.mp4'
+    assert not convert_videos.encode_segmented(
+        str(source), str(output), ['-c:v', 'libx264', '-c:a', 'copy'], 1800, 2,
+        progress_board=convert_videos.ProgressBoard(1, 1800))
+    assert not output.exists()
+    assert not any('concat' in call for call in fake_ffmpeg())
+    assert os.listdir(convert_videos.SEGMENT_WORK_DIR) == []
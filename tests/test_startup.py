@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+from conftest import SERVER_DIR, STATE_DIR
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = dict(os.environ,
+               VIDEO_STREAMER_LIBRARY_ROOTS=f"main={tmp_path / 'library'}",
+               VIDEO_STREAMER_METADATA_DB=str(tmp_path / 'metadata.db'))
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=SERVER_DIR, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+
+def test_ready(client, server, monkeypatch):
+    assert client.get('/ready').status_code == 200
+
+    monkeypatch.setitem(server.warm_state, 'ready', False)
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+    monkeypatch.setitem(server.warm_state, 'ready', True)
+    monkeypatch.setattr(server.stream_limiter, 'draining', True)
+    assert client.get('/ready').get_json()["draining"] is True
+    assert client.get('/ready').status_code == 503
+
+
+def is_cached(server, path):
+    """True if the head of path is in the block cache (reading it causes no miss)."""
+    misses = server.chunk_cache.misses
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        b''.join(server.chunk_cache.iter_range(
+            f, os.path.abspath(path), (st.st_mtime_ns, st.st_size), 0, 1000))
+    return server.chunk_cache.misses == misses
+
+
+def test_warm_up_reads_the_most_viewed_titles(server, library_video, monkeypatch):
+    paths = [library_video(f'warm{number}.mp4') for number in range(3)]
+    with open(os.path.join(STATE_DIR, 'videos.json'), 'w', encoding='utf-8') as f:
+        json.dump([{"id": f"w{number}", "title": f"Warm {number}", "filename": f"warm{number}.mp4",
+                    "root": "test", "path": f"warm{number}.mp4"} for number in range(3)], f)
+    server.metadata_store.record_views({os.path.abspath(paths[2]): 1000})
+    monkeypatch.setattr(server, 'WARM_TITLES', 1)
+    monkeypatch.setattr(server, 'warm_state',
+                        {"ready": False, "started": time.monotonic(), "seconds": None, "titles": 0})
+
+    server.warm_up()
+
+    assert server.warm_state["ready"] and server.warm_state["titles"] == 1
+    assert len(server.catalog.snapshot().videos) == 3
+    assert is_cached(server, paths[2])
+    assert not is_cached(server, paths[0])
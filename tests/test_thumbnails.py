@@ -0,0 +1,43 @@
+import os
+import json
+
+import pytest
+
+import config
+import thumbnails
+
+
+@pytest.fixture
+def fake_rendering(monkeypatch):
+    """Replaces the ffprobe/ffmpeg steps; each video gets images named after its directory."""
+    monkeypatch.setattr(thumbnails, 'probe_video', lambda path, with_keyframes: {"duration": 10})
+    monkeypatch.setattr(thumbnails, 'generate_posters', lambda path, info, work_dir, output_dir: {
+        "320": {"jpg": f"poster-{os.path.basename(os.path.dirname(path))}.jpg"}})
+    monkeypatch.setattr(thumbnails, 'generate_sprites', lambda path, info, work_dir, output_dir:
+                        f"thumbnails-{os.path.basename(os.path.dirname(path))}.vtt")
+
+
+def test_same_file_name_in_two_roots_keeps_both_entries(tmp_path, monkeypatch, fake_rendering):
+    roots = {'a': tmp_path / 'a', 'b': tmp_path / 'b'}
+    monkeypatch.setattr(config, 'LIBRARY_ROOTS', {name: str(path) for name, path in roots.items()})
+    manifest_file = tmp_path / 'manifest.json'
+    for path in roots.values():
+        path.mkdir()
+        (path / 'movie.mp4').write_bytes(b'video')
+        assert thumbnails.generate_thumbnails(str(path / 'movie.mp4'), str(tmp_path / 'out'),
+                                              str(manifest_file))
+
+    manifest = json.loads(manifest_file.read_text())
+    assert set(manifest) == {'a/movie.mp4', 'b/movie.mp4'}
+    assert manifest['a/movie.mp4']["sprites_vtt"] == 'thumbnails-a.vtt'
+    assert manifest['b/movie.mp4']["sprites_vtt"] == 'thumbnails-b.vtt'
+
+
+def test_missing_video_or_unwritable_manifest_is_reported_not_raised(tmp_path, fake_rendering):
+    assert thumbnails.generate_thumbnails(str(tmp_path / 'gone.mp4'), str(tmp_path / 'out'),
+                                          str(tmp_path / 'manifest.json')) is False
+
+    video = tmp_path / 'movie.mp4'
+    video.write_bytes(b'video')
+    assert thumbnails.generate_thumbnails(str(video), str(tmp_path / 'out'),
+                                          str(tmp_path / 'missing-dir' / 'manifest.json')) is False
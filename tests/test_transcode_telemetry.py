@@ -0,0 +1,61 @@
+import io
+import json
+
+from metrics import Registry
+from transcode_telemetry import TranscodeTelemetry, iter_progress_blocks, parse_progress
+
+PROGRESS = """\
+frame=120
+fps=48.00
+bitrate=1500.5kbits/s
+total_size=1048576
+out_time_us=5000000
+speed=2.01x
+progress=continue
+frame=240
+fps=N/A
+bitrate=N/A
+out_time_ms=10000000
+speed=N/A
+progress=end
+"""
+
+
+def test_iter_progress_blocks_yields_one_report_per_progress_line():
+    blocks = list(iter_progress_blocks(io.StringIO("garbage\n" + PROGRESS + "frame=1\n")))
+    assert [block['progress'] for block in blocks] == ['continue', 'end']
+    assert blocks[0]['frame'] == '120' and blocks[1]['frame'] == '240'
+
+
+def test_parse_progress():
+    first, last = (parse_progress(block) for block in iter_progress_blocks(io.StringIO(PROGRESS)))
+    assert first == {"frame": 120, "fps": 48.0, "bitrate_kbps": 1500.5, "total_size": 1048576,
+                     "out_time": 5.0, "speed": 2.01, "dup_frames": None, "drop_frames": None,
+                     "done": False}
+    assert last["out_time"] == 10.0  # out_time_ms is in microseconds too
+    assert last["fps"] is None and last["speed"] is None and last["done"] is True
+
+
+def test_jobs_with_the_same_name_are_tracked_separately(tmp_path):
+    telemetry = TranscodeTelemetry(event_interval=0, registry=Registry())
+    events = tmp_path / 'events.jsonl'
+    telemetry.open_log(str(events))
+    first = telemetry.start_job('work/concat.txt', duration=20)
+    second = telemetry.start_job('work/concat.txt', duration=40)
+    assert first.id != second.id
+
+    first.update({"out_time_us": "10000000", "speed": "1x", "progress": "continue"})
+    second.update({"out_time_us": "10000000", "speed": "3x", "progress": "continue"})
+    assert telemetry.progress.get(job=first.id) == 0.5
+    assert telemetry.progress.get(job=second.id) == 0.25
+
+    first.finish(True)
+    assert telemetry.speed.get(job=second.id) == 3.0  # Still reported
+    assert telemetry.aggregate()["active_jobs"] == 1
+    second.finish(False)
+    assert telemetry.aggregate()["active_jobs"] == 0
+
+    ended = [json.loads(line) for line in events.read_text().splitlines()
+             if '"job_end"' in line]
+    assert [(event["job"], event["result"]) for event in ended] == [
+        (first.id, 'ok'), (second.id, 'failed')]
@@ -0,0 +1,200 @@
+import os
+import json
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+from chunk_cache import CachedRangeIterator
+from mp4_index import gop_range
+from streaming import StreamFile
+
+
+def get(client, path, **headers):
+    with client.get(path, headers=headers) as response:
+        return response.status_code, response.headers, response.get_data()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_full_and_range_requests(client, server, library_video):
+    data = read(library_video('ranges.mp4'))
+    size = len(data)
+
+    status, headers, body = get(client, '/video/ranges.mp4')
+    assert (status, body) == (200, data)
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert int(headers['Content-Length']) == size
+
+    status, headers, body = get(client, '/video/ranges.mp4', Range='bytes=0-99')
+    assert (status, body) == (206, data[:100])
+    assert headers['Content-Range'] == f'bytes 0-99/{size}'
+
+    assert get(client, '/video/ranges.mp4', Range='bytes=-500')[2] == data[-500:]
+    assert get(client, '/video/ranges.mp4', Range='bytes=100-')[2] == data[100:]
+
+    # Invalid ranges are ignored, unsatisfiable ones get 416
+    assert get(client, '/video/ranges.mp4', Range='bytes=5-1')[:1] == (200,)
+    status, headers, _ = get(client, '/video/ranges.mp4', Range=f'bytes={size}-')
+    assert status == 416
+    assert headers['Content-Range'] == f'bytes */{size}'
+
+    status, headers, body = get(client, '/video/ranges.mp4', Range='bytes=0-9,100-109')
+    assert status == 206
+    assert headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    assert int(headers['Content-Length']) == len(body)
+    assert data[:10] in body and data[100:110] in body
+
+    assert server.stream_limiter.active == 0
+
+
+def test_conditional_requests(client, library_video):
+    data = read(library_video('conditional.mp4'))
+    etag = get(client, '/video/conditional.mp4')[1]['ETag']
+
+    assert get(client, '/video/conditional.mp4', **{'If-None-Match': etag})[0] == 304
+    assert get(client, '/video/conditional.mp4', **{'If-Match': '"other"'})[0] == 412
+    # If-Range: ranges only apply to the version the client has
+    assert get(client, '/video/conditional.mp4', Range='bytes=0-9',
+               **{'If-Range': etag})[:3:2] == (206, data[:10])
+    assert get(client, '/video/conditional.mp4', Range='bytes=0-9',
+               **{'If-Range': '"other"'})[:3:2] == (200, data)
+
+
+def test_unindexable_video_is_served_every_time(client, library_video):
+    data = read(library_video('audio-only.mp4', handler=b'soun'))
+    for _ in range(2):
+        assert get(client, '/video/audio-only.mp4')[:3:2] == (200, data)
+        assert get(client, '/video/audio-only.mp4', Range='bytes=0-99')[:3:2] == (206, data[:100])
+        assert get(client, '/video/audio-only.mp4', Range='bytes=-500')[:3:2] == (206, data[-500:])
+        assert get(client, '/video/audio-only.mp4', Range='bytes=5-1')[0] == 200
+        assert get(client, '/video_index/audio-only.mp4')[0] == 422
+        assert get(client, '/video_index/audio-only.mp4?t=3')[0] == 422
+
+
+@pytest.mark.parametrize('table', [b'stsz', b'stco'])
+def test_video_with_truncated_sample_table_is_served(client, library_video, monkeypatch, table):
+    import metadata_store
+    builds = []
+    build_index = metadata_store.build_index
+    monkeypatch.setattr(metadata_store, 'build_index', lambda path: builds.append(path) or build_index(path))
+
+    filename = f'truncated-{table.decode()}.mp4'
+    data = read(library_video(filename, truncate=table))
+    for _ in range(2):
+        assert get(client, f'/video/{filename}')[:3:2] == (200, data)
+        assert get(client, f'/video/{filename}', Range='bytes=0-')[:3:2] == (206, data)
+        assert get(client, f'/video/{filename}', Range='bytes=100-200')[:3:2] == (206, data[100:201])
+        assert get(client, f'/video_index/{filename}')[0] == 422
+    assert len(builds) == 1  # Remembered as unindexable rather than parsed again
+
+
+def test_moov_at_end(client, library_video):
+    data = read(library_video('moov-last.mp4', faststart=False))
+    assert get(client, '/video/moov-last.mp4', Range='bytes=-2000')[2] == data[-2000:]
+    assert get(client, '/video/moov-last.mp4')[2] == data
+
+
+def test_video_index(client, library_video):
+    library_video('indexed.mp4', samples=30, gop=10, fps=10)
+    status, _, body = get(client, '/video_index/indexed.mp4')
+    assert status == 200
+    index = json.loads(body)
+    assert index["keyframe_times"] == [0.0, 1.0, 2.0]
+
+    status, headers, body = get(client, '/video_index/indexed.mp4?t=1.5')
+    plan = json.loads(body)
+    assert plan["time"] == 1.0
+    assert plan["start"] == index["keyframe_offsets"][1]
+    assert get(client, '/video_index/indexed.mp4?t=1.5', **{'If-None-Match': headers['ETag']})[0] == 304
+
+    # The tag follows the keyframe the seek resolves to, not the spelling of t
+    assert get(client, '/video_index/indexed.mp4?t=1.50')[1]['ETag'] == headers['ETag']
+    assert get(client, '/video_index/indexed.mp4?t=1.9')[1]['ETag'] == headers['ETag']
+    assert get(client, '/video_index/indexed.mp4?t=2.5')[1]['ETag'] != headers['ETag']
+    assert get(client, '/video_index/indexed.mp4?t=1.50',
+               **{'If-None-Match': f'"other", {headers["ETag"]}'})[0] == 304
+    # Entity tags are compared whole, not as substrings of the header
+    assert get(client, '/video_index/indexed.mp4?t=1.5',
+               **{'If-None-Match': f'"x{headers["ETag"][1:]}'})[0] == 200
+
+
+def test_missing_and_unsupported(client):
+    assert get(client, '/video/missing.mp4')[0] == 404
+    assert get(client, '/video/notes.txt')[0] == 415
+
+
+def stream_body(server, path, range_header=None, file_wrapper=FileWrapper):
+    """The body build_stream_response picks for a request (closed by the caller)."""
+    headers = {'Range': range_header} if range_header else {}
+    environ = {'wsgi.file_wrapper': file_wrapper} if file_wrapper else {}
+    with server.create_app().test_request_context(
+            f'/video/{os.path.basename(path)}', headers=headers, environ_overrides=environ):
+        return server.build_stream_response(StreamFile(path)).response
+
+
+@pytest.fixture
+def large_video(library_video):
+    # 10 MB: larger than the cached head (CHUNK_CACHE_MAX_OFFSET)
+    return library_video('large.mp4', samples=100, sample_size=100_000)
+
+
+@pytest.mark.parametrize('range_header, from_cache', [
+    (None, False),
+    ('bytes=0-', False),
+    ('bytes=0-65535', True),      # moov probe: inside the cached head
+    ('bytes=5000000-', False),    # seek
+    ('bytes=-5000000', False),    # tail spanning several GOPs
+])
+def test_file_wrapper_unless_range_is_cached(server, large_video, range_header, from_cache):
+    body = stream_body(server, large_video, range_header)
+    try:
+        assert isinstance(body, CachedRangeIterator if from_cache else FileWrapper)
+    finally:
+        body.close()
+
+
+def test_moov_at_end_is_served_from_cache(server, library_video):
+    path = library_video('moov-last-large.mp4', samples=100, sample_size=100_000, faststart=False)
+    moov_size = os.path.getsize(path) - 8 - 100 * 100_000 - 32  # ftyp, mdat header, media
+    body = stream_body(server, path, f'bytes=-{moov_size}')
+    try:
+        assert isinstance(body, CachedRangeIterator)
+    finally:
+        body.close()
+
+
+def test_cache_without_file_wrapper(server, large_video):
+    # Iterated in Python anyway: the head comes from the cache, the rest from disk
+    body = stream_body(server, large_video, 'bytes=0-', file_wrapper=None)
+    try:
+        assert isinstance(body, CachedRangeIterator)
+        assert b''.join(body) == read(large_video)
+    finally:
+        body.close()
+
+
+def test_seek_within_one_gop_is_served_from_cache(server, library_video):
+    path = library_video('gops.mp4', samples=100, sample_size=100_000, gop=5)
+    index = server.metadata_store.get_mp4_index(path)
+    # The last but one group of pictures: beyond the cached head, not the end of the file
+    gop_start, gop_end = gop_range(index, index["keyframe_offsets"][-2])
+    assert gop_start > server.CHUNK_CACHE_MAX_OFFSET
+
+    # What /video_index?t= plans: exactly one group of pictures
+    body = stream_body(server, path, f'bytes={gop_start}-{gop_end - 1}')
+    try:
+        assert isinstance(body, CachedRangeIterator)
+        assert body.regions[-1] == (gop_start, gop_end)
+    finally:
+        body.close()
+
+    # Open-ended seeks go to disk, with or without a file wrapper
+    for file_wrapper in (FileWrapper, None):
+        body = stream_body(server, path, f'bytes={gop_start}-', file_wrapper=file_wrapper)
+        try:
+            assert not isinstance(body, CachedRangeIterator)
+        finally:
+            body.close()
@@ -0,0 +1,89 @@
+import time
+import threading
+
+import pytest
+
+import watcher
+from job_queue import JobQueue
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_change_tracker_waits_for_the_file_to_settle(tmp_path):
+    tracker = watcher.ChangeTracker(settle=0.1)
+    path = str(tmp_path / 'movie.mkv')
+    with open(path, 'wb') as f:
+        f.write(b'part')
+    tracker.touch(path)
+    assert tracker.ready() == []  # Too recent
+
+    time.sleep(0.15)
+    with open(path, 'ab') as f:
+        f.write(b' more')  # Still being copied: its size moved since the touch
+    assert tracker.ready() == []
+
+    time.sleep(0.15)
+    assert tracker.ready() == [path]
+    assert tracker.ready() == []  # Reported once
+
+
+def test_change_tracker_reports_deleted_files(tmp_path):
+    tracker = watcher.ChangeTracker(settle=0)
+    path = str(tmp_path / 'gone.mkv')
+    tracker.touch(path)
+    assert tracker.ready() == [path]
+
+
+def test_directory_poller_reports_new_changed_and_removed_files(tmp_path):
+    seen = []
+    poller = watcher.DirectoryPoller([str(tmp_path)], seen.append, interval=0.02)
+    poller.start()
+    try:
+        path = tmp_path / 'sub' / 'movie.mkv'
+        path.parent.mkdir()
+        path.write_bytes(b'a')
+        assert wait_for(lambda: str(path) in seen)
+
+        seen.clear()
+        path.write_bytes(b'longer')
+        assert wait_for(lambda: str(path) in seen)
+
+        seen.clear()
+        path.unlink()
+        assert wait_for(lambda: str(path) in seen)
+    finally:
+        poller.stop()
+
+
+@pytest.fixture
+def library_watcher(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher, 'JobQueue', lambda: JobQueue(str(tmp_path / 'jobs.db')))
+    return watcher.LibraryWatcher(use_polling=True, settle=0, reload_url='',
+                                  catalog_json=str(tmp_path / 'videos.json'))
+
+
+def test_conversion_loop_survives_a_failed_run(library_watcher, monkeypatch, capsys):
+    runs = []
+    second_run = threading.Event()
+
+    def run_conversions(*args, **kwargs):
+        runs.append(args)
+        if len(runs) == 1:
+            raise RuntimeError("disk on fire")
+        second_run.set()
+
+    monkeypatch.setattr(watcher, 'run_conversions', run_conversions)
+    monkeypatch.setattr(watcher, 'QUEUE_CHECK_INTERVAL', 0.01)
+    monkeypatch.setattr(library_watcher.queue, 'seconds_until_next', lambda mode: 0)
+    threading.Thread(target=library_watcher._conversion_loop, daemon=True).start()
+
+    assert second_run.wait(2)
+    error = capsys.readouterr().err
+    assert "Conversion run failed" in error and "RuntimeError: disk on fire" in error